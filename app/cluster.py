@@ -0,0 +1,346 @@
+# Multi-worker deployment: a gateway in front of N detection worker processes.
+# Usage: python -m app.cluster --workers 4 --host 0.0.0.0 --port 8000
+#
+# Each worker keeps the sliding windows of its IPs in process memory, so every
+# log entry is routed to a worker by consistent hashing on its ip_address. All
+# entries of an IP are then seen by the same worker, in order, and the features
+# are the same as with a single process.
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import asynccontextmanager
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect
+from config import (
+    CLUSTER_WORKERS, CLUSTER_HASH_REPLICAS, CLUSTER_WORKER_STARTUP_TIMEOUT_SECONDS,
+    DETECT_COALESCE_MAX_BATCH_SIZE, STREAM_MAX_IN_FLIGHT,
+)
+from app.services.streaming import DuplexStreamingResponse, iter_lines, line_too_long_error
+from core.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+# Sent to every worker: each one holds its own copy of the models
+BROADCAST_PATHS = ('/outlier/reload_models',)
+PROXY_METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto nodes, with replicas virtual points per
+    node. crc32 is used rather than hash(), which differs between processes.
+    """
+    def __init__(self, nodes: list, replicas: int = CLUSTER_HASH_REPLICAS):
+        points = sorted(
+            (zlib.crc32(f"{node}#{replica}".encode()), node)
+            for node in nodes for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str):
+        position = bisect.bisect(self._hashes, zlib.crc32(key.encode())) % len(self._hashes)
+        return self._nodes[position]
+
+
+def _parse_entries(body: bytes, content_type: str):
+    """
+    Parses a /detect_batch body into a list of dicts, or returns None when it
+    is not a list of entries with an ip_address; the worker then reports the error.
+    """
+    try:
+        if content_type.split(';')[0].strip() in NDJSON_CONTENT_TYPES:
+            entries = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            entries = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(entries, list) or not all(isinstance(e, dict) and isinstance(e.get('ip_address'), str) for e in entries):
+        return None
+    return entries
+
+
+def _merge_metrics(texts: list) -> str:
+    """
+    Merges the Prometheus text output of the workers into one exposition,
+    adding a worker label to every sample. Samples of a metric family stay
+    together under a single HELP/TYPE header.
+    """
+    headers, samples = {}, {}
+    for worker, text in enumerate(texts):
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# HELP '):
+                family = line.split(' ', 3)[2]
+                headers.setdefault(family, []).append(line)
+                samples.setdefault(family, [])
+            elif line.startswith('# TYPE '):
+                if len(headers[family]) < 2:
+                    headers[family].append(line)
+            elif line and family is not None:
+                # Label values may contain spaces, the sample value cannot
+                series, _, value = line.rpartition(' ')
+                if '{' in series:
+                    series = series.replace('{', f'{{worker="{worker}",', 1)
+                else:
+                    series = f'{series}{{worker="{worker}"}}'
+                samples[family].append(f'{series} {value}')
+    return ''.join('\n'.join(headers[family][:2] + samples[family]) + '\n' for family in headers)
+
+
+def _to_response(response: httpx.Response) -> Response:
+    return Response(content=response.content, status_code=response.status_code,
+                    media_type=response.headers.get('content-type'))
+
+
+def create_gateway(worker_transports: list, replicas: int = CLUSTER_HASH_REPLICAS) -> FastAPI:
+    """
+    Returns the gateway app for the given workers, one httpx transport each
+    (a unix socket transport for worker processes).
+    """
+    clients = []
+    ring = HashRing(list(range(len(worker_transports))), replicas)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        for transport in worker_transports:
+            clients.append(httpx.AsyncClient(transport=transport, base_url='http://worker', timeout=None))
+        yield
+        for client in clients:
+            await client.aclose()
+
+    gateway = FastAPI(title="Outlier Detector API (gateway)", lifespan=lifespan)
+
+    async def forward(worker: int, request: Request, content: bytes = None, headers: dict = None) -> httpx.Response:
+        return await clients[worker].request(
+            request.method, request.url.path, params=request.query_params,
+            content=await request.body() if content is None else content,
+            headers=headers or {'content-type': request.headers.get('content-type', 'application/json')},
+        )
+
+    @gateway.post("/outlier/detect")
+    async def detect(request: Request):
+        try:
+            worker = ring.node_for(json.loads(await request.body())['ip_address'])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            worker = 0  # Let a worker reject the invalid entry
+        return _to_response(await forward(worker, request))
+
+    @gateway.post("/outlier/detect_batch")
+    async def detect_batch(request: Request):
+        entries = _parse_entries(await request.body(), request.headers.get('content-type', ''))
+        if not entries:
+            return _to_response(await forward(0, request))
+
+        positions_per_worker = {}
+        for position, entry in enumerate(entries):
+            positions_per_worker.setdefault(ring.node_for(entry['ip_address']), []).append(position)
+        workers = list(positions_per_worker)
+        responses = await asyncio.gather(*(
+            forward(worker, request, content=json.dumps([entries[p] for p in positions_per_worker[worker]]).encode(),
+                    headers={'content-type': 'application/json'})
+            for worker in workers
+        ))
+        for response in responses:
+            if response.status_code != 200:
+                return _to_response(response)
+
+        # Put the results back in the order of the input entries
+        results = [None] * len(entries)
+        for worker, response in zip(workers, responses):
+            for position, result in zip(positions_per_worker[worker], response.json()['results']):
+                results[position] = result
+        return {**responses[0].json(), "results": results}
+
+    async def detect_lines(batch: list, params) -> list:
+        """
+        Scores (line_number, line) pairs of a stream on the workers of their
+        IPs, through the workers' /outlier/detect_stream with the client's
+        query parameters, and returns the results in order.
+        """
+        results = [None] * len(batch)
+        positions_per_worker = {}
+        for position, (line_number, line) in enumerate(batch):
+            if line is None:
+                results[position] = line_too_long_error(line_number)
+                continue
+            try:
+                worker = ring.node_for(json.loads(line)['ip_address'])
+            except (ValueError, KeyError, TypeError, AttributeError):
+                worker = 0  # Let a worker reject the invalid line
+            positions_per_worker.setdefault(worker, []).append(position)
+
+        workers = list(positions_per_worker)
+        responses = await asyncio.gather(*(
+            clients[worker].post('/outlier/detect_stream', params=params, headers={'content-type': 'application/x-ndjson'},
+                                 content=b''.join(batch[p][1] + b'\n' for p in positions_per_worker[worker]))
+            for worker in workers
+        ))
+        for worker, response in zip(workers, responses):
+            response.raise_for_status()
+            for position, line in zip(positions_per_worker[worker], response.text.splitlines()):
+                result = json.loads(line)
+                if 'line' in result:
+                    # Number the line within the client's stream, not the sub-request
+                    result['line'] = batch[position][0]
+                results[position] = result
+        return results
+
+    async def stream_through_workers(chunks, params):
+        """
+        Gateway side of the streaming endpoints: reads NDJSON lines, scores
+        the lines read so far as one batch split over the workers, and yields
+        the results in order. Reading stays at most STREAM_MAX_IN_FLIGHT lines
+        ahead of the results.
+        """
+        lines = asyncio.Queue(maxsize=STREAM_MAX_IN_FLIGHT)
+
+        async def read():
+            try:
+                line_number = 0
+                async for line in iter_lines(chunks):
+                    line_number += 1
+                    if line is not None and not line.strip():
+                        continue
+                    await lines.put((line_number, line))
+            finally:
+                await lines.put(None)
+
+        reader = asyncio.create_task(read())
+        try:
+            finished = False
+            while not finished:
+                batch = [await lines.get()]
+                while len(batch) < DETECT_COALESCE_MAX_BATCH_SIZE and not lines.empty():
+                    batch.append(lines.get_nowait())
+                if batch[-1] is None:
+                    finished = True
+                    batch.pop()
+                for result in await detect_lines(batch, params):
+                    yield result
+            await reader
+        finally:
+            reader.cancel()
+
+    @gateway.post("/outlier/detect_stream")
+    async def detect_stream(request: Request):
+        async def results():
+            async for result in stream_through_workers(request.stream(), request.query_params):
+                yield json.dumps(result) + '\n'
+        return DuplexStreamingResponse(results(), media_type='application/x-ndjson')
+
+    @gateway.websocket("/outlier/detect_ws")
+    async def detect_websocket(websocket: WebSocket):
+        await websocket.accept()
+
+        async def messages():
+            try:
+                while True:
+                    yield await websocket.receive_text() + '\n'
+            except WebSocketDisconnect:
+                return
+
+        try:
+            async for result in stream_through_workers(messages(), websocket.query_params):
+                await websocket.send_text(json.dumps(result))
+        except WebSocketDisconnect:
+            pass
+
+    @gateway.get("/metrics")
+    async def metrics():
+        responses = await asyncio.gather(*(client.get('/metrics') for client in clients))
+        return Response(_merge_metrics([response.text for response in responses]), media_type=METRICS_CONTENT_TYPE)
+
+    @gateway.post("/outlier/rollback_models")
+    async def rollback_models(request: Request):
+        # The first worker moves the registry's CURRENT pointer; the others load that version
+        response = await forward(0, request)
+        if response.status_code == 200:
+            params = {**request.query_params, 'version': response.json()['model_version']}
+            await asyncio.gather(*(
+                client.post('/outlier/reload_models', params=params) for client in clients[1:]
+            ))
+        return _to_response(response)
+
+    @gateway.api_route("/{path:path}", methods=PROXY_METHODS)
+    async def proxy(path: str, request: Request):
+        if request.url.path in BROADCAST_PATHS:
+            responses = await asyncio.gather(*(forward(worker, request) for worker in range(len(clients))))
+            failed = [response for response in responses if response.status_code != 200]
+            return _to_response(failed[0] if failed else responses[0])
+        return _to_response(await forward(0, request))
+
+    return gateway
+
+
+def _wait_until_ready(socket_paths: list, processes: list, timeout: float):
+    deadline = time.monotonic() + timeout
+    for path, process in zip(socket_paths, processes):
+        with httpx.Client(transport=httpx.HTTPTransport(uds=path), base_url='http://worker') as client:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Worker on {path} exited with code {process.returncode}.")
+                try:
+                    client.get('/').raise_for_status()
+                    break
+                except httpx.TransportError:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"Worker on {path} did not start within {timeout}s.")
+                    time.sleep(0.2)
+
+
+def start_workers(workers: int, socket_dir: str, app: str = 'app.main:app') -> tuple:
+    """
+    Starts the detection workers, each serving app on its own unix socket, and
+    waits until they all serve requests. Returns the socket paths and processes.
+    """
+    socket_paths = [os.path.join(socket_dir, f'worker-{worker}.sock') for worker in range(workers)]
+    processes = [
+        subprocess.Popen([sys.executable, '-m', 'uvicorn', app, '--uds', path, '--log-level', 'warning'])
+        for path in socket_paths
+    ]
+    try:
+        _wait_until_ready(socket_paths, processes, CLUSTER_WORKER_STARTUP_TIMEOUT_SECONDS)
+    except Exception:
+        stop_workers(processes)
+        raise
+    return socket_paths, processes
+
+
+def stop_workers(processes: list):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the detection service as a gateway in front of worker processes.")
+    parser.add_argument('--workers', type=int, default=CLUSTER_WORKERS)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--app', default='app.main:app',
+                        help="App served by the workers; app.inference:app starts faster but serves only /outlier")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='outlier-detector-') as socket_dir:
+        print(f"Starting {args.workers} detection worker(s)...")
+        socket_paths, processes = start_workers(args.workers, socket_dir, args.app)
+        try:
+            transports = [httpx.AsyncHTTPTransport(uds=path) for path in socket_paths]
+            uvicorn.run(create_gateway(transports), host=args.host, port=args.port)
+        finally:
+            stop_workers(processes)
+
+if __name__ == '__main__':
+    main()
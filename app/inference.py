@@ -0,0 +1,23 @@
+# Inference-only entry point. Serves the detection endpoints and /metrics without the
+# data generation, feature and training routers, so starting it imports neither
+# PyCaret nor the Airflow task modules nor requests; models are loaded from their
+# fast inference artifacts. Run with: uvicorn app.inference:app
+from fastapi import FastAPI
+from app.services import monitoring, outlier_detector
+
+app = FastAPI(
+    title="Outlier Detector Inference API",
+    description="Real-time outlier detection on log entries.",
+    version="1.0.0",
+    lifespan=outlier_detector.lifespan
+)
+
+app.include_router(outlier_detector.router, prefix="/outlier", tags=["Outlier Detection"])
+app.include_router(monitoring.router, tags=["Root"])
+
+@app.get("/", tags=["Root"])
+def read_root():
+    """
+    Root endpoint for the API.
+    """
+    return {"message": "Welcome to the Outlier Detector Inference API"}
@@ -1,16 +1,20 @@
 from fastapi import APIRouter
+from core.log import get_logger
 from dags.tasks.processing import process_log_data_from_db
 
 router = APIRouter()
+logger = get_logger('data_processor')
 
 @router.post("/generate_features")
-def generate_features():
+def generate_features(full_rebuild: bool = False):
     """
-    Triggers the feature generation process on-demand.
+    Triggers the feature generation process on-demand. By default only logs
+    newer than the last run are processed; pass full_rebuild=true to
+    recompute the whole 'features' table.
     """
     try:
-        print("On-demand feature generation triggered via API.")
-        process_log_data_from_db()
+        logger.info("On-demand feature generation triggered via API")
+        process_log_data_from_db(full_rebuild=full_rebuild)
         return {"status": "success", "message": "Feature generation task completed successfully."}
     except Exception as e:
         return {"status": "error", "message": f"An error occurred during feature generation: {e}"}
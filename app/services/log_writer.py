@@ -0,0 +1,190 @@
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+from config import (
+    LOG_WRITER_BATCH_SIZE, LOG_WRITER_FLUSH_INTERVAL_SECONDS,
+    LOG_WRITER_MAX_PENDING_ROWS, LOG_WRITER_ENQUEUE_TIMEOUT_SECONDS, LOG_WRITER_MAX_RETRIES,
+)
+from core.db import get_engine
+from core.log import get_logger
+from core.metrics import LATENCY_BUCKETS, Counter, Gauge, Histogram
+
+logger = get_logger('log_writer')
+
+LOG_WRITER_WRITE_SECONDS = Histogram('outlier_log_writer_write_seconds', 'Time to insert one batch of log rows.', buckets=LATENCY_BUCKETS)
+LOG_WRITER_ROWS = Counter('outlier_log_writer_rows_total', 'Log rows written to or dropped from the logs table.', ['outcome'])
+LOG_WRITER_PENDING_ROWS = Gauge('outlier_log_writer_pending_rows', 'Log rows waiting to be written.')
+LOG_WRITER_ERRORS = Counter('outlier_log_writer_errors_total', 'Failed attempts of the writer thread to write a batch; the batch is retried.')
+
+# qmark parameters go straight to the sqlite3 driver's executemany.
+INSERT_LOGS_SQL = "INSERT INTO logs (timestamp, ip_address, service_endpoint, http_response_code) VALUES (?, ?, ?, ?)"
+
+class LogWriterFull(Exception):
+    """
+    Raised when the pending rows did not drain below the limit in time.
+    """
+
+class LogWriter:
+    """
+    Write-behind ingestion for the 'logs' table.
+
+    Callers hand over rows and return immediately; a background thread writes
+    them with executemany, one transaction per batch, once batch_size rows are
+    pending or flush_interval seconds have passed. The number of pending rows is
+    bounded: submit() blocks while the buffer is full, and gives up with
+    LogWriterFull after enqueue_timeout seconds. A batch that cannot be written
+    goes back to the front of the buffer and is retried with backoff; rows are
+    only dropped when the writer is stopping and keeps failing.
+    """
+    def __init__(self, engine_factory=get_engine, batch_size=LOG_WRITER_BATCH_SIZE,
+                 flush_interval=LOG_WRITER_FLUSH_INTERVAL_SECONDS, max_pending_rows=LOG_WRITER_MAX_PENDING_ROWS,
+                 enqueue_timeout=LOG_WRITER_ENQUEUE_TIMEOUT_SECONDS, max_retries=LOG_WRITER_MAX_RETRIES):
+        self.engine_factory = engine_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending_rows = max_pending_rows
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self._pending = []
+        self._reserved = 0
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._atexit_registered = False
+
+    def submit(self, rows: list, reserved: bool = False):
+        """
+        Queues (timestamp, ip_address, service_endpoint, http_response_code)
+        tuples for insertion. Timestamps must already be formatted for the table.
+        With reserved, the rows use the room held by an enclosing reserve()
+        block and the call never blocks.
+        """
+        if not rows:
+            return
+        with self._condition:
+            self._ensure_started()
+            if not reserved:
+                self._wait_for_room(len(rows))
+            self._pending.extend(rows)
+            LOG_WRITER_PENDING_ROWS.set(len(self._pending))
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, num_rows: int):
+        """
+        Waits for room for num_rows rows like submit() does, raising
+        LogWriterFull on timeout, and holds it until the block exits. Callers
+        that must not wait while holding a lock reserve before taking it, then
+        submit(rows, reserved=True) under the lock.
+        """
+        with self._condition:
+            self._ensure_started()
+            self._wait_for_room(num_rows)
+            self._reserved += num_rows
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._reserved -= num_rows
+                self._condition.notify_all()
+
+    def _wait_for_room(self, num_rows: int):
+        # Called with self._condition held. A batch larger than the whole buffer
+        # is still accepted once the buffer is empty.
+        deadline = time.monotonic() + self.enqueue_timeout
+        while (self._pending or self._reserved) and len(self._pending) + self._reserved + num_rows > self.max_pending_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LogWriterFull(f"{len(self._pending)} log rows are waiting to be written.")
+            self._condition.wait(remaining)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Blocks until every row submitted so far has been written. Returns False on timeout.
+        """
+        with self._condition:
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+    def stop(self, timeout: float = None):
+        """
+        Writes the remaining rows and stops the background thread.
+        """
+        with self._condition:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._condition.notify_all()
+            thread = self._thread
+        thread.join(timeout)
+        with self._condition:
+            self._thread = None
+            self._stopping = False
+
+    def _ensure_started(self):
+        # Called with self._condition held
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def _run(self):
+        # The engine is created on the first batch, and again after a failure
+        engine = None
+        failures = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._pending) >= self.batch_size or self._stopping, self.flush_interval)
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                self._in_flight = len(batch)
+                LOG_WRITER_PENDING_ROWS.set(len(self._pending))
+                stopping = self._stopping
+                # Room was freed for blocked submitters
+                self._condition.notify_all()
+
+            try:
+                if batch:
+                    if engine is None:
+                        engine = self.engine_factory()
+                    self._write(engine, batch)
+                failures = 0
+            except Exception as e:
+                engine = None
+                failures += 1
+                LOG_WRITER_ERRORS.inc()
+                logger.error("Log writer failed, retrying", extra={'rows': len(batch), 'failures': failures, 'error': str(e)})
+                with self._condition:
+                    # Put the batch back in front, so its rows are written once the writer recovers
+                    self._pending[:0] = batch
+                    LOG_WRITER_PENDING_ROWS.set(len(self._pending))
+                    if stopping and failures >= self.max_retries:
+                        self._drop_pending()
+                time.sleep(min(self.flush_interval * 2 ** (failures - 1), 5))
+
+            with self._condition:
+                self._in_flight = 0
+                self._condition.notify_all()
+                if stopping and not self._pending:
+                    return
+
+    def _drop_pending(self):
+        # Called with self._condition held, when stopping and the writer keeps failing
+        LOG_WRITER_ROWS.labels(outcome='dropped').inc(len(self._pending))
+        logger.error("Dropping log rows, the writer is stopping and keeps failing", extra={'rows': len(self._pending)})
+        self._pending.clear()
+        LOG_WRITER_PENDING_ROWS.set(0)
+
+    def _write(self, engine, batch: list):
+        # Raises on failure; _run puts the batch back and retries it
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            connection.exec_driver_sql(INSERT_LOGS_SQL, batch)
+        LOG_WRITER_WRITE_SECONDS.observe(time.perf_counter() - start)
+        LOG_WRITER_ROWS.labels(outcome='written').inc(len(batch))
@@ -1,8 +1,10 @@
 from fastapi import APIRouter
 from dags.tasks.training import train_outlier_models
 from config import MODELS_TO_TRAIN
+from core.log import get_logger
 
 router = APIRouter()
+logger = get_logger('model_trainer')
 
 class ModelTrainer:
     """
@@ -12,9 +14,9 @@ class ModelTrainer:
         """
         Calls the centralized training function.
         """
-        print("On-demand model training triggered via API.")
+        logger.info("On-demand model training triggered via API")
         train_outlier_models(model_names=MODELS_TO_TRAIN)
-        print("On-demand training process finished.")
+        logger.info("On-demand training process finished")
 
 @router.post("/train_models")
 def trigger_model_training():
@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Response
+from core.metrics import CONTENT_TYPE, REGISTRY, generate_latest
+
+router = APIRouter()
+
+@router.get("/metrics")
+def metrics():
+    """
+    Service metrics, and those of the pipeline runs started from this process,
+    in Prometheus text format.
+    """
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE)
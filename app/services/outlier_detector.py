@@ -1,47 +1,288 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from datetime import datetime
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
-from pycaret.anomaly import load_model, predict_model
-from config import DB_URI, FEATURE_WINDOW_INTERVAL, MODELS_TO_TRAIN
+from sqlalchemy import text
+from config import (
+    DB_URI, FEATURE_WINDOW_INTERVAL, MODELS_TO_TRAIN, FAST_INFERENCE_ENABLED, LOOKUP_TABLE_ENABLED,
+    STREAM_MAX_IN_FLIGHT, STORAGE_BACKEND, ENSEMBLE_EARLY_EXIT, ENSEMBLE_COST_PROBE_ROWS, ENSEMBLE_COST_PROBE_REPEATS,
+)
 from cachetools import TTLCache
+from core import registry
+from core.db import get_engine
+from core.log import get_logger
+from core.metrics import LATENCY_BUCKETS, Counter, Gauge, Histogram
+from core.fast_inference import FastModel, fast_model_path
+from core.lookup_table import DecisionLookupTable
+from app.services.log_writer import LogWriter, LogWriterFull
+from app.services.request_coalescer import RequestCoalescer
+from app.services.streaming import DuplexStreamingResponse, iter_lines, line_too_long_error
+from core.windows import (
+    DB_TIMESTAMP_FORMAT, FEATURE_COLUMNS, IPWindowState,
+    error_flags, to_naive_utc, window_nanoseconds,
+)
 
 router = APIRouter()
+logger = get_logger('detector')
+
+# --- Metrics ---
+DETECT_REQUEST_SECONDS = Histogram('outlier_detect_request_seconds', 'Duration of detection requests.', ['endpoint'], buckets=LATENCY_BUCKETS)
+DETECT_ENTRIES = Counter('outlier_detect_entries_total', 'Log entries received for detection.', ['endpoint'])
+DETECT_BATCH_SIZE = Histogram('outlier_detect_batch_entries', 'Log entries scored together in one batch.',
+                              buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096))
+DETECT_STAGE_SECONDS = Histogram('outlier_detect_stage_seconds', 'Time spent per detection stage.', ['stage'], buckets=LATENCY_BUCKETS)
+MODEL_PREDICT_SECONDS = Histogram('outlier_model_predict_seconds', 'Time spent in one predict call per model.', ['model'], buckets=LATENCY_BUCKETS)
+MODEL_COST_SECONDS = Gauge('outlier_model_cost_seconds_per_row', 'Measured inference cost of each model being served, per row.', ['model'])
+MODEL_EVALUATIONS_SKIPPED = Counter('outlier_model_evaluations_skipped_total',
+                                    'Entries a model did not score because their majority vote was already decided.', ['model'])
+MODEL_SECONDS_SAVED = Counter('outlier_model_seconds_saved_total',
+                              'Estimated inference time saved by skipped evaluations (entries times measured cost per row).', ['model'])
+WINDOW_CACHE_EVENTS = Counter('outlier_window_cache_events_total', 'Window cache hits, misses, expirations and evictions.', ['event'])
+WINDOW_CACHE_SIZE = Gauge('outlier_window_cache_entries', 'IP windows held in the cache.')
+MODEL_LOAD_SECONDS = Histogram('outlier_model_load_seconds', 'Time to load a model version.', buckets=LATENCY_BUCKETS)
+MODEL_VERSION = Gauge('outlier_model_version_info', 'The model version being served (value 1).', ['version'])
+MODELS_LOADED = Gauge('outlier_models_loaded', 'Models in the ensemble being served.')
 
 # --- Model Loading ---
-models = {}
-
-def _load_models_if_needed():
-    if not models:
-        print("Attempting to load models...")
-        for model_name in MODELS_TO_TRAIN:
-            if model_name not in models:
-                model_path = f'outlier_model_{model_name}'
-                try:
-                    models[model_name] = load_model(model_path)
-                    print(f"Successfully loaded model: {model_path}.pkl")
-                except FileNotFoundError:
-                    print(f"Info: Model file not found for '{model_name}'. It may not have been trained yet.")
-                except Exception as e:
-                    print(f"An error occurred loading model '{model_name}': {e}")
-        if not models:
-            print("Warning: No models could be loaded.")
-
-def _reload_all_models():
-    global models
-    print("Initiating full model reload...")
+class ModelEnsemble:
+    """
+    The models of one registry version. An ensemble is never modified after it
+    is built: a reload builds a new one and swaps the module-level reference,
+    so a request that already picked up an ensemble finishes on that version.
+    Models are evaluated from the cheapest to the most expensive according to
+    costs (seconds per row); models without a cost keep their order, last.
+    """
+    def __init__(self, version, models: dict, lookup_table: DecisionLookupTable = None, costs: dict = None):
+        self.version = version
+        self.models = models
+        self.lookup_table = lookup_table
+        self.costs = costs or {}
+        self.evaluation_order = sorted(models, key=lambda name: self.costs.get(name, float('inf')))
+
+    def __bool__(self):
+        return bool(self.models)
+
+ensemble = ModelEnsemble(None, {})
+_reload_lock = threading.Lock()
+_reload_thread = None
+
+# PyCaret is only imported for models without a fast inference artifact: importing
+# it takes seconds, and the inference-only app (app.inference) never needs it.
+def load_model(model_path: str, verbose: bool = False):
+    from pycaret.anomaly import load_model as pycaret_load_model
+    return pycaret_load_model(model_path, verbose=verbose)
+
+def predict_model(model, data: pd.DataFrame) -> pd.DataFrame:
+    from pycaret.anomaly import predict_model as pycaret_predict_model
+    return pycaret_predict_model(model, data=data)
+
+def _load_model(model_path: str):
+    if FAST_INFERENCE_ENABLED and os.path.exists(fast_model_path(model_path)):
+        model = FastModel.load(fast_model_path(model_path))
+        logger.info("Loaded fast inference model", extra={'path': fast_model_path(model_path)})
+    else:
+        model = load_model(model_path, verbose=False)
+        logger.info("Loaded model", extra={'path': f'{model_path}.pkl'})
+    return model
+
+def _predict(model, features_df: pd.DataFrame):
+    """
+    Returns a model's (Anomaly, Anomaly_Score) arrays for the rows of features_df.
+    """
+    if isinstance(model, FastModel):
+        return model.score(features_df[model.columns].to_numpy(dtype=np.float64))
+    prediction_df = predict_model(model, data=features_df)
+    return prediction_df['Anomaly'].to_numpy(), prediction_df['Anomaly_Score'].to_numpy()
+
+def _measure_costs(models: dict) -> dict:
+    """
+    Returns each model's inference cost in seconds per row: the best of
+    ENSEMBLE_COST_PROBE_REPEATS predict calls on seeded rows of small counts,
+    like the window features. Models that cannot score them are left out.
+    """
+    rng = np.random.default_rng(0)
+    probe_df = pd.DataFrame(rng.poisson(lam=(8, 2, 1), size=(ENSEMBLE_COST_PROBE_ROWS, len(FEATURE_COLUMNS))),
+                            columns=FEATURE_COLUMNS, dtype='float64')
+    costs = {}
+    for name, model in models.items():
+        try:
+            timings = []
+            for _ in range(ENSEMBLE_COST_PROBE_REPEATS):
+                start = time.perf_counter()
+                _predict(model, probe_df)
+                timings.append(time.perf_counter() - start)
+            costs[name] = min(timings) / ENSEMBLE_COST_PROBE_ROWS
+        except Exception as e:
+            logger.warning("Could not measure the model's inference cost", extra={'model': name, 'error': str(e)})
+    return costs
+
+def _build_ensemble(version=None) -> ModelEnsemble:
+    """
+    Loads every model of a registry version (the CURRENT one by default).
+    Without a registry, falls back to the unversioned outlier_model_<name>.pkl
+    files in the working directory.
+    """
+    version = version or registry.get_current_version()
+    if version is not None:
+        model_names = list(registry.read_manifest(version)['models'])
+        model_paths = {name: registry.model_path(version, name) for name in model_names}
+    else:
+        model_paths = {name: f'outlier_model_{name}' for name in MODELS_TO_TRAIN}
+
     models = {}
-    _load_models_if_needed()
-    if not models:
-        raise HTTPException(status_code=500, detail="Failed to load any models after reload attempt.")
-    print("Model reload complete.")
+    for model_name, model_path in model_paths.items():
+        try:
+            models[model_name] = _load_model(model_path)
+        except FileNotFoundError:
+            logger.info("Model file not found, it may not have been trained yet", extra={'model': model_name})
+        except Exception as e:
+            logger.error("Could not load model", extra={'model': model_name, 'error': str(e)})
+
+    lookup_table = None
+    if LOOKUP_TABLE_ENABLED and version is not None:
+        lookup_table = DecisionLookupTable.load(registry.version_dir(version))
+        # The table's votes are only valid for the exact set of models it was compiled for
+        if lookup_table is not None and lookup_table.models != list(models):
+            logger.warning("The lookup table does not match the loaded models, scoring every entry live", extra={'version': version})
+            lookup_table = None
+        elif lookup_table is not None:
+            logger.info("Loaded the decision lookup table", extra={'version': version})
+
+    costs = _measure_costs(models) if ENSEMBLE_EARLY_EXIT else {}
+    logger.info("Measured the inference cost of the models", extra={'version': version, 'seconds_per_row': costs})
+    return ModelEnsemble(version, models, lookup_table, costs)
+
+def _swap_ensemble(version=None, set_current: bool = False, only_if_empty: bool = False) -> ModelEnsemble:
+    """
+    Builds the ensemble of a version and makes it the active one with a single
+    reference assignment. The active ensemble is kept if nothing could be loaded.
+
+    With set_current=True (a rollback), every model of the version must load,
+    and the registry's CURRENT is only pointed at the version once it has.
+    With only_if_empty=True, nothing is loaded if an ensemble is already served.
+    """
+    global ensemble
+    with _reload_lock:
+        if only_if_empty and ensemble:
+            return ensemble
+        logger.info("Loading model version", extra={'version': version or registry.get_current_version()})
+        start = time.perf_counter()
+        new_ensemble = _build_ensemble(version)
+        MODEL_LOAD_SECONDS.observe(time.perf_counter() - start)
+        if not new_ensemble:
+            logger.warning("No models could be loaded", extra={'version': new_ensemble.version})
+            return ensemble
+        if set_current:
+            expected_models = list(registry.read_manifest(new_ensemble.version)['models'])
+            if list(new_ensemble.models) != expected_models:
+                logger.error("Not every model of the version could be loaded, keeping the active version",
+                             extra={'version': new_ensemble.version, 'loaded': list(new_ensemble.models), 'expected': expected_models})
+                return ensemble
+            registry.set_current_version(new_ensemble.version)
+        ensemble = new_ensemble
+        MODEL_VERSION.clear()
+        MODEL_VERSION.labels(version=ensemble.version or 'unversioned').set(1)
+        MODELS_LOADED.set(len(ensemble.models))
+        MODEL_COST_SECONDS.clear()
+        for name, cost in ensemble.costs.items():
+            MODEL_COST_SECONDS.labels(model=name).set(cost)
+        logger.info("Serving model version", extra={'version': ensemble.version, 'models': list(ensemble.models),
+                                                      'evaluation_order': ensemble.evaluation_order,
+                                                      'lookup_table': ensemble.lookup_table is not None})
+        return ensemble
+
+def load_models_if_needed():
+    # Nothing is being served yet, so there is no reason to load in the background.
+    # Concurrent callers wait for the first one's load instead of repeating it.
+    if not ensemble:
+        try:
+            _swap_ensemble(only_if_empty=True)
+        except Exception as e:
+            logger.error("Could not load the models", extra={'error': str(e)})
+
+async def _load_models_off_loop():
+    """
+    Loads the models on the threadpool when none are served yet (none could
+    be loaded at startup), so the event loop is not blocked while they load.
+    """
+    if not ensemble:
+        await run_in_threadpool(load_models_if_needed)
+
+def _reload_all_models(version=None, wait: bool = False, set_current: bool = False):
+    """
+    Builds the new ensemble in a background thread while requests keep being
+    served by the current one. With wait=True, blocks until the swap is done.
+    set_current is passed on to _swap_ensemble.
+    """
+    global _reload_thread
+    logger.info("Model reload requested", extra={'version': version, 'wait': wait})
+    _reload_thread = threading.Thread(target=_swap_ensemble, args=(version, set_current), name='model-reload', daemon=True)
+    _reload_thread.start()
+    if wait:
+        _reload_thread.join()
+        if not ensemble or (version is not None and ensemble.version != version):
+            raise HTTPException(status_code=500, detail="Failed to load any models after reload attempt.")
+
+# --- Window State Setup ---
+# Each cached value is the IPWindowState of one IP address. An entry expires after
+# a full window of inactivity, after which it is rebuilt from the database.
+window_ns = window_nanoseconds(FEATURE_WINDOW_INTERVAL)
+interval_seconds = window_ns / 1e9
+class _InstrumentedTTLCache(TTLCache):
+    def expire(self, time=None):
+        expired = super().expire(time)
+        if expired:
+            WINDOW_CACHE_EVENTS.labels(event='expired').inc(len(expired))
+        return expired
+
+    def popitem(self):
+        # Only called when the cache is full
+        WINDOW_CACHE_EVENTS.labels(event='evicted').inc()
+        return super().popitem()
+
+cache = _InstrumentedTTLCache(maxsize=10000, ttl=interval_seconds + 60)
+cache_lock = threading.Lock()
 
-_load_models_if_needed()
+# Rows are flushed within LOG_WRITER_FLUSH_INTERVAL_SECONDS, well before a window
+# state expires from the cache and has to be re-read from the database.
+log_writer = LogWriter()
 
-# --- Caching Setup ---
-interval_seconds = pd.Timedelta(FEATURE_WINDOW_INTERVAL).total_seconds()
-cache = TTLCache(maxsize=10000, ttl=interval_seconds + 60)
+def check_storage_backend(backend: str = STORAGE_BACKEND):
+    """
+    Raises if the feature job would not read the logs this service ingests:
+    they are written to the database's logs table, which the 'parquet'
+    storage backend never reads.
+    """
+    if backend != 'sqlite':
+        raise RuntimeError(
+            f"The detection service writes the logs it receives to the database, but STORAGE_BACKEND is '{backend}', "
+            "so they would never be featurized or trained on. Use STORAGE_BACKEND = 'sqlite' with the detection service.")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Lifespan of the apps serving the detection endpoints (app.main and
+    app.inference).
+    """
+    check_storage_backend()
+    # Load the models before serving, rather than when the module is imported
+    load_models_if_needed()
+    yield
+    # Score the requests still waiting for a micro-batch, then write out any log
+    # rows still waiting in the write-behind queue
+    detect_coalescer.stop()
+    log_writer.stop()
 
 class LogEntry(BaseModel):
     timestamp: datetime
@@ -49,94 +290,455 @@ class LogEntry(BaseModel):
     service_endpoint: str
     http_response_code: int
 
-def get_recent_logs_with_caching(ip_address: str, engine) -> pd.DataFrame:
-    window_end = pd.Timestamp.now()
-    window_start = window_end - pd.Timedelta(FEATURE_WINDOW_INTERVAL)
+log_entry_list_adapter = TypeAdapter(list[LogEntry])
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
 
-    if ip_address in cache:
-        print(f"Cache HIT for IP: {ip_address}")
-        cached_df = cache[ip_address]
-        pruned_df = cached_df[cached_df['timestamp'] >= window_start].copy()
-        cache[ip_address] = pruned_df
-        return pruned_df
-    
-    print(f"Cache MISS for IP: {ip_address}. Querying database.")
-    query = f"""
-    SELECT timestamp, ip_address, service_endpoint, http_response_code 
-    FROM logs 
-    WHERE ip_address = '{ip_address}' AND timestamp BETWEEN '{window_start}' AND '{window_end}'
-    """
+def _load_window_state(ip_address: str, timestamp_ns: int, engine) -> IPWindowState:
+    window_end = pd.Timestamp(timestamp_ns)
+    window_start = window_end - pd.Timedelta(window_ns)
+    query = text("""
+    SELECT timestamp, http_response_code
+    FROM logs
+    WHERE ip_address = :ip_address AND timestamp > :window_start AND timestamp <= :window_end
+    ORDER BY timestamp
+    """)
+    params = {
+        'ip_address': ip_address,
+        'window_start': window_start.strftime(DB_TIMESTAMP_FORMAT),
+        'window_end': window_end.strftime(DB_TIMESTAMP_FORMAT),
+    }
     with engine.connect() as connection:
-        recent_logs_df = pd.read_sql(query, connection, parse_dates=['timestamp'])
-    
-    cache[ip_address] = recent_logs_df
-    return recent_logs_df
+        recent_logs_df = pd.read_sql(query, connection, params=params)
+
+    state = IPWindowState(window_ns)
+    timestamps = to_naive_utc(recent_logs_df['timestamp']).to_numpy().astype('int64')
+    client_errors, server_errors = error_flags(recent_logs_df['http_response_code'])
+    for ts, client_error, server_error in zip(timestamps.tolist(), client_errors.tolist(), server_errors.tolist()):
+        state.add(ts, client_error, server_error)
+    return state
+
+def get_window_state_with_caching(ip_address: str, timestamp_ns: int, engine) -> IPWindowState:
+    """
+    Returns the sliding-window state for an IP, seeding it from the 'logs' table
+    on a cache miss. Must be called with cache_lock held.
+    """
+    start = time.perf_counter()
+    state = cache.get(ip_address)
+    if state is not None:
+        WINDOW_CACHE_EVENTS.labels(event='hit').inc()
+        DETECT_STAGE_SECONDS.labels(stage='cache_lookup').observe(time.perf_counter() - start)
+    else:
+        WINDOW_CACHE_EVENTS.labels(event='miss').inc()
+        logger.debug("Window cache miss, querying the database", extra={'ip_address': ip_address})
+        with DETECT_STAGE_SECONDS.labels(stage='db_fallback').time():
+            state = _load_window_state(ip_address, timestamp_ns, engine)
+    # Re-assigning refreshes the entry's TTL.
+    cache[ip_address] = state
+    WINDOW_CACHE_SIZE.set(len(cache))
+    return state
+
+def _compute_features(logs_df: pd.DataFrame, engine, log_rows: list = None) -> pd.DataFrame:
+    """
+    Updates the window state of every IP in logs_df and returns one row of
+    features per log entry. Entries of the same IP are applied in the order
+    they appear in logs_df.
+
+    log_rows are handed to the log writer under the same lock, in room
+    reserved before taking it: a full writer (LogWriterFull) fails the
+    request before any window is updated, and never holds up the others.
+    """
+    timestamps_ns = logs_df['timestamp'].to_numpy().astype('int64')
+    client_errors, server_errors = error_flags(logs_df['http_response_code'])
+    counts = np.empty((len(logs_df), 3), dtype=np.int64)
+    positions_per_ip = logs_df.groupby('ip_address', sort=False).indices
+
+    with contextlib.ExitStack() as stack:
+        if log_rows:
+            with DETECT_STAGE_SECONDS.labels(stage='log_enqueue').time():
+                stack.enter_context(log_writer.reserve(len(log_rows)))
+        # Update the IP windows before inserting, so a cache miss does not read the new rows back.
+        # Every window is loaded before any is updated, so a failed load leaves them all untouched.
+        with cache_lock:
+            window_states = {
+                ip_address: get_window_state_with_caching(ip_address, int(timestamps_ns[positions[0]]), engine)
+                for ip_address, positions in positions_per_ip.items()
+            }
+            for ip_address, positions in positions_per_ip.items():
+                counts[positions] = window_states[ip_address].extend(timestamps_ns[positions], client_errors[positions], server_errors[positions])
+            if log_rows:
+                log_writer.submit(log_rows, reserved=True)
+
+    return pd.DataFrame(counts, columns=FEATURE_COLUMNS, dtype='float64')
+
+def _score_features(features_df: pd.DataFrame, active_ensemble: ModelEnsemble, full_scores=False) -> list:
+    """
+    Scores a feature matrix with the models of the ensemble, one predict call
+    per model, and returns the per-row final decision and model predictions.
+    Rows found in the ensemble's lookup table are not scored by the models.
+
+    The models are evaluated in the ensemble's evaluation order, cheapest
+    first, and each one only scores the rows whose majority vote the
+    remaining models can still change. The decisions are the same as with
+    every model; the models a row skipped are listed in its skipped_models.
+    full_scores, for every row or as one flag per row, has every model score
+    the rows.
+    """
+    models = active_ensemble.models
+    table = active_ensemble.lookup_table
+    num_rows = len(features_df)
+    covered = np.zeros(num_rows, dtype=bool)
+    decisions = np.zeros(num_rows, dtype=bool)
+    if table is not None:
+        start = time.perf_counter()
+        covered, table_anomalies, table_scores, table_decisions = table.lookup(features_df[FEATURE_COLUMNS].to_numpy())
+        decisions[covered] = table_decisions
+        DETECT_STAGE_SECONDS.labels(stage='lookup_table').observe(time.perf_counter() - start)
+    covered_rows = np.flatnonzero(covered)
+    full_scores = np.broadcast_to(np.asarray(full_scores, dtype=bool) | (not ENSEMBLE_EARLY_EXIT), num_rows)
+
+    majority = len(models) / 2
+    votes = np.zeros(num_rows, dtype=np.int64)
+    model_outputs = {}
+    for evaluated, name in enumerate(active_ensemble.evaluation_order):
+        # A row is decided once it has a majority, or once the remaining models cannot give it one
+        undecided = (votes < majority) & (votes + len(models) - evaluated >= majority)
+        live_rows = np.flatnonzero(~covered & (undecided | full_scores))
+        parts = []
+        if len(covered_rows):
+            position = list(models).index(name)
+            parts.append((covered_rows, table_anomalies[:, position], table_scores[:, position]))
+        if len(live_rows):
+            live_features_df = features_df if len(live_rows) == num_rows else features_df.iloc[live_rows].reset_index(drop=True)
+            start = time.perf_counter()
+            live_anomalies, live_scores = _predict(models[name], live_features_df)
+            MODEL_PREDICT_SECONDS.labels(model=name).observe(time.perf_counter() - start)
+            parts.append((live_rows, live_anomalies, live_scores))
+
+        skipped = num_rows - len(covered_rows) - len(live_rows)
+        if skipped:
+            MODEL_EVALUATIONS_SKIPPED.labels(model=name).inc(skipped)
+            if name in active_ensemble.costs:
+                MODEL_SECONDS_SAVED.labels(model=name).inc(skipped * active_ensemble.costs[name])
+        if not parts:
+            continue
+        if len(parts) == 1 and len(parts[0][0]) == num_rows:
+            scored = np.ones(num_rows, dtype=bool)
+            anomalies, scores = parts[0][1], parts[0][2]
+        else:
+            # Merge the table's rows with the rows scored live
+            scored = np.zeros(num_rows, dtype=bool)
+            anomalies = np.zeros(num_rows, dtype=np.int64)
+            scores = np.zeros(num_rows, dtype=np.result_type(*(part_scores.dtype for _, _, part_scores in parts)))
+            for rows, part_anomalies, part_scores in parts:
+                scored[rows], anomalies[rows], scores[rows] = True, part_anomalies, part_scores
+        votes += scored & (anomalies != 0)
+        model_outputs[name] = (scored, anomalies, scores)
+
+    results = []
+    for row in range(num_rows):
+        all_predictions = {}
+        skipped_models = []
+        for name in models:
+            if name not in model_outputs or not model_outputs[name][0][row]:
+                skipped_models.append(name)
+                continue
+            _, anomalies, scores = model_outputs[name]
+            all_predictions[name] = { "is_anomaly": bool(anomalies[row]), "score": str(scores[row]) }
+
+        anomaly_votes = int(votes[row])
+        final_is_anomaly = bool(decisions[row]) if covered[row] else anomaly_votes >= majority
+        reason = f"{anomaly_votes} out of {len(models)} models flagged it as an anomaly."
+        if skipped_models:
+            reason = (f"{anomaly_votes} out of {len(all_predictions)} evaluated models flagged it as an anomaly; "
+                      f"the other {len(skipped_models)} of {len(models)} could not change the majority.")
+        results.append({
+            "final_decision": { "is_anomaly": final_is_anomaly, "reason": reason },
+            "model_predictions": all_predictions,
+            "skipped_models": skipped_models,
+        })
+    return results
+
+def _detect_entries(log_entries: list, active_ensemble: ModelEnsemble, full_scores=False) -> list:
+    """
+    Runs detection for a list of log entries: window features, one bulk write
+    to the 'logs' table and one predict call per model of the ensemble.
+    full_scores is passed on to _score_features.
+    """
+    engine = get_engine(DB_URI)
+
+    # Create a DataFrame from the input log entries, using their own timestamps
+    new_logs_df = pd.DataFrame([log_entry.model_dump() for log_entry in log_entries])
+    new_logs_df['timestamp'] = to_naive_utc(new_logs_df['timestamp'])
+
+    # The new log entries go to the write-behind writer; scoring does not wait for the disk
+    log_rows = list(zip(
+        new_logs_df['timestamp'].dt.strftime(DB_TIMESTAMP_FORMAT),
+        new_logs_df['ip_address'],
+        new_logs_df['service_endpoint'],
+        new_logs_df['http_response_code'].astype(int).tolist(),
+    ))
+
+    DETECT_BATCH_SIZE.observe(len(log_entries))
+    with DETECT_STAGE_SECONDS.labels(stage='features').time():
+        features_df = _compute_features(new_logs_df, engine, log_rows)
+
+    results = _score_features(features_df, active_ensemble, full_scores)
+    features = features_df.to_dict(orient='records')
+    return [
+        {"log_entry": log_entry.model_dump(), **result, "features_calculated": features[i]}
+        for i, (log_entry, result) in enumerate(zip(log_entries, results))
+    ]
+
+def _detect_coalesced(items: list) -> list:
+    """
+    Runs detection for a micro-batch of (log_entry, ensemble, full_scores)
+    items collected from concurrent /detect calls. Entries are scored by the
+    ensemble their request picked up, so a batch spanning a model reload is
+    split in two.
+    """
+    results = [None] * len(items)
+    positions_per_ensemble = {}
+    for position, (_, active_ensemble, _) in enumerate(items):
+        positions_per_ensemble.setdefault(id(active_ensemble), []).append(position)
+    for positions in positions_per_ensemble.values():
+        active_ensemble = items[positions[0]][1]
+        full_scores = np.array([items[position][2] for position in positions], dtype=bool)
+        batch_results = _detect_entries([items[position][0] for position in positions], active_ensemble, full_scores)
+        for position, result in zip(positions, batch_results):
+            results[position] = result
+    return results
+
+# Single /detect calls are scored in micro-batches on the coalescer's own thread,
+# which also keeps inference off the request threadpool.
+detect_coalescer = RequestCoalescer(_detect_coalesced)
+
+def _parse_log_entries(body: bytes, content_type: str) -> list:
+    """
+    Parses a request body holding either a JSON array or NDJSON (one JSON
+    object per line) of log entries.
+    """
+    if content_type.split(';')[0].strip() in NDJSON_CONTENT_TYPES:
+        return [LogEntry.model_validate_json(line) for line in body.splitlines() if line.strip()]
+    return log_entry_list_adapter.validate_json(body)
+
+def _timed(endpoint: str):
+    """
+    Records the duration of an async endpoint in DETECT_REQUEST_SECONDS.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            with DETECT_REQUEST_SECONDS.labels(endpoint=endpoint).time():
+                return await handler(*args, **kwargs)
+        return wrapper
+    return decorator
 
 @router.post("/detect")
-def detect_outlier(log_entry: LogEntry):
-    _load_models_if_needed()
+@_timed('detect')
+async def detect_outlier(log_entry: LogEntry, full_scores: bool = False):
+    """
+    Detects whether a single log entry is an outlier. Concurrent calls are
+    coalesced and scored together, see DETECT_COALESCE_MAX_WAIT_MS. Models
+    that cannot change the majority vote are skipped unless full_scores=true.
+    """
+    DETECT_ENTRIES.labels(endpoint='detect').inc()
+    await _load_models_off_loop()
+    # Read the reference once: a concurrent reload does not affect this request
+    active_ensemble = ensemble
     
-    if not models:
+    if not active_ensemble:
         raise HTTPException(status_code=500, detail="No models are loaded. Cannot perform detection. Please train the models first.")
 
     try:
-        engine = create_engine(DB_URI)
-        
-        # Create a DataFrame from the input log entry, using its own timestamp
-        new_log_df = pd.DataFrame([log_entry.model_dump()])
-        
-        # Insert the new log entry into the database
-        with engine.connect() as connection:
-            new_log_df.to_sql('logs', connection, if_exists='append', index=False)
-        print(f"Inserted new log for IP: {log_entry.ip_address}")
-
-        recent_logs_df = get_recent_logs_with_caching(log_entry.ip_address, engine)
-        
-        combined_df = pd.concat([recent_logs_df, new_log_df], ignore_index=True)
-        # Ensure timestamp column is in the correct format before setting as index
-        combined_df['timestamp'] = pd.to_datetime(combined_df['timestamp'])
-        combined_df = combined_df.set_index('timestamp').sort_index()
-
-        combined_df['client_error'] = ((combined_df['http_response_code'] >= 400) & (combined_df['http_response_code'] < 500)).astype(int)
-        combined_df['server_error'] = ((combined_df['http_response_code'] >= 500) & (combined_df['http_response_code'] < 600)).astype(int)
-
-        aggregations = { 'service_endpoint': 'count', 'client_error': 'sum', 'server_error': 'sum' }
-        
-        features_df = combined_df.rolling(FEATURE_WINDOW_INTERVAL).agg(aggregations)
-        features_df.columns = ['request_count', 'client_error_count', 'server_error_count']
-        
-        latest_features = features_df.iloc[-1:].reset_index(drop=True)
+        result = await asyncio.wrap_future(detect_coalescer.submit((log_entry, active_ensemble, full_scores)))
+        return {"status": "success", "model_version": active_ensemble.version, **result}
+    except LogWriterFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        all_predictions = {}
-        anomaly_votes = 0
-        for name, model in models.items():
-            prediction_df = predict_model(model, data=latest_features)
-            is_anomaly = bool(prediction_df['Anomaly'].iloc[0])
-            if is_anomaly:
-                anomaly_votes += 1
-            all_predictions[name] = { "is_anomaly": is_anomaly, "score": str(prediction_df['Anomaly_Score'].iloc[0]) }
-
-        final_is_anomaly = anomaly_votes >= (len(models) / 2)
-
-        cache[log_entry.ip_address] = combined_df.reset_index()
-
-        return {
-            "status": "success",
-            "log_entry": log_entry.model_dump(),
-            "final_decision": { "is_anomaly": final_is_anomaly, "reason": f"{anomaly_votes} out of {len(models)} models flagged it as an anomaly." },
-            "model_predictions": all_predictions,
-            "features_calculated": latest_features.to_dict(orient='records')[0]
+@router.post(
+    "/detect_batch",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": {"type": "array", "items": {"$ref": "#/components/schemas/LogEntry"}}},
+                "application/x-ndjson": {"schema": {"type": "string"}},
+            },
         }
+    },
+)
+@_timed('detect_batch')
+async def detect_outlier_batch(request: Request, full_scores: bool = False):
+    """
+    Detects outliers for a batch of log entries, sent as a JSON array or as
+    NDJSON. Results are returned in the order of the input entries. Pass
+    full_scores=true to have every model score every entry.
+    """
+    try:
+        log_entries = _parse_log_entries(await request.body(), request.headers.get('content-type', ''))
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    DETECT_ENTRIES.labels(endpoint='detect_batch').inc(len(log_entries))
+
+    await _load_models_off_loop()
+    active_ensemble = ensemble
+    if not active_ensemble:
+        raise HTTPException(status_code=500, detail="No models are loaded. Cannot perform detection. Please train the models first.")
+    if not log_entries:
+        return {"status": "success", "model_version": active_ensemble.version, "results": []}
 
+    try:
+        results = await run_in_threadpool(_detect_entries, log_entries, active_ensemble, full_scores)
+        return {"status": "success", "model_version": active_ensemble.version, "results": results}
+    except LogWriterFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- Streaming Detection ---
+def _submit_line(line, line_number: int, full_scores: bool):
+    """
+    Validates one NDJSON line and hands it to the detection coalescer. Returns
+    the pending (future, ensemble) pair, or the error to report for the line.
+    """
+    if line is None:
+        return line_too_long_error(line_number)
+    try:
+        log_entry = LogEntry.model_validate_json(line)
+    except ValidationError as e:
+        return {"status": "error", "line": line_number, "detail": e.errors(include_url=False, include_context=False)}
+    active_ensemble = ensemble
+    if not active_ensemble:
+        return {"status": "error", "line": line_number, "detail": "No models are loaded. Cannot perform detection."}
+    return detect_coalescer.submit((log_entry, active_ensemble, full_scores)), active_ensemble
+
+async def _stream_detections(chunks, endpoint: str, full_scores: bool = False):
+    """
+    Detects outliers for a stream of NDJSON log lines and yields one result
+    per non-empty line, in order.
+
+    Lines are scored through the detection coalescer, so they are batched
+    with each other and with concurrent /detect calls. At most
+    STREAM_MAX_IN_FLIGHT lines are read ahead of the results: when the
+    consumer of the results is slow, reading stops and the sender is held
+    back by the transport's flow control.
+    """
+    pending = asyncio.Queue(maxsize=STREAM_MAX_IN_FLIGHT)
+    entries = DETECT_ENTRIES.labels(endpoint=endpoint)
+
+    async def read():
+        try:
+            line_number = 0
+            async for line in iter_lines(chunks):
+                line_number += 1
+                if line is not None and not line.strip():
+                    continue
+                entries.inc()
+                await _load_models_off_loop()
+                await pending.put(_submit_line(line, line_number, full_scores))
+        finally:
+            await pending.put(None)
+
+    reader = asyncio.create_task(read())
+    try:
+        while (item := await pending.get()) is not None:
+            if isinstance(item, dict):
+                yield item
+                continue
+            future, active_ensemble = item
+            try:
+                result = await asyncio.wrap_future(future)
+                yield {"status": "success", "model_version": active_ensemble.version, **result}
+            except Exception as e:
+                yield {"status": "error", "detail": str(e)}
+        # Re-raise a failure of the reader, e.g. a client disconnect
+        await reader
+    finally:
+        reader.cancel()
+
+@router.post(
+    "/detect_stream",
+    openapi_extra={"requestBody": {"required": True, "content": {"application/x-ndjson": {"schema": {"type": "string"}}}}},
+)
+async def detect_outlier_stream(request: Request, full_scores: bool = False):
+    """
+    Detects outliers for a chunked NDJSON request body (one log entry per
+    line) and streams one NDJSON result per line back, in order, while the
+    body is still being received. Invalid lines get an error result with
+    their line number; the stream carries on.
+    """
+    async def results():
+        async for result in _stream_detections(request.stream(), 'detect_stream', full_scores):
+            yield json.dumps(jsonable_encoder(result)) + '\n'
+    return DuplexStreamingResponse(results(), media_type='application/x-ndjson')
+
+@router.websocket("/detect_ws")
+async def detect_outlier_websocket(websocket: WebSocket, full_scores: bool = False):
+    """
+    WebSocket version of /detect_stream: each text message holds one or more
+    NDJSON log lines, and every line gets one JSON result message, in order.
+    """
+    await websocket.accept()
+
+    async def messages():
+        try:
+            while True:
+                # Each message ends its last line
+                yield await websocket.receive_text() + '\n'
+        except WebSocketDisconnect:
+            return
+
+    try:
+        async for result in _stream_detections(messages(), 'detect_ws', full_scores):
+            await websocket.send_text(json.dumps(jsonable_encoder(result)))
+    except WebSocketDisconnect:
+        pass
+
 @router.post("/reload_models")
-def reload_models_endpoint():
+def reload_models_endpoint(version: str = None, wait: bool = False):
+    """
+    Loads the registry's CURRENT model version (or the given one) in the
+    background and swaps it in once complete. Requests keep being served by
+    the active version meanwhile. Pass wait=true to block until the swap.
+    """
     try:
-        _reload_all_models()
-        return {"status": "success", "message": "Models reloaded successfully."}
+        _reload_all_models(version, wait=wait)
+        if wait:
+            return {"status": "success", "message": "Models reloaded successfully.", "model_version": ensemble.version}
+        return {"status": "success", "message": "Model reload started.", "model_version": ensemble.version}
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred during model reload: {e}")
+
+@router.get("/models")
+def list_model_versions():
+    """
+    Lists the registry's model versions, the CURRENT one and the one being served.
+    """
+    return {
+        "serving_version": ensemble.version,
+        "serving_models": list(ensemble.models),
+        "serving_evaluation_order": ensemble.evaluation_order,
+        "serving_cost_seconds_per_row": ensemble.costs,
+        "registry_current_version": registry.get_current_version(),
+        "versions": registry.list_versions(),
+    }
+
+@router.post("/rollback_models")
+def rollback_models_endpoint(version: str = None):
+    """
+    Rolls back to an earlier model version (by default the one before
+    CURRENT). The version is loaded first; only once every model loaded are
+    the registry's CURRENT and the served ensemble switched to it. Returns
+    when the rollback is done, or with an error, leaving both unchanged.
+    """
+    target = version or registry.previous_version()
+    if target is None:
+        raise HTTPException(status_code=400, detail="There is no earlier model version to roll back to.")
+    if target not in registry.list_versions():
+        raise HTTPException(status_code=404, detail=f"Model version '{target}' does not exist or is incomplete.")
+    _reload_all_models(target, wait=True, set_current=True)
+    return {"status": "success", "message": f"Rolled back to model version {target}.", "model_version": target}
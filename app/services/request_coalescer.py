@@ -0,0 +1,100 @@
+import atexit
+import threading
+import time
+from concurrent.futures import Future
+from config import DETECT_COALESCE_MAX_BATCH_SIZE, DETECT_COALESCE_MAX_WAIT_MS
+
+class RequestCoalescer:
+    """
+    Micro-batching for concurrent single-item requests.
+
+    Callers submit one item and get a Future back. A dedicated thread collects
+    the items submitted within max_wait_ms of the oldest waiting one (or until
+    max_batch_size items are waiting), runs process_batch once on the whole
+    list and resolves every Future with its own result. process_batch must
+    return one result per item, in order; if it raises, every Future of the
+    batch gets the exception.
+    """
+    def __init__(self, process_batch, max_batch_size=DETECT_COALESCE_MAX_BATCH_SIZE,
+                 max_wait_ms=DETECT_COALESCE_MAX_WAIT_MS):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._atexit_registered = False
+
+    def submit(self, item) -> Future:
+        future = Future()
+        with self._condition:
+            self._ensure_started()
+            self._pending.append((item, future, time.monotonic()))
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch_size:
+                self._condition.notify_all()
+        return future
+
+    def stop(self, timeout: float = None):
+        """
+        Processes the items still waiting and stops the batching thread.
+        """
+        with self._condition:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._condition.notify_all()
+            thread = self._thread
+        thread.join(timeout)
+        with self._condition:
+            self._thread = None
+            self._stopping = False
+
+    def _ensure_started(self):
+        # Called with self._condition held
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='request-coalescer', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def _next_batch(self) -> list:
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending or self._stopping)
+            # Measured from the oldest item, so items that queued up while the
+            # previous batch was being processed do not wait a second time
+            deadline = self._pending[0][2] + self.max_wait_ms / 1000 if self._pending else 0
+            while len(self._pending) < self.max_batch_size and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._process(batch)
+            with self._condition:
+                if self._stopping and not self._pending:
+                    return
+
+    def _process(self, batch: list):
+        # Skip the items whose caller has already given up (e.g. a disconnected client)
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        items = [item for item, _, _ in batch]
+        try:
+            results = self.process_batch(items)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
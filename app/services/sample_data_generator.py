@@ -1,42 +1,187 @@
+import argparse
 import pandas as pd
 import numpy as np
 from fastapi import APIRouter
-from sqlalchemy import create_engine
-from config import DB_PATH, DB_URI
+from config import (
+    DB_PATH, DB_URI, LOG_GENERATOR_CHUNK_ROWS, LOG_GENERATOR_BURST_REQUESTS,
+    LOG_GENERATOR_BURST_SECONDS, STORAGE_BACKEND, PARQUET_STORAGE_DIR,
+)
+from core.db import get_engine
+from core.log import get_logger
+from core.storage import get_storage
 
 router = APIRouter()
+logger = get_logger('sample_data_generator')
+
+ENDPOINTS = ["/home", "/login", "/api/data", "/profile", "/logout", "/admin"]
+RESPONSE_CODES = [200, 201, 404, 401, 500, 302]
+RESPONSE_CODE_PROBABILITIES = [0.7, 0.1, 0.1, 0.05, 0.03, 0.02]
+
+# Injected anomalies: each burst sends LOG_GENERATOR_BURST_REQUESTS requests from one
+# IP within LOG_GENERATOR_BURST_SECONDS, with the response codes of its kind.
+BURST_KINDS = {
+    'request_flood': ([200], [1.0]),
+    'client_errors': ([401, 404], [0.5, 0.5]),
+    'server_errors': ([500], [1.0]),
+}
 
 class SampleDataGenerator:
+    def __init__(self, num_ips: int = 20, zipf_exponent: float = 0.0, seed: int = None):
+        """
+        Generates log entries from num_ips IPs. With zipf_exponent > 0 the IP of
+        each entry is drawn from a Zipf distribution (the k-th IP sends in
+        proportion to 1 / k^zipf_exponent); 0 spreads the traffic evenly. With a
+        seed, the same entries (relative to the start time) are generated every time.
+        """
+        self.num_ips = num_ips
+        self.zipf_exponent = zipf_exponent
+        self.seed = seed
+        # Background entries and bursts draw from independent streams of the same seed
+        self._entropy = np.random.SeedSequence(seed).entropy
+        self._addresses = np.array(_ip_addresses(np.arange(num_ips)), dtype=object)
+        if zipf_exponent > 0:
+            weights = np.arange(1, num_ips + 1, dtype=np.float64) ** -zipf_exponent
+            self._ip_cdf = np.cumsum(weights / weights.sum())
+        else:
+            self._ip_cdf = None
+
+    def _rng(self, stream: int) -> np.random.Generator:
+        return np.random.default_rng(np.random.SeedSequence(self._entropy, spawn_key=(stream,)))
+
+    def _draw_ips(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        if self._ip_cdf is None:
+            return rng.integers(0, self.num_ips, size=size)
+        return np.minimum(np.searchsorted(self._ip_cdf, rng.random(size), side='right'), self.num_ips - 1)
+
+    def plan_anomaly_bursts(self, count: int, start_time: pd.Timestamp, duration: str = '1D') -> pd.DataFrame:
+        """
+        Returns the ground truth of count anomaly bursts: the IP, start and end
+        time, kind and number of requests of each, ordered by start time.
+        """
+        rng = self._rng(1)
+        span_us = max(pd.Timedelta(duration) // pd.Timedelta(microseconds=1) - LOG_GENERATOR_BURST_SECONDS * 10**6, 0)
+        starts = start_time + pd.to_timedelta(np.sort(rng.integers(0, span_us + 1, size=count)), unit='us')
+        return pd.DataFrame({
+            'ip_address': self._addresses[rng.integers(0, self.num_ips, size=count)],
+            'start_time': starts,
+            'end_time': starts + pd.Timedelta(seconds=LOG_GENERATOR_BURST_SECONDS),
+            'kind': rng.choice(list(BURST_KINDS), size=count),
+            'request_count': LOG_GENERATOR_BURST_REQUESTS,
+        })
+
+    def _burst_logs(self, bursts: pd.DataFrame) -> pd.DataFrame:
+        rng = self._rng(2)
+        frames = []
+        for burst in bursts.itertuples(index=False):
+            codes, probabilities = BURST_KINDS[burst.kind]
+            offsets = rng.integers(0, LOG_GENERATOR_BURST_SECONDS * 10**6, size=burst.request_count)
+            frames.append(pd.DataFrame({
+                'timestamp': burst.start_time + pd.to_timedelta(offsets, unit='us'),
+                'ip_address': burst.ip_address,
+                'service_endpoint': rng.choice(ENDPOINTS, size=burst.request_count),
+                'http_response_code': rng.choice(codes, size=burst.request_count, p=probabilities),
+            }))
+        columns = ['timestamp', 'ip_address', 'service_endpoint', 'http_response_code']
+        burst_logs = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+        return burst_logs.sort_values('timestamp', kind='stable', ignore_index=True)
+
+    def iter_log_chunks(self, num_rows: int, chunk_rows: int = LOG_GENERATOR_CHUNK_ROWS, start_time: pd.Timestamp = None,
+                        duration: str = '1D', bursts: pd.DataFrame = None):
+        """
+        Yields num_rows log entries spread over duration from start_time (by
+        default the last day), as time-ordered DataFrames of about chunk_rows
+        rows. Memory use is set by chunk_rows, not by num_rows.
+
+        The rows of the given anomaly bursts (see plan_anomaly_bursts) are merged
+        in, in addition to the num_rows background entries.
+        """
+        start_time = (pd.Timestamp.now() - pd.Timedelta(duration)).floor('us') if start_time is None else start_time
+        # Timestamps have microsecond resolution, like DB_TIMESTAMP_FORMAT
+        duration_us = pd.Timedelta(duration) // pd.Timedelta(microseconds=1)
+        burst_logs = self._burst_logs(bursts) if bursts is not None else None
+        rng = self._rng(0)
+        for first_row in range(0, num_rows, chunk_rows):
+            size = min(chunk_rows, num_rows - first_row)
+            # Each chunk covers its share of the duration, so chunks follow each other in time
+            chunk_start_us = duration_us * first_row // num_rows
+            chunk_end_us = duration_us * (first_row + size) // num_rows
+            offsets = np.sort(rng.integers(chunk_start_us, max(chunk_end_us, chunk_start_us + 1), size=size))
+            chunk_df = pd.DataFrame({
+                'timestamp': start_time + pd.to_timedelta(offsets, unit='us'),
+                'ip_address': self._addresses[self._draw_ips(rng, size)],
+                'service_endpoint': rng.choice(ENDPOINTS, size=size),
+                'http_response_code': rng.choice(RESPONSE_CODES, size=size, p=RESPONSE_CODE_PROBABILITIES),
+            })
+            if burst_logs is not None and len(burst_logs):
+                is_last = first_row + size >= num_rows
+                lower = start_time + pd.Timedelta(chunk_start_us, unit='us') if first_row else pd.Timestamp.min
+                upper = start_time + pd.Timedelta(chunk_end_us, unit='us') if not is_last else pd.Timestamp.max
+                in_chunk = burst_logs[(burst_logs['timestamp'] >= lower) & (burst_logs['timestamp'] < upper)]
+                chunk_df = pd.concat([chunk_df, in_chunk], ignore_index=True).sort_values('timestamp', kind='stable', ignore_index=True)
+            yield chunk_df
+
     def generate_log_data(self, num_rows=300000):
-        print("Generating sample log data...")
-        ips = [f"192.168.1.{i}" for i in range(1, 20)] + ["10.0.0.5"]
-        endpoints = ["/home", "/login", "/api/data", "/profile", "/logout", "/admin"]
-        responses = [200, 201, 404, 401, 500, 302]
-
-        start_time = pd.Timestamp.now() - pd.Timedelta(days=1)
-
-        data = {
-            "timestamp": pd.to_datetime(start_time) + pd.to_timedelta(
-                np.random.randint(0, 60 * 60 * 24, size=num_rows), unit='s'),
-            "ip_address": np.random.choice(ips, size=num_rows, p=[0.05] * 19 + [0.05]),
-            "service_endpoint": np.random.choice(endpoints, size=num_rows),
-            "http_response_code": np.random.choice(responses, size=num_rows, p=[0.7, 0.1, 0.1, 0.05, 0.03, 0.02])
-        }
-        return pd.DataFrame(data)
+        """
+        Generates num_rows log entries of the last day in one DataFrame.
+        """
+        logger.info("Generating sample log data", extra={'rows': num_rows, 'ips': self.num_ips})
+        chunks = list(self.iter_log_chunks(num_rows, chunk_rows=max(num_rows, 1)))
+        return chunks[0] if chunks else pd.DataFrame(columns=['timestamp', 'ip_address', 'service_endpoint', 'http_response_code'])
+
+def _ip_addresses(ip_codes: np.ndarray) -> list:
+    """
+    Maps IP numbers (up to 2^24) to addresses in 10.0.0.0/8.
+    """
+    return [f"10.{code >> 16}.{(code >> 8) & 255}.{code & 255}" for code in ip_codes.tolist()]
+
+def _log_progress(chunks):
+    written_rows = 0
+    for chunk_df in chunks:
+        yield chunk_df
+        written_rows += len(chunk_df)
+        logger.info("Wrote sample logs", extra={'rows': written_rows})
+
+def generate_sample_logs(num_rows: int, num_ips: int = 20, zipf_exponent: float = 0.0, anomaly_bursts: int = 0,
+                         seed: int = None, engine=None, storage_backend: str = STORAGE_BACKEND) -> int:
+    """
+    Streams num_rows sample logs of the last day, plus anomaly_bursts injected
+    bursts and their ground truth, into the storage of the logs (see
+    core.storage). Returns the number of rows written.
+    """
+    generator = SampleDataGenerator(num_ips=num_ips, zipf_exponent=zipf_exponent, seed=seed)
+    storage = get_storage(engine if engine is not None else get_engine(DB_URI), storage_backend)
+    start_time = (pd.Timestamp.now() - pd.Timedelta(days=1)).floor('us')
+    logger.info("Generating sample logs", extra={'rows': num_rows, 'ips': num_ips, 'zipf_exponent': zipf_exponent, 'anomaly_bursts': anomaly_bursts})
+    bursts = None
+    if anomaly_bursts:
+        bursts = generator.plan_anomaly_bursts(anomaly_bursts, start_time)
+        storage.write_anomaly_bursts(bursts)
+    return storage.write_logs(_log_progress(generator.iter_log_chunks(num_rows, start_time=start_time, bursts=bursts)))
 
 @router.post("/generate_sample")
-def generate_sample():
+def generate_sample(num_rows: int = 300000, num_ips: int = 20, zipf_exponent: float = 0.0,
+                    anomaly_bursts: int = 0, seed: int = None):
     """
-    Generates sample log data and saves it to the 'logs' table in the SQLite database.
+    Generates sample log data and saves it to the 'logs' table. Injected
+    anomaly bursts are recorded in 'anomaly_bursts'.
     """
     try:
-        engine = create_engine(DB_URI)
-        generator = SampleDataGenerator()
-        df = generator.generate_log_data()
-
-        df.to_sql('logs', engine, if_exists='append', index=False)
-        
-        num_rows = len(df)
-        return {"message": f"{num_rows} rows of sample data saved to the 'logs' table in {DB_PATH}"}
+        written_rows = generate_sample_logs(num_rows, num_ips, zipf_exponent, anomaly_bursts, seed)
+        location = DB_PATH if STORAGE_BACKEND == 'sqlite' else PARQUET_STORAGE_DIR
+        return {"message": f"{written_rows} rows of sample data saved to the 'logs' table in {location}"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates sample logs in bounded memory.")
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--ips', type=int, default=20)
+    parser.add_argument('--zipf', type=float, default=0.0, help="Zipf exponent of the traffic per IP (0: even)")
+    parser.add_argument('--anomaly-bursts', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--storage', choices=['sqlite', 'parquet'], default=STORAGE_BACKEND)
+    args = parser.parse_args()
+    generate_sample_logs(args.rows, args.ips, args.zipf, args.anomaly_bursts, args.seed, storage_backend=args.storage)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+from fastapi.responses import StreamingResponse
+from config import STREAM_MAX_LINE_BYTES
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse that does not listen for a disconnect while streaming:
+    the request body is still being read, and the body iterator has to be the
+    only reader of the ASGI receive channel.
+    """
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+async def iter_lines(chunks):
+    """
+    Splits a stream of byte or text chunks into lines. A line longer than
+    STREAM_MAX_LINE_BYTES is not buffered; it is yielded as None.
+    """
+    buffer = b''
+    skipping = False
+    async for chunk in chunks:
+        buffer += chunk.encode() if isinstance(chunk, str) else chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if skipping:
+                # The end of a line that was already reported as too long
+                skipping = False
+            else:
+                yield line if len(line) <= STREAM_MAX_LINE_BYTES else None
+        if len(buffer) > STREAM_MAX_LINE_BYTES:
+            if not skipping:
+                yield None
+                skipping = True
+            buffer = b''
+    if buffer.strip() and not skipping:
+        yield buffer
+
+def line_too_long_error(line_number: int) -> dict:
+    return {"status": "error", "line": line_number, "detail": f"Line longer than {STREAM_MAX_LINE_BYTES} bytes."}
@@ -0,0 +1,77 @@
+# Measures /outlier/detect scoring throughput and latency with request coalescing,
+# for a range of micro-batch sizes, with many concurrent single-entry clients.
+# Usage: python -m benchmarks.bench_coalescing --clients 64 --requests 4000 --batch-sizes 1 8 32 128
+import argparse
+import asyncio
+import time
+import numpy as np
+import pandas as pd
+from pyod.models.iforest import IForest
+from pyod.models.knn import KNN
+from pyod.models.lof import LOF
+from app.services.outlier_detector import ModelEnsemble, _score_features
+from app.services.request_coalescer import RequestCoalescer
+from core.fast_inference import ARTIFACT_FORMAT_VERSION, FastModel
+from core.windows import FEATURE_COLUMNS
+
+def _build_ensemble(seed: int) -> ModelEnsemble:
+    """
+    Fits the pyod models PyCaret trains on synthetic features and wraps them
+    as fast inference models, so no trained registry version is needed.
+    """
+    rng = np.random.default_rng(seed)
+    training_features = rng.poisson(lam=(20, 2, 1), size=(5000, 3)).astype(np.float64)
+    models = {}
+    for name, estimator in [('lof', LOF()), ('iforest', IForest(random_state=seed)), ('knn', KNN())]:
+        estimator.fit(training_features)
+        models[name] = FastModel({
+            'format_version': ARTIFACT_FORMAT_VERSION,
+            'columns': FEATURE_COLUMNS,
+            'fill_values': np.full(len(FEATURE_COLUMNS), np.nan),
+            'dtype': '<f4',
+            'estimator': estimator,
+            'threshold': float(estimator.threshold_),
+        })
+    return ModelEnsemble('benchmark', models)
+
+async def _run(coalescer: RequestCoalescer, clients: int, requests: int, seed: int):
+    rng = np.random.default_rng(seed)
+    features = rng.poisson(lam=(20, 2, 1), size=(requests, 3)).astype(np.float64)
+    latencies = []
+    next_request = iter(range(requests))
+
+    async def client():
+        for i in next_request:
+            start = time.perf_counter()
+            await asyncio.wrap_future(coalescer.submit(features[i]))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return time.perf_counter() - start, np.array(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and latency of coalesced /outlier/detect scoring.")
+    parser.add_argument('--clients', type=int, default=64, help="Concurrent clients, each sending one entry at a time")
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 128, 256])
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    ensemble = _build_ensemble(args.seed)
+    score_batch = lambda items: _score_features(pd.DataFrame(np.vstack(items), columns=FEATURE_COLUMNS), ensemble)
+
+    print(f"{args.clients} clients, {args.requests} requests, max wait {args.max_wait_ms} ms")
+    print(f"{'batch size':>10} {'requests/s':>12} {'p50 ms':>8} {'p99 ms':>8}")
+    for batch_size in args.batch_sizes:
+        coalescer = RequestCoalescer(score_batch, max_batch_size=batch_size, max_wait_ms=args.max_wait_ms)
+        # Warm up the batching thread and the models
+        asyncio.run(_run(coalescer, args.clients, min(args.requests, 200), args.seed))
+        seconds, latencies = asyncio.run(_run(coalescer, args.clients, args.requests, args.seed))
+        coalescer.stop()
+        p50, p99 = np.percentile(latencies * 1000, [50, 99])
+        print(f"{batch_size:>10} {args.requests / seconds:12,.0f} {p50:8.1f} {p99:8.1f}")
+
+if __name__ == '__main__':
+    main()
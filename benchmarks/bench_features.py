@@ -0,0 +1,49 @@
+# Compares the feature engines of process_log_data_from_db on sample data.
+# Usage: python -m benchmarks.bench_features --rows 300000 --ips 5000 --workers 4
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from app.services.sample_data_generator import SampleDataGenerator
+from dags.tasks.processing import _compute_features, _compute_features_numpy, _compute_features_parallel
+
+def _best_of(function, logs_df, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        features_df = function(logs_df.copy())
+        timings.append(time.perf_counter() - start)
+    return min(timings), features_df
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the feature engines of process_log_data_from_db.")
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--ips', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logs_df = SampleDataGenerator(num_ips=args.ips, seed=args.seed).generate_log_data(num_rows=args.rows)
+
+    pandas_seconds, expected = _best_of(_compute_features, logs_df, args.repeats)
+    results = [('pandas groupby().rolling()', pandas_seconds)]
+
+    numpy_seconds, actual = _best_of(_compute_features_numpy, logs_df, args.repeats)
+    pd.testing.assert_frame_equal(actual, expected)
+    results.append(('numpy, 1 process', numpy_seconds))
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        # Warm the pool up, so process start-up is not part of the timing
+        _compute_features_parallel(logs_df.head(1000).copy(), executor, args.workers)
+        parallel = lambda df: _compute_features_parallel(df, executor, args.workers)
+        parallel_seconds, actual = _best_of(parallel, logs_df, args.repeats)
+    pd.testing.assert_frame_equal(actual, expected)
+    results.append((f'numpy, {args.workers} processes', parallel_seconds))
+
+    print(f"{args.rows} rows, {logs_df['ip_address'].nunique()} IPs")
+    for name, seconds in results:
+        print(f"{name:<30} {seconds:8.3f}s {args.rows / seconds:14,.0f} rows/s  {pandas_seconds / seconds:6.1f}x")
+
+if __name__ == '__main__':
+    main()
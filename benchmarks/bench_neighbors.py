@@ -0,0 +1,75 @@
+# Compares LOF and KNN scored against every training row with their compact
+# neighbor index (core.neighbors): prediction agreement, score differences, scoring
+# time and pickled size, on the features of seeded sample logs. For LOF, the
+# agreement of the full model with itself fitted on shuffled rows is shown as well:
+# that is how much its decisions already depend on how ties are broken.
+# Usage: python -m benchmarks.bench_neighbors --rows 300000 --ips 1000 --zipf 1.1 --leaf-sizes 8 16 32 64
+import argparse
+import pickle
+import time
+import numpy as np
+from pyod.models.knn import KNN
+from pyod.models.lof import LOF
+from app.services.sample_data_generator import SampleDataGenerator
+from core.neighbors import compact_neighbor_model
+from core.windows import FEATURE_COLUMNS
+from dags.tasks.processing import _compute_features_numpy
+
+# PyCaret's create_model fits the pyod models with this contamination
+CONTAMINATION = 0.05
+
+def _features(rows: int, ips: int, zipf_exponent: float, seed: int) -> np.ndarray:
+    logs_df = SampleDataGenerator(num_ips=ips, zipf_exponent=zipf_exponent, seed=seed).generate_log_data(num_rows=rows)
+    return _compute_features_numpy(logs_df)[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+
+def _best_of(function, repeats: int):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description="Agreement and speedup of the compact LOF/KNN neighbor index.")
+    parser.add_argument('--rows', type=int, default=300000, help="Log rows of the training day")
+    parser.add_argument('--ips', type=int, default=1000)
+    parser.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent of the traffic per IP (0: even)")
+    parser.add_argument('--queries', type=int, default=20000, help="Feature rows of another day to score")
+    parser.add_argument('--leaf-sizes', type=int, nargs='+', default=[16])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    training_X = _features(args.rows, args.ips, args.zipf, args.seed)
+    query_X = _features(args.rows, args.ips, args.zipf, args.seed + 1)[:args.queries]
+    distinct = len(np.unique(training_X, axis=0))
+    print(f"{len(training_X)} training rows ({distinct} distinct), {len(query_X)} query rows")
+    print(f"{'model':<6} {'index':<10} {'rows':>8} {'score ms':>9} {'speedup':>8} {'agreement':>10} {'max diff':>10} {'size KB':>9}")
+
+    rng = np.random.default_rng(args.seed)
+    for name, make_estimator in [('knn', KNN), ('lof', LOF)]:
+        estimator = make_estimator(contamination=CONTAMINATION).fit(training_X)
+        full_seconds, full_scores = _best_of(lambda: estimator.decision_function(query_X), args.repeats)
+        full_anomalies = full_scores > estimator.threshold_
+        size = len(pickle.dumps(estimator)) / 1024
+        print(f"{name:<6} {'full':<10} {len(training_X):8} {full_seconds * 1000:9.1f} {1:8.1f}x {1:10.2%} {0:10.3g} {size:9.0f}")
+
+        if name == 'lof':
+            shuffled = make_estimator(contamination=CONTAMINATION).fit(training_X[rng.permutation(len(training_X))])
+            shuffled_scores = shuffled.decision_function(query_X)
+            agreement = np.mean((shuffled_scores > shuffled.threshold_) == full_anomalies)
+            difference = np.abs(shuffled_scores - full_scores).max()
+            print(f"{name:<6} {'shuffled':<10} {len(training_X):8} {'':>9} {'':>9} {agreement:10.2%} {difference:10.3g}")
+
+        for leaf_size in args.leaf_sizes:
+            compact = compact_neighbor_model(estimator, leaf_size)
+            seconds, scores = _best_of(lambda: compact.decision_function(query_X), args.repeats)
+            agreement = np.mean((scores > estimator.threshold_) == full_anomalies)
+            difference = np.abs(scores - full_scores).max()
+            size = len(pickle.dumps(compact)) / 1024
+            print(f"{name:<6} {f'leaf {leaf_size}':<10} {compact.index.n_points:8} {seconds * 1000:9.1f} "
+                  f"{full_seconds / seconds:8.1f}x {agreement:10.2%} {difference:10.3g} {size:9.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Measures the cold start of the full app (app.main:app) against the inference-only
+# app (app.inference:app): the import time and number of modules loaded in a fresh
+# interpreter, and the time from starting uvicorn until the first /outlier/detect
+# response, with a published registry version of fast inference models.
+# Usage: python -m benchmarks.bench_startup --repeats 5
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+import numpy as np
+from benchmarks.bench_workers import REPOSITORY_ROOT, _free_port, _publish_models
+
+APPS = ['app.main:app', 'app.inference:app']
+# Loaded by the full app only
+HEAVY_MODULES = ['pycaret', 'requests', 'dags']
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': len(sys.modules),
+                  'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+ENTRY = {"timestamp": "2024-01-01T00:00:00Z", "ip_address": "10.0.0.1", "service_endpoint": "/api", "http_response_code": 200}
+
+def _measure_import(app: str, directory: str, env: dict) -> dict:
+    module = app.split(':')[0]
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=directory, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+def _measure_first_response(app: str, directory: str, env: dict) -> float:
+    """
+    Returns the seconds from starting uvicorn until the first detection
+    (models loaded, features computed) is returned.
+    """
+    port = _free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', app, '--port', str(port), '--log-level', 'warning'],
+        cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 120
+        while True:
+            try:
+                response = httpx.post(f'http://127.0.0.1:{port}/outlier/detect', json=ENTRY)
+                response.raise_for_status()
+                return time.perf_counter() - start
+            except httpx.TransportError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"{app} did not start.")
+                time.sleep(0.02)
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start of the full app against the inference-only app.")
+    parser.add_argument('--repeats', type=int, default=5, help="Runs per app; the median is reported")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench-startup-') as directory:
+        _publish_models(os.path.join(directory, 'model_registry'), args.seed)
+        env = {**os.environ, 'PYTHONPATH': REPOSITORY_ROOT}
+        print(f"{'app':<20} {'import s':>9} {'modules':>8} {'first response s':>17}  heavy modules")
+        for app in APPS:
+            imports = [_measure_import(app, directory, env) for _ in range(args.repeats)]
+            first_responses = [_measure_first_response(app, directory, env) for _ in range(args.repeats)]
+            import_seconds = np.median([result['seconds'] for result in imports])
+            heavy = ', '.join(imports[-1]['heavy']) or '-'
+            print(f"{app:<20} {import_seconds:9.2f} {imports[-1]['modules']:8} {np.median(first_responses):17.2f}  {heavy}")
+
+if __name__ == '__main__':
+    main()
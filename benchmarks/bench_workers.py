@@ -0,0 +1,136 @@
+# Measures /outlier/detect throughput of the multi-worker deployment (app.cluster)
+# for a range of worker counts, and checks that the features do not depend on it.
+# Usage: python -m benchmarks.bench_workers --workers 1 2 4 --clients 64 --requests 4000
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import joblib
+import httpx
+import numpy as np
+from pyod.models.iforest import IForest
+from pyod.models.knn import KNN
+from pyod.models.lof import LOF
+from core import registry
+from core.fast_inference import ARTIFACT_FORMAT_VERSION, fast_model_path
+from core.windows import FEATURE_COLUMNS
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _publish_models(registry_dir: str, seed: int):
+    """
+    Publishes a registry version of fast inference models fitted on synthetic
+    features, so the workers have models to serve.
+    """
+    rng = np.random.default_rng(seed)
+    training_features = rng.poisson(lam=(20, 2, 1), size=(5000, 3)).astype(np.float64)
+    version = registry.create_version(registry_dir)
+    names = []
+    for name, estimator in [('lof', LOF()), ('iforest', IForest(random_state=seed)), ('knn', KNN())]:
+        estimator.fit(training_features)
+        joblib.dump({
+            'format_version': ARTIFACT_FORMAT_VERSION,
+            'columns': FEATURE_COLUMNS,
+            'fill_values': np.full(len(FEATURE_COLUMNS), np.nan),
+            'dtype': '<f8',
+            'estimator': estimator,
+            'threshold': float(estimator.threshold_),
+        }, fast_model_path(registry.model_path(version, name, registry_dir)))
+        names.append(name)
+    registry.write_manifest(version, {'models': {name: {} for name in names}}, registry_dir)
+    registry.set_current_version(version, registry_dir)
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _make_streams(clients: int, requests: int, ips_per_client: int, seed: int) -> list:
+    """
+    Returns one list of log entries per client. Every client owns its own IPs
+    and sends its entries one after the other, so the order of each IP's
+    entries, and therefore its features, does not depend on the scheduling.
+    """
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2024-01-01T00:00:00', 'ms')
+    streams = []
+    for client in range(clients):
+        count = requests // clients
+        offsets = np.sort(rng.integers(0, 10 * 60 * 1000, size=count))
+        ips = rng.integers(0, ips_per_client, size=count)
+        codes = rng.choice([200, 200, 200, 404, 500], size=count)
+        streams.append([
+            {"timestamp": f"{start + offset}Z", "ip_address": f"10.{client}.0.{ip}", "service_endpoint": "/api", "http_response_code": int(code)}
+            for offset, ip, code in zip(offsets.tolist(), ips.tolist(), codes.tolist())
+        ])
+    return streams
+
+async def _run_load(url: str, streams: list):
+    latencies, features = [], {}
+    limits = httpx.Limits(max_connections=len(streams))
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        async def send(stream):
+            for position, entry in enumerate(stream):
+                start = time.perf_counter()
+                response = await client.post('/outlier/detect', json=entry)
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+                features[(entry['ip_address'], position)] = response.json()['features_calculated']
+        start = time.perf_counter()
+        await asyncio.gather(*(send(stream) for stream in streams))
+        return time.perf_counter() - start, np.array(latencies), features
+
+def _benchmark(workers: int, streams: list, seed: int):
+    with tempfile.TemporaryDirectory(prefix='bench-workers-') as directory:
+        _publish_models(os.path.join(directory, 'model_registry'), seed)
+        port = _free_port()
+        env = {**os.environ, 'PYTHONPATH': REPOSITORY_ROOT}
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'app.cluster', '--workers', str(workers), '--port', str(port)],
+            cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = f'http://127.0.0.1:{port}'
+        try:
+            deadline = time.monotonic() + 300
+            while True:
+                try:
+                    httpx.get(f'{url}/').raise_for_status()
+                    break
+                except httpx.TransportError:
+                    if process.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError(f"The cluster with {workers} worker(s) did not start.")
+                    time.sleep(0.5)
+            # Warm up every worker (cache misses, first predictions) on throw-away IPs
+            warm_up = [[{**entry, 'ip_address': f"warm-{entry['ip_address']}"} for entry in stream[:20]] for stream in streams]
+            asyncio.run(_run_load(url, warm_up))
+            return asyncio.run(_run_load(url, streams))
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of /outlier/detect per number of worker processes.")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--ips-per-client', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    streams = _make_streams(args.clients, args.requests, args.ips_per_client, args.seed)
+    requests = sum(len(stream) for stream in streams)
+    print(f"{requests} requests from {args.clients} clients, {os.cpu_count()} CPU(s)")
+    print(f"{'workers':>7} {'requests/s':>12} {'p50 ms':>8} {'p99 ms':>8}  features")
+    reference = None
+    for workers in args.workers:
+        seconds, latencies, features = _benchmark(workers, streams, args.seed)
+        reference = reference or features
+        p50, p99 = np.percentile(latencies * 1000, [50, 99])
+        same = 'identical' if features == reference else 'DIFFERENT'
+        print(f"{workers:>7} {requests / seconds:12,.0f} {p50:8.1f} {p99:8.1f}  {same}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+# Reproducible benchmark suite. Generates seeded sample logs into a scratch database,
+# then measures the feature job (rows/s, peak RSS), training (wall time per model)
+# and /outlier/detect (requests/s, p50/p99 latency, in-process). Results are written
+# as JSON; with --baseline they are compared against an earlier result, and a
+# regression beyond --tolerance makes the run exit with status 1.
+# Usage:
+#   python -m benchmarks.run --rows 1000000 --ips 1000 --output benchmarks/baseline.json
+#   python -m benchmarks.run --rows 1000000 --ips 1000 --baseline benchmarks/baseline.json
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Metrics compared against the baseline; the others only describe the run
+HIGHER_IS_BETTER = ('rows_per_second', 'requests_per_second')
+LOWER_IS_BETTER = ('seconds', 'p50_ms', 'p99_ms', 'peak_rss_mb')
+# Parameters that change the workload; results are only comparable when they match
+WORKLOAD_PARAMETERS = ('rows', 'ips', 'zipf', 'seed', 'models', 'requests', 'clients')
+
+# --- Phases ---
+# Every phase runs in a fresh process inside the scratch directory, so the relative
+# DB_PATH and MODEL_REGISTRY_DIR resolve there and the peak RSS is the phase's own.
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux; the feature job may use worker processes
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak / 1024, 1)
+
+def _generate(rows: int, ips: int, zipf_exponent: float, seed: int) -> dict:
+    from app.services.sample_data_generator import generate_sample_logs
+
+    start = time.perf_counter()
+    generate_sample_logs(rows, ips, zipf_exponent, seed=seed)
+    seconds = time.perf_counter() - start
+    return {'seconds': round(seconds, 3), 'rows_per_second': round(rows / seconds)}
+
+def _features(rows: int) -> dict:
+    from dags.tasks.processing import process_log_data_from_db
+
+    start = time.perf_counter()
+    process_log_data_from_db(full_rebuild=True)
+    seconds = time.perf_counter() - start
+    return {'seconds': round(seconds, 3), 'rows_per_second': round(rows / seconds), 'peak_rss_mb': _peak_rss_mb()}
+
+def _training(models: list) -> dict:
+    from core import registry
+    from dags.tasks.training import train_outlier_models
+
+    start = time.perf_counter()
+    train_outlier_models(model_names=models, workers=1)
+    seconds = time.perf_counter() - start
+    manifest = registry.read_manifest(registry.get_current_version())
+    return {
+        'seconds': round(seconds, 3),
+        'models': {name: {'seconds': manifest['models'][name]['training_seconds']} for name in models},
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+def _make_streams(requests: int, clients: int, ips: int, seed: int) -> list:
+    """
+    Returns one time-ordered list of log entries per client, following the
+    generated logs. Every IP belongs to one client, so the order of its
+    entries does not depend on the scheduling.
+    """
+    from app.services.sample_data_generator import _ip_addresses
+
+    rng = np.random.default_rng(seed)
+    start = np.datetime64(time.time_ns() // 1000000, 'ms')
+    offsets = np.sort(rng.integers(0, 60 * 1000, size=requests))
+    ip_codes = rng.integers(0, ips, size=requests)
+    codes = rng.choice([200, 201, 404, 401, 500, 302], size=requests, p=[0.7, 0.1, 0.1, 0.05, 0.03, 0.02])
+    streams = [[] for _ in range(clients)]
+    for offset, ip_code, ip_address, code in zip(offsets.tolist(), ip_codes.tolist(), _ip_addresses(ip_codes), codes.tolist()):
+        streams[ip_code % clients].append({
+            "timestamp": f"{start + offset}Z", "ip_address": ip_address,
+            "service_endpoint": "/api/data", "http_response_code": code,
+        })
+    return streams
+
+async def _run_load(app, streams: list):
+    import httpx
+
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=60) as client:
+        async def send(stream):
+            for entry in stream:
+                start = time.perf_counter()
+                response = await client.post('/outlier/detect', json=entry)
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+        start = time.perf_counter()
+        await asyncio.gather(*(send(stream) for stream in streams))
+        return time.perf_counter() - start, np.array(latencies)
+
+def _detect(requests: int, clients: int, ips: int, seed: int) -> dict:
+    # The app loads the published model version on the first request
+    from app.main import app
+    from app.services import outlier_detector
+
+    streams = _make_streams(requests, clients, ips, seed)
+    # Warm up on throw-away IPs (first predictions, code paths)
+    warm_up = [[{**entry, 'ip_address': f"warm-{entry['ip_address']}"} for entry in stream[:10]] for stream in streams]
+    asyncio.run(_run_load(app, warm_up))
+    seconds, latencies = asyncio.run(_run_load(app, streams))
+    outlier_detector.detect_coalescer.stop()
+    outlier_detector.log_writer.stop()
+    p50, p99 = np.percentile(latencies * 1000, [50, 99])
+    return {'requests_per_second': round(len(latencies) / seconds), 'p50_ms': round(p50, 3), 'p99_ms': round(p99, 3)}
+
+def _run_phase(directory: str, phase, *args) -> dict:
+    os.chdir(directory)
+    return phase(*args)
+
+def _in_fresh_process(directory: str, phase, *args) -> dict:
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_run_phase, directory, phase, *args).result()
+
+# --- Comparison ---
+
+def _flatten(results: dict, prefix: str = '') -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+def compare(results: dict, baseline: dict) -> list:
+    """
+    Returns (metric, baseline, current, change) for every metric present in
+    both results, where change is the relative change in the worse direction
+    (positive means slower or larger).
+    """
+    current, previous = _flatten(results), _flatten(baseline)
+    rows = []
+    for metric, value in current.items():
+        name = metric.rsplit('.', 1)[-1]
+        if metric not in previous or not previous[metric] or name not in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            continue
+        change = (value - previous[metric]) / previous[metric]
+        rows.append((metric, previous[metric], value, -change if name in HIGHER_IS_BETTER else change))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks detection, feature engineering and training on seeded sample data.")
+    parser.add_argument('--rows', type=int, default=100000, help="Log rows to generate (1e5 to 1e8)")
+    parser.add_argument('--ips', type=int, default=20, help="Distinct IPs (20 to 1e6)")
+    parser.add_argument('--zipf', type=float, default=0.0, help="Zipf exponent of the traffic per IP (0: even)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--models', nargs='+', default=None, help="Models to train (default: MODELS_TO_TRAIN)")
+    parser.add_argument('--requests', type=int, default=5000, help="/outlier/detect requests to send")
+    parser.add_argument('--clients', type=int, default=32, help="Concurrent clients of the load generator")
+    parser.add_argument('--output', default=None, help="Write the results to this JSON file")
+    parser.add_argument('--baseline', default=None, help="Compare against the results in this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed relative regression against the baseline")
+    args = parser.parse_args()
+
+    from config import MODELS_TO_TRAIN
+    models = args.models or MODELS_TO_TRAIN
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as directory:
+        print(f"Generating {args.rows} rows over {args.ips} IPs (seed {args.seed})...")
+        results['generate'] = _in_fresh_process(directory, _generate, args.rows, args.ips, args.zipf, args.seed)
+        print("Running the feature job...")
+        results['features'] = _in_fresh_process(directory, _features, args.rows)
+        print(f"Training {models}...")
+        results['training'] = _in_fresh_process(directory, _training, models)
+        print(f"Sending {args.requests} requests from {args.clients} clients to /outlier/detect...")
+        results['detect'] = _in_fresh_process(directory, _detect, args.requests, args.clients, args.ips, args.seed + 1)
+
+    report = {
+        'parameters': {**vars(args), 'models': models},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'results': results,
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if any(baseline['parameters'].get(name) != report['parameters'][name] for name in WORKLOAD_PARAMETERS):
+            print("Warning: the baseline was run with a different workload.")
+        regressions = 0
+        print(f"{'metric':<32} {'baseline':>12} {'current':>12} {'change':>8}")
+        for metric, previous, value, change in compare(results, baseline['results']):
+            regressed = change > args.tolerance
+            regressions += regressed
+            print(f"{metric:<32} {previous:12,.3f} {value:12,.3f} {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,147 @@ DB_URI = f"sqlite:///{DB_PATH}"
 # Use pandas offset aliases: https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html#offset-aliases
 FEATURE_WINDOW_INTERVAL = '5min'
 
+# Storage of the logs and features tables used by the feature, training and sample
+# data jobs: 'sqlite' (tables in DB_PATH) or 'parquet' (date-partitioned Parquet
+# datasets under PARQUET_STORAGE_DIR; needs pyarrow). The detection service writes
+# and looks up its logs in the database, so it refuses to start with 'parquet':
+# the feature job would never read the logs it ingests.
+STORAGE_BACKEND = 'sqlite'
+PARQUET_STORAGE_DIR = "datasets"
+
+# The feature job streams the logs table in time-ordered chunks of this many rows,
+# which bounds its peak memory regardless of table size. None loads all logs at once.
+# Each chunk's features are committed in their own transaction, so a failed run
+# resumes from the last committed chunk and the log writer is never locked out for long.
+FEATURE_CHUNK_ROWS = 500000
+
+# The sample data generator streams logs in chunks of this many rows (one insert
+# transaction each), so any number of rows is generated in bounded memory. Each
+# injected anomaly burst sends LOG_GENERATOR_BURST_REQUESTS requests from one IP
+# within LOG_GENERATOR_BURST_SECONDS.
+LOG_GENERATOR_CHUNK_ROWS = 250000
+LOG_GENERATOR_BURST_REQUESTS = 300
+LOG_GENERATOR_BURST_SECONDS = 60
+
+# Engine of the feature job: 'numpy' (vectorized windows over sorted timestamps) or
+# 'pandas' (groupby().rolling()). Both produce identical features. With the numpy
+# engine, FEATURE_WORKERS > 1 hash-partitions the IPs over a pool of processes;
+# set it to the number of cores available to the Airflow worker.
+FEATURE_ENGINE = 'numpy'
+FEATURE_WORKERS = 1
+
+# Models are trained on the features of this trailing period (pandas offset alias).
+TRAINING_HORIZON = '24h'
+
+# Training reads the features of TRAINING_HORIZON. Above TRAINING_MAX_ROWS rows, a
+# reservoir sample stratified by IP (seeded with TRAINING_SAMPLE_SEED) is used, which
+# keeps the superlinear LOF/KNN training bounded. None trains on every row.
+TRAINING_MAX_ROWS = 50000
+TRAINING_SAMPLE_SEED = 42
+
+# Training is skipped while the served models are up to date: their training
+# configuration is unchanged, they are younger than TRAINING_MAX_MODEL_AGE, and the
+# features either did not change since or drifted less than TRAINING_DRIFT_THRESHOLD.
+# Drift is the largest population stability index over the feature columns, on
+# TRAINING_DRIFT_BINS quantile bins of the served models' training features
+# (0.1 is the usual bound of an insignificant shift). The feature job similarly skips
+# runs when neither the logs nor FEATURE_WINDOW_INTERVAL changed.
+TRAINING_DRIFT_THRESHOLD = 0.1
+TRAINING_DRIFT_BINS = 10
+TRAINING_MAX_MODEL_AGE = '7D'
+
+# Number of processes that train MODELS_TO_TRAIN concurrently, one experiment each.
+TRAINING_WORKERS = 3
+
+# Raw logs older than this are compacted into per-IP per-minute rollups by the
+# retention task. Must cover TRAINING_HORIZON plus one FEATURE_WINDOW_INTERVAL.
+LOG_RETENTION_PERIOD = '2D'
+
 # Define the list of anomaly detection models to train.
 # An odd number is recommended to avoid ties in majority voting.
 # See PyCaret documentation for available model IDs: https://pycaret.org/anomaly-detection/
 MODELS_TO_TRAIN = ['lof', 'iforest', 'knn']
+
+# Each training run saves its models into a new version directory of this registry,
+# with a manifest, and then points the registry's CURRENT file at it. The detection
+# service serves the CURRENT version; older versions are kept for rollback.
+MODEL_REGISTRY_DIR = "model_registry"
+MODEL_REGISTRY_KEEP_VERSIONS = 5
+# Version directories without a manifest are deleted once they have not been written
+# to for this long (pandas offset alias); younger ones may belong to a running training.
+MODEL_REGISTRY_INCOMPLETE_GRACE_PERIOD = '1D'
+
+# Score models through their exported fast inference artifacts (fitted estimator +
+# NumPy preprocessing) instead of PyCaret's predict_model, when the artifact exists.
+FAST_INFERENCE_ENABLED = True
+
+# The fast inference artifacts of these models score against a compact neighbor index
+# (core.neighbors): a KD-tree over the distinct training feature vectors, each weighted
+# by its number of rows, with NEIGHBOR_INDEX_LEAF_SIZE points per leaf. KNN scores are
+# unchanged. LOF ('lof') is supported as well, but may decide differently where rows
+# tie for the k-th nearest neighbor; benchmarks/bench_neighbors.py reports both.
+NEIGHBOR_INDEX_COMPACT_MODELS = ['knn']
+NEIGHBOR_INDEX_LEAF_SIZE = 32
+
+# After training, precompile every model's score and the majority vote for each
+# (request_count, client_error_count, server_error_count) combination up to the
+# largest values seen in training, capped at LOOKUP_TABLE_MAX_COUNTS. Detection then
+# looks the decision up and only scores the entries outside the table. The table is
+# skipped when the grid would have more than LOOKUP_TABLE_MAX_CELLS cells.
+LOOKUP_TABLE_ENABLED = True
+LOOKUP_TABLE_MAX_COUNTS = (1000, 200, 200)
+LOOKUP_TABLE_MAX_CELLS = 2000000
+
+# Early-exit majority voting. When a model version is loaded, each model's inference
+# cost is measured as the best of ENSEMBLE_COST_PROBE_REPEATS predict calls on
+# ENSEMBLE_COST_PROBE_ROWS seeded feature rows. Detection then evaluates the models
+# from the cheapest to the most expensive and stops scoring an entry as soon as the
+# remaining models can no longer change its majority vote; the decision is the same
+# as with every model. Requests can still ask for every score with full_scores=true.
+ENSEMBLE_EARLY_EXIT = True
+ENSEMBLE_COST_PROBE_ROWS = 256
+ENSEMBLE_COST_PROBE_REPEATS = 3
+
+# Write-behind ingestion of the logs received by /outlier/detect.
+# Rows are written in one transaction per batch, when LOG_WRITER_BATCH_SIZE rows are
+# pending or every LOG_WRITER_FLUSH_INTERVAL_SECONDS. Requests block (and eventually
+# fail with 503) while more than LOG_WRITER_MAX_PENDING_ROWS rows are waiting.
+# A batch that cannot be written is retried with backoff until it is; rows are only
+# dropped on shutdown, after LOG_WRITER_MAX_RETRIES consecutive failures.
+LOG_WRITER_BATCH_SIZE = 5000
+LOG_WRITER_FLUSH_INTERVAL_SECONDS = 0.5
+LOG_WRITER_MAX_PENDING_ROWS = 100000
+LOG_WRITER_ENQUEUE_TIMEOUT_SECONDS = 5
+LOG_WRITER_MAX_RETRIES = 3
+
+# Concurrent /outlier/detect calls are coalesced into micro-batches: the entries that
+# arrive within DETECT_COALESCE_MAX_WAIT_MS of the oldest waiting one (at most
+# DETECT_COALESCE_MAX_BATCH_SIZE of them) are scored together, one predict call per
+# model. A batch size of 1 scores every call on its own.
+DETECT_COALESCE_MAX_WAIT_MS = 5
+DETECT_COALESCE_MAX_BATCH_SIZE = 256
+
+# Streaming detection (/outlier/detect_stream and /outlier/detect_ws): at most
+# STREAM_MAX_IN_FLIGHT lines of a stream are read ahead of the results sent back, so a
+# slow consumer slows the sender down instead of growing the server's memory.
+STREAM_MAX_IN_FLIGHT = 1024
+STREAM_MAX_LINE_BYTES = 65536
+
+# Multi-worker mode (python -m app.cluster): a gateway routes every log entry to one
+# of CLUSTER_WORKERS detection processes by consistent hashing on its ip_address, so
+# each IP's sliding window lives in exactly one worker.
+CLUSTER_WORKERS = 4
+CLUSTER_HASH_REPLICAS = 64
+CLUSTER_WORKER_STARTUP_TIMEOUT_SECONDS = 120
+
+# Logging: JSON lines on stderr, at LOG_LEVEL and above. Each message is logged at
+# most LOG_RATE_LIMIT_PER_INTERVAL times per LOG_RATE_LIMIT_INTERVAL_SECONDS; the
+# number of dropped records is reported on the next one.
+LOG_LEVEL = 'INFO'
+LOG_RATE_LIMIT_PER_INTERVAL = 20
+LOG_RATE_LIMIT_INTERVAL_SECONDS = 10
+
+# Metrics are served in Prometheus text format at /metrics. Pipeline tasks running
+# outside the API process (Airflow) write theirs to this file for node_exporter's
+# textfile collector when it is set, e.g. "/var/lib/node_exporter/outlier_pipeline.prom".
+METRICS_TEXTFILE_PATH = None
@@ -0,0 +1,98 @@
+import threading
+from sqlalchemy import create_engine, event, text
+from config import DB_URI
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+# The project's schema. The logs table matches what pandas.to_sql creates for the
+# generated sample logs, so databases created before these statements keep working.
+#
+# Logs are looked up by IP over a time range (window state on a cache miss) and
+# scanned by time range (feature jobs, retention), hence the two indexes. Instead of
+# day-partitioned tables, the retention job keeps the logs table bounded: rows older
+# than LOG_RETENTION_PERIOD are compacted into per-IP per-minute log_rollups.
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS logs (
+        timestamp DATETIME,
+        ip_address TEXT,
+        service_endpoint TEXT,
+        http_response_code BIGINT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_logs_ip_address_timestamp ON logs (ip_address, timestamp)",
+    "CREATE INDEX IF NOT EXISTS ix_logs_timestamp ON logs (timestamp)",
+    """
+    CREATE TABLE IF NOT EXISTS log_rollups (
+        ip_address TEXT NOT NULL,
+        minute DATETIME NOT NULL,
+        request_count BIGINT NOT NULL,
+        client_error_count BIGINT NOT NULL,
+        server_error_count BIGINT NOT NULL,
+        PRIMARY KEY (ip_address, minute)
+    )
+    """,
+    # Ground truth of the anomaly bursts injected by the sample data generator
+    """
+    CREATE TABLE IF NOT EXISTS anomaly_bursts (
+        ip_address TEXT NOT NULL,
+        start_time DATETIME NOT NULL,
+        end_time DATETIME NOT NULL,
+        kind TEXT NOT NULL,
+        request_count BIGINT NOT NULL
+    )
+    """,
+    # Small key/value store for pipeline bookkeeping, e.g. the feature job's watermark
+    """
+    CREATE TABLE IF NOT EXISTS pipeline_state (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """,
+]
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    # WAL lets readers (cache misses, feature jobs) run while the log writer commits.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+def ensure_schema(engine):
+    """
+    Creates the project's tables and indexes, if they do not exist yet.
+    """
+    with engine.begin() as connection:
+        for statement in SCHEMA_STATEMENTS:
+            connection.execute(text(statement))
+
+def get_engine(db_uri: str = DB_URI):
+    """
+    Returns the process-wide SQLAlchemy engine (and so the connection pool)
+    for db_uri, creating it and its schema on first use.
+    """
+    engine = _engines.get(db_uri)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(db_uri)
+            if engine is None:
+                engine = create_engine(db_uri, pool_pre_ping=True)
+                if engine.dialect.name == 'sqlite':
+                    event.listen(engine, 'connect', _configure_sqlite_connection)
+                ensure_schema(engine)
+                _engines[db_uri] = engine
+    return engine
+
+def get_pipeline_state(connection, key: str):
+    """
+    Returns the value stored under key in the pipeline_state table, or None.
+    """
+    return connection.execute(text("SELECT value FROM pipeline_state WHERE key = :key"), {'key': key}).scalar()
+
+def set_pipeline_state(connection, key: str, value: str):
+    connection.execute(
+        text("INSERT INTO pipeline_state (key, value) VALUES (:key, :value) ON CONFLICT (key) DO UPDATE SET value = excluded.value"),
+        {'key': key, 'value': value},
+    )
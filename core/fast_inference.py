@@ -0,0 +1,98 @@
+# PyCaret-free inference: the fitted pyod estimator, its threshold and the
+# pipeline's imputers folded into fill values, scored on plain NumPy arrays.
+import joblib
+import numpy as np
+import pandas as pd
+from config import NEIGHBOR_INDEX_LEAF_SIZE
+
+ARTIFACT_FORMAT_VERSION = 1
+
+
+def fast_model_path(model_path: str) -> str:
+    """
+    Returns the path of the fast inference artifact for a saved PyCaret model
+    path (given without the .pkl extension).
+    """
+    return f"{model_path}.fast.joblib"
+
+
+def _fold_preprocessing(pipeline, columns: list) -> np.ndarray:
+    """
+    Collapses the pipeline's preprocessing steps into one fill value per column
+    (NaN where the column is not imputed).
+    """
+    fill_values = np.full(len(columns), np.nan)
+    for name, step in pipeline.steps[:-1]:
+        include = getattr(step, '_include', None)
+        transformer = getattr(step, 'transformer', None)
+        if include is not None and len(include) == 0:
+            continue  # A wrapper without columns is a no-op
+        if transformer is None or not hasattr(transformer, 'statistics_'):
+            raise ValueError(f"Cannot fold pipeline step '{name}' into the fast inference path.")
+        for column, value in zip(transformer.feature_names_in_, transformer.statistics_):
+            fill_values[columns.index(column)] = float(value)
+    return fill_values
+
+
+def export_fast_model(pipeline, training_features: pd.DataFrame, path: str, compact_neighbors: bool = False):
+    """
+    Saves the fast inference artifact for a fitted PyCaret pipeline.
+
+    The dtype the pipeline hands to the estimator is taken from a transform of
+    the training features, so the fast path feeds the estimator exactly the
+    same values as predict_model does.
+
+    With compact_neighbors, a KNN or LOF estimator is saved as its compact
+    neighbor index (see core.neighbors); other estimators are saved as they are.
+    """
+    columns = list(training_features.columns)
+    estimator = pipeline.steps[-1][1]
+    transformed = pipeline[:-1].transform(training_features.head(1))
+    scorer = estimator
+    if compact_neighbors:
+        # Imported here: only training builds indexes, and the artifacts import it when loaded
+        from core.neighbors import compact_neighbor_model
+        scorer = compact_neighbor_model(estimator, NEIGHBOR_INDEX_LEAF_SIZE) or estimator
+    artifact = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'columns': columns,
+        'fill_values': _fold_preprocessing(pipeline, columns),
+        'dtype': np.result_type(*transformed.dtypes).str,
+        'estimator': scorer,
+        'threshold': float(estimator.threshold_),
+    }
+    joblib.dump(artifact, path)
+
+
+class FastModel:
+    """
+    A trained outlier model scored directly on NumPy feature arrays.
+    """
+    def __init__(self, artifact: dict):
+        if artifact.get('format_version') != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported fast inference artifact version: {artifact.get('format_version')}")
+        self.columns = artifact['columns']
+        self.fill_values = np.asarray(artifact['fill_values'], dtype=np.float64)
+        self.dtype = np.dtype(artifact['dtype'])
+        self.estimator = artifact['estimator']
+        self.threshold = artifact['threshold']
+        self._imputed = ~np.isnan(self.fill_values)
+
+    @classmethod
+    def load(cls, path: str) -> 'FastModel':
+        return cls(joblib.load(path))
+
+    def score(self, features: np.ndarray):
+        """
+        Scores a float64 array whose columns are in self.columns order.
+        Returns the (Anomaly, Anomaly_Score) arrays that predict_model would.
+        """
+        X = np.array(features, dtype=np.float64, ndmin=2)
+        if self._imputed.any():
+            missing = np.isnan(X) & self._imputed
+            if missing.any():
+                X[missing] = np.broadcast_to(self.fill_values, X.shape)[missing]
+        scores = self.estimator.decision_function(X.astype(self.dtype, copy=False))
+        # Same rule as pyod's predict(), without scoring the rows a second time
+        anomalies = (scores > self.threshold).astype(np.int64)
+        return anomalies, scores
@@ -0,0 +1,105 @@
+# Structured, rate-limited logging. Records are JSON objects with the message and
+# the fields passed as extra=..., e.g.
+#     logger.info("Cache miss", extra={'ip_address': ip_address})
+# Messages should be constant strings: the rate limit is kept per message. Records
+# are handed to a background thread, so logging never writes to a stream on the
+# request path.
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from config import LOG_LEVEL, LOG_RATE_LIMIT_PER_INTERVAL, LOG_RATE_LIMIT_INTERVAL_SECONDS
+
+ROOT_LOGGER = 'outlier_detector'
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most limit records per logger and message every interval
+    seconds. The next record let through reports how many were dropped.
+    """
+    def __init__(self, limit: int = LOG_RATE_LIMIT_PER_INTERVAL, interval: float = LOG_RATE_LIMIT_INTERVAL_SECONDS):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window_start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - window_start >= self.interval:
+                window_start, count = now, 0
+            if count >= self.limit:
+                self._windows[key] = (window_start, count, suppressed + 1)
+                return False
+            self._windows[key] = (window_start, count + 1, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class _StderrHandler(logging.StreamHandler):
+    # Resolves sys.stderr on every write, so redirections (e.g. by Airflow) are honored
+    @property
+    def stream(self):
+        return sys.stderr
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+_configure_lock = threading.Lock()
+_listener = None
+
+
+def _configure():
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+        records = queue.SimpleQueue()
+        # The QueueHandler formats each record into its JSON line; the listener only writes it
+        handler = logging.handlers.QueueHandler(records)
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(RateLimitFilter())
+        output = _StderrHandler()
+        output.setFormatter(logging.Formatter('%(message)s'))
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(LOG_LEVEL)
+        root.addHandler(handler)
+        root.propagate = False
+        _listener = logging.handlers.QueueListener(records, output)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Returns a logger under the service's root logger, e.g. get_logger('detector').
+    """
+    _configure()
+    return logging.getLogger(f'{ROOT_LOGGER}.{name}')
@@ -0,0 +1,115 @@
+# Precompiled decisions for the bounded integer feature space: every model's score
+# and the majority vote for each (request_count, client_error_count,
+# server_error_count) cell up to the observed maxima, looked up instead of scored.
+import json
+import os
+import numpy as np
+from core.log import get_logger
+from core.windows import FEATURE_COLUMNS
+
+LOOKUP_TABLE_FILE = 'lookup_table.json'
+LOOKUP_SCORES_FILE = 'lookup_scores.npy'
+LOOKUP_DECISIONS_FILE = 'lookup_decisions.npy'
+# Marks the cells that were not compiled (error counts above the request count)
+NOT_COMPILED = -1
+
+logger = get_logger('lookup_table')
+
+
+def _valid_cells(shape: tuple) -> np.ndarray:
+    """
+    Returns the (n, 3) coordinates of the cells whose error counts fit within
+    the request count, the only combinations a window can produce.
+    """
+    requests, client_errors, server_errors = np.indices(shape, sparse=True)
+    valid = np.broadcast_to(client_errors + server_errors <= requests, shape)
+    return np.argwhere(valid)
+
+
+def compile_lookup_table(models: dict, training_features, directory: str, max_counts: tuple, max_cells: int):
+    """
+    Scores every valid cell of the feature grid with each FastModel and saves
+    the scores and majority-vote decisions into directory. The grid spans
+    0..max observed value per feature, limited by max_counts.
+
+    Returns the table's metadata, or None when the grid has more than max_cells cells.
+    """
+    observed = training_features[FEATURE_COLUMNS].max().fillna(0).to_numpy()
+    shape = tuple(int(min(value, cap)) + 1 for value, cap in zip(observed, max_counts))
+    if np.prod(shape, dtype=np.int64) > max_cells:
+        logger.info("Skipping the lookup table: the grid is too large", extra={'shape': shape, 'max_cells': max_cells})
+        return None
+
+    cells = _valid_cells(shape)
+    names = list(models)
+    features = cells.astype(np.float64)
+    outputs = [models[name].score(features[:, [FEATURE_COLUMNS.index(c) for c in models[name].columns]]) for name in names]
+
+    scores = np.full(shape + (len(names),), np.nan, dtype=np.result_type(*(s.dtype for _, s in outputs)))
+    decisions = np.full(shape, NOT_COMPILED, dtype=np.int8)
+    index = tuple(cells.T)
+    votes = np.zeros(len(cells), dtype=np.int64)
+    for position, (anomalies, model_scores) in enumerate(outputs):
+        scores[index + (position,)] = model_scores
+        votes += anomalies
+    decisions[index] = votes >= len(names) / 2
+
+    np.save(os.path.join(directory, LOOKUP_SCORES_FILE), scores)
+    np.save(os.path.join(directory, LOOKUP_DECISIONS_FILE), decisions)
+    metadata = {
+        'models': names,
+        'thresholds': {name: models[name].threshold for name in names},
+        'shape': list(shape),
+        'compiled_cells': len(cells),
+    }
+    with open(os.path.join(directory, LOOKUP_TABLE_FILE), 'w') as f:
+        json.dump(metadata, f, indent=2)
+    logger.info("Compiled the lookup table", extra={'cells': len(cells), 'shape': shape, 'models': names})
+    return metadata
+
+
+class DecisionLookupTable:
+    """
+    A compiled lookup table, memory-mapped read-only so that every worker
+    process shares the page cache's copy.
+    """
+    def __init__(self, metadata: dict, scores: np.ndarray, decisions: np.ndarray):
+        self.models = metadata['models']
+        self.thresholds = np.array([metadata['thresholds'][name] for name in self.models])
+        self.scores = scores
+        self.decisions = decisions
+        self._upper = np.array(decisions.shape, dtype=np.int64)
+
+    @classmethod
+    def load(cls, directory: str):
+        """
+        Returns the table compiled into directory, or None if there is none.
+        """
+        metadata_path = os.path.join(directory, LOOKUP_TABLE_FILE)
+        if not os.path.exists(metadata_path):
+            return None
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        scores = np.load(os.path.join(directory, LOOKUP_SCORES_FILE), mmap_mode='r')
+        decisions = np.load(os.path.join(directory, LOOKUP_DECISIONS_FILE), mmap_mode='r')
+        return cls(metadata, scores, decisions)
+
+    def lookup(self, features: np.ndarray):
+        """
+        Looks up an (n, 3) array of feature counts in FEATURE_COLUMNS order.
+
+        Returns a boolean mask of the rows found in the table and, for those
+        rows, the (rows, models) anomaly flags and scores and the decisions.
+        """
+        counts = np.asarray(features, dtype=np.float64)
+        cells = counts.astype(np.int64)
+        covered = np.all((cells == counts) & (cells >= 0) & (cells < self._upper), axis=1)
+        index = tuple(cells[covered].T)
+        decisions = np.asarray(self.decisions[index])
+        # Valid windows never reach uncompiled cells, but do not trust the input
+        compiled = decisions != NOT_COMPILED
+        covered[covered] = compiled
+        index = tuple(component[compiled] for component in index)
+        scores = np.asarray(self.scores[index])
+        anomalies = (scores > self.thresholds).astype(np.int64)
+        return covered, anomalies, scores, decisions[compiled].astype(bool)
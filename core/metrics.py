@@ -0,0 +1,48 @@
+# Prometheus metrics of the service and the pipeline tasks, on prometheus_client's
+# default registry (rendered for /metrics with generate_latest).
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST as CONTENT_TYPE, REGISTRY, Counter, Gauge, Histogram,
+    disable_created_metrics, generate_latest, write_to_textfile,
+)
+
+# The *_created series hold a per-process timestamp, which the cluster gateway
+# would add up across workers.
+disable_created_metrics()
+
+# prometheus_client's default buckets start at 5ms; detection stages take well under that.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+# --- Pipeline Metrics ---
+# Shared by the feature and training tasks. When they run inside the API process they
+# are served at /metrics; Airflow runs write them to METRICS_TEXTFILE_PATH instead.
+PIPELINE_RUN_SECONDS = Histogram('pipeline_run_seconds', 'Duration of pipeline task runs.', ['task'], buckets=LATENCY_BUCKETS)
+PIPELINE_STAGE_SECONDS = Histogram('pipeline_stage_seconds', 'Time spent per stage of a pipeline task.', ['task', 'stage'], buckets=LATENCY_BUCKETS)
+PIPELINE_ROWS = Counter('pipeline_rows_total', 'Rows processed by pipeline tasks.', ['task'])
+PIPELINE_RUNS = Counter('pipeline_runs_total', 'Pipeline task runs by outcome.', ['task', 'outcome'])
+PIPELINE_LAST_SUCCESS = Gauge('pipeline_last_success_timestamp_seconds', 'Unix time of the last successful run.', ['task'])
+PIPELINE_SKIPS = Counter('pipeline_skips_total', 'Pipeline task runs that skipped their work, by reason.', ['task', 'reason'])
+PIPELINE_FEATURE_DRIFT = Gauge('pipeline_feature_drift', 'Largest population stability index of the recent features against those of the served models.')
+
+
+@contextmanager
+def pipeline_run(task: str, textfile_path: str = None):
+    """
+    Times a pipeline task run and records its outcome. Writes the registry to
+    textfile_path afterwards (for node_exporter's textfile collector), when given.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        PIPELINE_RUNS.labels(task=task, outcome='failure').inc()
+        raise
+    else:
+        PIPELINE_RUNS.labels(task=task, outcome='success').inc()
+        PIPELINE_LAST_SUCCESS.labels(task=task).set(time.time())
+    finally:
+        PIPELINE_RUN_SECONDS.labels(task=task).observe(time.perf_counter() - start)
+        if textfile_path:
+            write_to_textfile(textfile_path, REGISTRY)
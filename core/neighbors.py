@@ -0,0 +1,163 @@
+# Compact nearest-neighbor indexes for the LOF and KNN models. The features are small
+# integer counts, so a day of training rows holds few distinct vectors: the models
+# are scored against a KD-tree of the distinct vectors, each weighted by the number
+# of training rows it stands for, instead of against every training row.
+import numpy as np
+from sklearn.neighbors import KDTree
+from core.log import get_logger
+
+logger = get_logger('neighbors')
+
+# Distinct vectors whose neighbors are queried at once when fitting CompactLOF
+FIT_CHUNK_POINTS = 50000
+
+
+def _neighbor_weights(counts: np.ndarray, k: int) -> np.ndarray:
+    """
+    For the multiplicities of each query's distinct neighbors, nearest first,
+    returns how many copies of each fall within the query's k nearest rows.
+    """
+    cumulative = np.cumsum(counts, axis=1)
+    return np.clip(k - (cumulative - counts), 0, counts)
+
+
+def _kth_distance(distances: np.ndarray, counts: np.ndarray, rank: int) -> np.ndarray:
+    """
+    Returns the distance to the rank-th nearest row (0-based), counting every
+    distinct neighbor as many times as its multiplicity.
+    """
+    position = (np.cumsum(counts, axis=1) <= rank).sum(axis=1)
+    return distances[np.arange(len(distances)), position]
+
+
+def _tie_shared_weights(distances: np.ndarray, counts: np.ndarray, k: int) -> np.ndarray:
+    """
+    Like _neighbor_weights, but the rows tied at the distance of the k-th
+    nearest row share the remaining weight in proportion to their multiplicity,
+    so the weights do not depend on the order in which ties are returned.
+    """
+    kth = _kth_distance(distances, counts, k - 1)[:, np.newaxis]
+    tied = np.isclose(distances, kth, rtol=1e-12, atol=0)
+    inside = np.where((distances < kth) & ~tied, counts, 0)
+    tied_counts = np.where(tied, counts, 0)
+    remaining = k - inside.sum(axis=1, keepdims=True)
+    return inside + tied_counts * remaining / tied_counts.sum(axis=1, keepdims=True)
+
+
+class _CompactIndex:
+    """
+    A KD-tree over the distinct training vectors, with their multiplicities.
+    """
+    def __init__(self, points: np.ndarray, counts: np.ndarray, n_neighbors: int, metric: str, metric_params: dict, leaf_size: int):
+        self.counts = counts
+        self.n_neighbors = n_neighbors
+        self.tree = KDTree(points, leaf_size=leaf_size, metric=metric, **(metric_params or {}))
+
+    @property
+    def n_points(self) -> int:
+        return len(self.counts)
+
+    def query(self, X: np.ndarray, n_distinct: int):
+        """
+        Returns the distances, indices and multiplicities of the n_distinct
+        nearest distinct vectors to each row of X, nearest first.
+        """
+        distances, indices = self.tree.query(X, k=min(n_distinct, self.n_points))
+        return distances, indices, self.counts[indices]
+
+
+class CompactKNN:
+    """
+    Scores like a fitted pyod KNN, with identical scores: the distance to the
+    k-th nearest training row (or the mean or median of the k distances).
+    """
+    def __init__(self, index: _CompactIndex, method: str):
+        self.index = index
+        self.method = method
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        k = self.index.n_neighbors
+        # Every distinct vector counts at least once, so k of them always cover k rows
+        distances, _, counts = self.index.query(X, k)
+        if self.method == 'largest':
+            return _kth_distance(distances, counts, k - 1)
+        if self.method == 'mean':
+            return (distances * _neighbor_weights(counts, k)).sum(axis=1) / k
+        return (_kth_distance(distances, counts, (k - 1) // 2) + _kth_distance(distances, counts, k // 2)) / 2
+
+
+class CompactLOF:
+    """
+    Scores like a fitted pyod LOF: the mean local reachability density of the
+    k nearest training rows over that of the scored row.
+
+    On integer features many rows tie for the k-th nearest neighbor, and the
+    full model keeps whichever its tree returns first, so shuffling the
+    training rows changes some of its decisions. Here the tied rows share the
+    remaining weight instead, for the training rows' densities as well as for
+    the scored rows. Scores therefore differ from the full model's where it
+    broke such a tie, and do not depend on the order of the training rows.
+    """
+    def __init__(self, index: _CompactIndex):
+        self.index = index
+        self.k_distances = np.empty(index.n_points)
+        self.lrd = np.empty(index.n_points)
+        # The k-distances of all the neighbors are needed before any density
+        for start in range(0, index.n_points, FIT_CHUNK_POINTS):
+            distances, _, counts = self._training_neighbors(start)
+            self.k_distances[start:start + FIT_CHUNK_POINTS] = _kth_distance(distances, counts, index.n_neighbors - 1)
+        for start in range(0, index.n_points, FIT_CHUNK_POINTS):
+            self.lrd[start:start + FIT_CHUNK_POINTS] = self._density(*self._training_neighbors(start))
+
+    def _training_neighbors(self, start: int):
+        """
+        Returns the neighbors of the distinct vectors from start on: the other
+        training rows, so one copy of the vector itself (its nearest) less.
+        """
+        points = np.asarray(self.index.tree.data[start:start + FIT_CHUNK_POINTS])
+        distances, indices, counts = self.index.query(points, 2 * self.index.n_neighbors + 1)
+        counts = counts.copy()
+        counts[:, 0] -= 1
+        return distances, indices, counts
+
+    def _density(self, distances: np.ndarray, indices: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        k = self.index.n_neighbors
+        weights = _tie_shared_weights(distances, counts, k)
+        reach_distances = np.maximum(distances, self.k_distances[indices])
+        # Same as LocalOutlierFactor, including its 1e-10 for duplicated rows
+        return 1.0 / ((reach_distances * weights).sum(axis=1) / k + 1e-10)
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        k = self.index.n_neighbors
+        # Twice k distinct vectors, so that the rows tied with the k-th nearest are included
+        distances, indices, counts = self.index.query(X, 2 * k)
+        X_lrd = self._density(distances, indices, counts)
+        return (self.lrd[indices] * _tie_shared_weights(distances, counts, k)).sum(axis=1) / k / X_lrd
+
+
+def compact_neighbor_model(estimator, leaf_size: int):
+    """
+    Returns a compact stand-in for a fitted pyod KNN or LOF estimator, scored
+    against the distinct training vectors, or None for other estimators and
+    for metrics a KD-tree does not support.
+    """
+    from pyod.models.knn import KNN
+    from pyod.models.lof import LOF
+
+    if isinstance(estimator, KNN):
+        neighbors = estimator.neigh_
+    elif isinstance(estimator, LOF):
+        neighbors = estimator.detector_
+    else:
+        return None
+    if neighbors.effective_metric_ not in KDTree.valid_metrics:
+        return None
+
+    training_X = neighbors._fit_X
+    points, counts = np.unique(training_X, axis=0, return_counts=True)
+    n_neighbors = estimator.n_neighbors if isinstance(estimator, KNN) else neighbors.n_neighbors_
+    index = _CompactIndex(points, counts, n_neighbors, neighbors.effective_metric_, neighbors.effective_metric_params_, leaf_size)
+    logger.info("Built a compact neighbor index", extra={'rows': len(training_X), 'distinct_rows': index.n_points})
+    if isinstance(estimator, KNN):
+        return CompactKNN(index, estimator.method)
+    return CompactLOF(index)
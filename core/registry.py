@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import time
+import pandas as pd
+from config import MODEL_REGISTRY_DIR, MODEL_REGISTRY_KEEP_VERSIONS, MODEL_REGISTRY_INCOMPLETE_GRACE_PERIOD
+
+# A version directory is complete once its manifest has been written; training
+# writes the manifest last, so a half-written version is never listed or loaded.
+MANIFEST_FILE = 'manifest.json'
+# Holds the name of the version the detection service should serve.
+CURRENT_FILE = 'CURRENT'
+
+
+def _write_atomically(path: str, content: str):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+def version_dir(version: str, registry_dir: str = MODEL_REGISTRY_DIR) -> str:
+    return os.path.join(registry_dir, version)
+
+
+def model_path(version: str, model_name: str, registry_dir: str = MODEL_REGISTRY_DIR) -> str:
+    """
+    Returns the path (without the .pkl extension) of a model within a version.
+    """
+    return os.path.join(version_dir(version, registry_dir), f'outlier_model_{model_name}')
+
+
+def create_version(registry_dir: str = MODEL_REGISTRY_DIR) -> str:
+    """
+    Creates an empty directory for a new model version and returns its name.
+    Version names sort in creation order.
+    """
+    os.makedirs(registry_dir, exist_ok=True)
+    while True:
+        version = pd.Timestamp.now(tz='UTC').strftime('v%Y%m%dT%H%M%S%fZ')
+        try:
+            os.mkdir(version_dir(version, registry_dir))
+            return version
+        except FileExistsError:
+            continue
+
+
+def write_manifest(version: str, manifest: dict, registry_dir: str = MODEL_REGISTRY_DIR):
+    manifest = {'version': version, 'created_at': pd.Timestamp.now(tz='UTC').isoformat(), **manifest}
+    _write_atomically(os.path.join(version_dir(version, registry_dir), MANIFEST_FILE), json.dumps(manifest, indent=2))
+
+
+def read_manifest(version: str, registry_dir: str = MODEL_REGISTRY_DIR) -> dict:
+    with open(os.path.join(version_dir(version, registry_dir), MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def list_versions(registry_dir: str = MODEL_REGISTRY_DIR) -> list:
+    """
+    Returns the complete versions, oldest first.
+    """
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(registry_dir)
+        if os.path.isfile(os.path.join(registry_dir, name, MANIFEST_FILE))
+    )
+
+
+def get_current_version(registry_dir: str = MODEL_REGISTRY_DIR):
+    try:
+        with open(os.path.join(registry_dir, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def set_current_version(version: str, registry_dir: str = MODEL_REGISTRY_DIR):
+    """
+    Points the registry at a complete version. Used both to publish a newly
+    trained version and to roll back to an earlier one.
+    """
+    if version not in list_versions(registry_dir):
+        raise ValueError(f"Model version '{version}' does not exist or is incomplete.")
+    _write_atomically(os.path.join(registry_dir, CURRENT_FILE), version)
+
+
+def previous_version(registry_dir: str = MODEL_REGISTRY_DIR):
+    """
+    Returns the complete version just before the current one, if any.
+    """
+    versions = list_versions(registry_dir)
+    current = get_current_version(registry_dir)
+    if current not in versions:
+        return None
+    position = versions.index(current)
+    return versions[position - 1] if position > 0 else None
+
+
+def prune_versions(keep: int = MODEL_REGISTRY_KEEP_VERSIONS, registry_dir: str = MODEL_REGISTRY_DIR,
+                   grace_period: str = MODEL_REGISTRY_INCOMPLETE_GRACE_PERIOD):
+    """
+    Deletes all but the newest keep versions, never the current one, along
+    with incomplete versions left behind by failed training runs: those not
+    modified for grace_period, as younger ones may still be being written.
+    """
+    current = get_current_version(registry_dir)
+    versions = list_versions(registry_dir)
+    stale = [version for version in versions[:-keep] if version != current]
+    if os.path.isdir(registry_dir):
+        cutoff = time.time() - pd.Timedelta(grace_period).total_seconds()
+        stale += [
+            name for name in os.listdir(registry_dir)
+            if os.path.isdir(os.path.join(registry_dir, name)) and name not in versions
+            and os.path.getmtime(os.path.join(registry_dir, name)) < cutoff
+        ]
+    for version in stale:
+        shutil.rmtree(version_dir(version, registry_dir), ignore_errors=True)
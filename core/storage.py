@@ -0,0 +1,466 @@
+# Storage of the 'logs' and 'features' tables read and written by the batch jobs
+# (feature processing, training, sample data). STORAGE_BACKEND selects it:
+#   'sqlite'  - tables in the project database (the default);
+#   'parquet' - date-partitioned Parquet datasets under PARQUET_STORAGE_DIR, read
+#               with column projection, partition pruning and predicate pushdown
+#               over memory-mapped files. Needs pyarrow.
+# Pipeline bookkeeping (pipeline_state) and the detection service's own log writes
+# and window look-ups always use the database, so the detection service only runs
+# with the 'sqlite' backend (see check_storage_backend in app.services.outlier_detector).
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from config import STORAGE_BACKEND, PARQUET_STORAGE_DIR
+from core.db import ensure_schema
+from core.windows import DB_TIMESTAMP_FORMAT
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+LOG_COLUMNS = ['timestamp', 'ip_address', 'service_endpoint', 'http_response_code']
+
+# Logs are always read in (timestamp, rowid) order, so that rows sharing a
+# timestamp are aggregated in the same order by full and incremental runs.
+READ_LOGS_SQL = """
+SELECT timestamp, ip_address, service_endpoint, http_response_code
+FROM logs
+WHERE timestamp > :since
+ORDER BY timestamp, rowid
+"""
+
+# One page of READ_LOGS_SQL after the (timestamp, rowid) of the previous page's last row.
+# The range on timestamp alone keeps the scan on ix_logs_timestamp.
+READ_LOGS_PAGE_SQL = """
+SELECT rowid, timestamp, ip_address, service_endpoint, http_response_code
+FROM logs
+WHERE timestamp >= :after_timestamp AND (timestamp > :after_timestamp OR rowid > :after_rowid)
+ORDER BY timestamp, rowid
+LIMIT :limit
+"""
+
+COUNT_FEATURES_PER_IP_SQL = """
+SELECT ip_address, COUNT(*) AS row_count
+FROM features
+WHERE timestamp >= :since
+GROUP BY ip_address
+"""
+
+# Changes with every insert (rowid), deletion (count) and compaction of old logs (range)
+SUMMARIZE_LOGS_SQL = "SELECT COUNT(*), MIN(timestamp), MAX(timestamp), MAX(rowid) FROM logs"
+
+INSERT_LOGS_SQL = "INSERT INTO logs (timestamp, ip_address, service_endpoint, http_response_code) VALUES (?, ?, ?, ?)"
+INSERT_BURSTS_SQL = "INSERT INTO anomaly_bursts (ip_address, start_time, end_time, kind, request_count) VALUES (?, ?, ?, ?, ?)"
+
+
+def _db_timestamps(timestamps: pd.Series) -> list:
+    # DB_TIMESTAMP_FORMAT, formatted vectorized rather than with strftime per row
+    return np.char.replace(np.datetime_as_string(timestamps.to_numpy(dtype='datetime64[us]'), unit='us'), 'T', ' ').tolist()
+
+
+def _timestamp_range(path: str) -> tuple:
+    """
+    Returns the smallest and largest timestamp of a Parquet file, from its statistics.
+    """
+    metadata = pq.ParquetFile(path).metadata
+    column = metadata.schema.names.index('timestamp')
+    statistics = [metadata.row_group(i).column(column).statistics for i in range(metadata.num_row_groups)]
+    statistics = [s for s in statistics if s is not None and s.has_min_max]
+    return min(s.min for s in statistics), max(s.max for s in statistics)
+
+
+def _read_batches(path: str, columns: list, batch_size, after=None):
+    """
+    Yields the record batches of a Parquet file, without the rows at or
+    before the timestamp after when given.
+    """
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    for batch in parquet_file.iter_batches(batch_size=batch_size or parquet_file.metadata.num_rows or 1, columns=columns):
+        if after is not None:
+            batch = batch.filter(pc.greater(batch['timestamp'], after))
+        if batch.num_rows:
+            yield batch
+
+
+def _merge_sorted(sources: list, chunk_rows):
+    """
+    Merges iterators of record batches, each sorted by timestamp, into tables
+    of at most chunk_rows rows (everything at once when chunk_rows is None) in
+    timestamp order. Rows sharing a timestamp keep the order of the sources.
+
+    A source's rows below the last loaded timestamp of every other source can
+    no longer be preceded by unread rows: those are merged and handed out,
+    and the source that set the bound loads its next batch.
+    """
+    buffers = [None] * len(sources)
+    active = set()
+
+    def load(i):
+        batch = next(sources[i], None)
+        if batch is None:
+            active.discard(i)
+            return
+        active.add(i)
+        table = pa.Table.from_batches([batch])
+        buffers[i] = table if buffers[i] is None else pa.concat_tables([buffers[i], table])
+
+    for i in range(len(sources)):
+        load(i)
+    while True:
+        last_timestamps = {i: buffers[i]['timestamp'][-1].as_py() for i in active}
+        bound = min(last_timestamps.values()) if active else None
+        ready = []
+        for i, buffer in enumerate(buffers):
+            if buffer is None or not buffer.num_rows:
+                continue
+            if bound is None:
+                count = buffer.num_rows
+            else:
+                count = int(pc.sum(pc.less(buffer['timestamp'], pa.scalar(bound, type=buffer.schema.field('timestamp').type))).as_py() or 0)
+            if count:
+                ready.append(buffer.slice(0, count))
+                buffers[i] = buffer.slice(count)
+        if ready:
+            merged = pa.concat_tables(ready)
+            # Stable: equal timestamps stay in source order
+            merged = merged.take(pc.sort_indices(merged, sort_keys=[('timestamp', 'ascending')]))
+            step = chunk_rows or max(merged.num_rows, 1)
+            for offset in range(0, merged.num_rows, step):
+                yield merged.slice(offset, step)
+        if not active:
+            return
+        for i, last_timestamp in last_timestamps.items():
+            if last_timestamp == bound:
+                load(i)
+
+
+def _to_pandas(table) -> pd.DataFrame:
+    # Parquet keeps microseconds; the feature code works on nanosecond timestamps
+    df = table.to_pandas()
+    if 'timestamp' in df:
+        df['timestamp'] = df['timestamp'].astype('datetime64[ns]')
+    return df
+
+
+class SQLiteStorage:
+    def __init__(self, engine):
+        self.engine = engine
+
+    # --- Logs ---
+
+    def iter_logs(self, since: pd.Timestamp, chunk_rows):
+        """
+        Yields the logs newer than since in (timestamp, rowid) order, as DataFrames
+        of at most chunk_rows rows (all rows at once when chunk_rows is None).
+
+        Each chunk is read in its own short transaction, continuing after the
+        last row of the previous one, so no read stays open while the caller
+        commits between chunks.
+        """
+        if not chunk_rows:
+            with self.engine.connect() as connection:
+                yield pd.read_sql(text(READ_LOGS_SQL), connection, params={'since': since.strftime(DB_TIMESTAMP_FORMAT)})
+            return
+        params = {'after_timestamp': since.strftime(DB_TIMESTAMP_FORMAT), 'after_rowid': 2**63 - 1, 'limit': chunk_rows}
+        while True:
+            with self.engine.connect() as connection:
+                chunk_df = pd.read_sql(text(READ_LOGS_PAGE_SQL), connection, params=params)
+            if chunk_df.empty:
+                return
+            params['after_timestamp'], params['after_rowid'] = chunk_df['timestamp'].iloc[-1], int(chunk_df['rowid'].iloc[-1])
+            yield chunk_df.drop(columns='rowid')
+            if len(chunk_df) < chunk_rows:
+                return
+
+    def summarize_logs(self, connection) -> list:
+        """
+        Returns a cheap summary of the logs table that changes whenever rows
+        are added or removed, for fingerprinting its content.
+        """
+        return list(connection.execute(text(SUMMARIZE_LOGS_SQL)).one())
+
+    def write_logs(self, chunks) -> int:
+        """
+        Inserts DataFrames of logs with executemany, one transaction per chunk.
+        Returns the number of rows written.
+        """
+        ensure_schema(self.engine)
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            written_rows = 0
+            for chunk_df in chunks:
+                cursor.executemany(INSERT_LOGS_SQL, zip(
+                    _db_timestamps(chunk_df['timestamp']), chunk_df['ip_address'].tolist(),
+                    chunk_df['service_endpoint'].tolist(), chunk_df['http_response_code'].tolist()))
+                connection.commit()
+                written_rows += len(chunk_df)
+            return written_rows
+        finally:
+            connection.close()
+
+    def write_anomaly_bursts(self, bursts: pd.DataFrame):
+        ensure_schema(self.engine)
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(INSERT_BURSTS_SQL, list(zip(
+                bursts['ip_address'].tolist(), _db_timestamps(bursts['start_time']), _db_timestamps(bursts['end_time']),
+                bursts['kind'].tolist(), bursts['request_count'].tolist())))
+
+    # --- Features ---
+
+    def has_features(self, connection) -> bool:
+        return connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'features'")).first() is not None
+
+    def begin_features(self, connection, watermark: pd.Timestamp = None):
+        """
+        Prepares a feature run: drops all features for a full rebuild (watermark
+        None), or the features at or after the watermark for an incremental run.
+        """
+        if watermark is None:
+            # Dropped before the logs are read: SQLite cannot drop a table while a query is running
+            connection.execute(text("DROP TABLE IF EXISTS features"))
+        else:
+            connection.execute(
+                text("DELETE FROM features WHERE timestamp >= :watermark"),
+                {'watermark': watermark.strftime(DB_TIMESTAMP_FORMAT)},
+            )
+
+    def append_features(self, connection, features_df: pd.DataFrame):
+        features_df.to_sql('features', connection, if_exists='append', index=False)
+
+    def finish_features(self, connection):
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_features_timestamp ON features (timestamp)"))
+
+    def count_features_per_ip(self, connection, since: pd.Timestamp) -> pd.Series:
+        params = {'since': since.strftime(DB_TIMESTAMP_FORMAT)}
+        return pd.read_sql(text(COUNT_FEATURES_PER_IP_SQL), connection, params=params).set_index('ip_address')['row_count']
+
+    def iter_features(self, connection, since: pd.Timestamp, columns: list, chunk_rows=None):
+        """
+        Yields the given columns of the features at or after since, as DataFrames
+        of at most chunk_rows rows (all rows at once when chunk_rows is None).
+        """
+        query = text(f"SELECT {', '.join(columns)} FROM features WHERE timestamp >= :since")
+        params = {'since': since.strftime(DB_TIMESTAMP_FORMAT)}
+        if not chunk_rows:
+            yield pd.read_sql(query, connection, params=params)
+            return
+        streaming_connection = connection.execution_options(stream_results=True)
+        yield from pd.read_sql(query, streaming_connection, params=params, chunksize=chunk_rows)
+
+
+class ParquetStorage:
+    """
+    Keeps logs and features as Parquet datasets partitioned by day
+    (<directory>/<table>/date=YYYY-MM-DD/part-*.parquet). Files are named in
+    write order, so rows sharing a timestamp keep their order on reads. Each
+    file is written under a temporary name that readers ignore, then renamed.
+
+    Each logs file is sorted by timestamp, so reading the logs in order merges
+    the sorted files of a day in one stream, a batch of each file at a time.
+    Files are never rewritten to keep a day in order.
+
+    Like the SQLite tables, a feature run replaces the features from its
+    watermark on in begin_features and then appends chunk by chunk, so a
+    failed run keeps the chunks written before its last watermark. Only the
+    files that span the watermark are rewritten, batch by batch.
+    """
+    def __init__(self, engine, directory: str = PARQUET_STORAGE_DIR):
+        if pa is None:
+            raise ImportError("The 'parquet' storage backend needs pyarrow (pip install pyarrow).")
+        self.engine = engine
+        self.directory = directory
+        self._filesystem = pafs.LocalFileSystem(use_mmap=True)
+        self._partitioning = ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+
+    def _table_dir(self, table: str) -> str:
+        return os.path.join(self.directory, table)
+
+    def _dates(self, table_dir: str, since: pd.Timestamp) -> list:
+        if not os.path.isdir(table_dir):
+            return []
+        dates = sorted(name.split('=', 1)[1] for name in os.listdir(table_dir) if name.startswith('date='))
+        return [date for date in dates if since is None or date >= since.strftime('%Y-%m-%d')]
+
+    def _dataset(self, table_dir: str):
+        return ds.dataset(table_dir, format='parquet', partitioning=self._partitioning, filesystem=self._filesystem)
+
+    def _filter(self, date: str = None, since: pd.Timestamp = None, inclusive: bool = False):
+        expression = None
+        if date is not None:
+            expression = ds.field('date') == date
+        if since is not None and since > pd.Timestamp.min:
+            bound = pa.scalar(since.to_pydatetime(), type=pa.timestamp('us'))
+            condition = ds.field('timestamp') >= bound if inclusive else ds.field('timestamp') > bound
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def _files(self, partition_dir: str) -> list:
+        # In write order; files starting with '_' are being written
+        return sorted(os.path.join(partition_dir, name) for name in os.listdir(partition_dir) if not name.startswith('_'))
+
+    def _write_file(self, partition_dir: str, schema, batches):
+        name = f'part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.parquet'
+        # Datasets skip files starting with '_'
+        temporary_path = os.path.join(partition_dir, f'_{name}')
+        with pq.ParquetWriter(temporary_path, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+        os.replace(temporary_path, os.path.join(partition_dir, name))
+
+    def _write(self, table_dir: str, df: pd.DataFrame, sort: bool = False):
+        """
+        Appends df to the dataset at table_dir, one new file per day, sorted by
+        timestamp when sort is set.
+        """
+        df = df.assign(timestamp=df['timestamp'].astype('datetime64[us]'))
+        days = df['timestamp'].dt.strftime('%Y-%m-%d')
+        for date, day_df in df.groupby(days, sort=True):
+            partition_dir = os.path.join(table_dir, f'date={date}')
+            os.makedirs(partition_dir, exist_ok=True)
+            if sort:
+                day_df = day_df.sort_values('timestamp', kind='stable')
+            table = pa.Table.from_pandas(day_df, preserve_index=False)
+            self._write_file(partition_dir, table.schema, table.to_batches())
+
+    # --- Logs ---
+
+    def iter_logs(self, since: pd.Timestamp, chunk_rows):
+        """
+        Yields the logs newer than since in timestamp order, as DataFrames of
+        at most chunk_rows rows (a whole day when chunk_rows is None). The
+        sorted files of a day are merged from record batches that share
+        chunk_rows, so memory use is set by chunk_rows and not by the day.
+        """
+        table_dir = self._table_dir('logs')
+        dates = self._dates(table_dir, since)
+        if not dates:
+            yield pd.DataFrame(columns=LOG_COLUMNS)
+            return
+        bound = pa.scalar(since.to_pydatetime(), type=pa.timestamp('us')) if since > pd.Timestamp.min else None
+        for date in dates:
+            paths = self._files(os.path.join(table_dir, f'date={date}'))
+            # Files entirely at or before since have nothing to read
+            paths = [path for path in paths if bound is None or _timestamp_range(path)[1] > bound.as_py()]
+            if not paths:
+                continue
+            batch_size = max(chunk_rows // len(paths), 1024) if chunk_rows else None
+            sources = [_read_batches(path, LOG_COLUMNS, batch_size, bound) for path in paths]
+            for table in _merge_sorted(sources, chunk_rows):
+                yield _to_pandas(table)
+
+    def summarize_logs(self, connection) -> list:
+        """
+        Returns the names and sizes of the logs files. Files are never
+        modified, only added or removed, so this changes with the content.
+        """
+        table_dir = self._table_dir('logs')
+        files = []
+        for date in self._dates(table_dir, None):
+            partition_dir = os.path.join(table_dir, f'date={date}')
+            files.extend([f'{date}/{name}', os.path.getsize(os.path.join(partition_dir, name))]
+                         for name in sorted(os.listdir(partition_dir)) if not name.startswith('_'))
+        return files
+
+    def write_logs(self, chunks) -> int:
+        written_rows = 0
+        for chunk_df in chunks:
+            self._write(self._table_dir('logs'), chunk_df, sort=True)
+            written_rows += len(chunk_df)
+        return written_rows
+
+    def drop_partitions(self, table: str, cutoff: pd.Timestamp) -> list:
+        """
+        Deletes the day partitions of table whose whole day is before cutoff
+        and returns their dates.
+        """
+        table_dir = self._table_dir(table)
+        dropped = [date for date in self._dates(table_dir, None) if pd.Timestamp(date) + pd.Timedelta(days=1) <= cutoff]
+        for date in dropped:
+            shutil.rmtree(os.path.join(table_dir, f'date={date}'))
+        return dropped
+
+    def write_anomaly_bursts(self, bursts: pd.DataFrame):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, 'anomaly_bursts.parquet')
+        if os.path.exists(path):
+            bursts = pd.concat([pd.read_parquet(path), bursts], ignore_index=True)
+        bursts.to_parquet(path, index=False)
+
+    # --- Features ---
+
+    def has_features(self, connection) -> bool:
+        return bool(self._dates(self._table_dir('features'), None))
+
+    def begin_features(self, connection, watermark: pd.Timestamp = None):
+        """
+        Drops all features (watermark None), or the rows at or after the
+        watermark: files entirely after it are deleted, and the files that
+        span it are rewritten without those rows, batch by batch.
+        """
+        table_dir = self._table_dir('features')
+        if watermark is None:
+            shutil.rmtree(table_dir, ignore_errors=True)
+            return
+        bound = watermark.to_pydatetime()
+        for date in self._dates(table_dir, watermark):
+            partition_dir = os.path.join(table_dir, f'date={date}')
+            for path in self._files(partition_dir):
+                first_timestamp, last_timestamp = _timestamp_range(path)
+                if last_timestamp < bound:
+                    continue
+                if first_timestamp < bound:
+                    parquet_file = pq.ParquetFile(path)
+                    batches = (batch.filter(pc.less(batch['timestamp'], pa.scalar(bound, type=pa.timestamp('us'))))
+                               for batch in parquet_file.iter_batches())
+                    self._write_file(partition_dir, parquet_file.schema_arrow, (batch for batch in batches if batch.num_rows))
+                os.remove(path)
+
+    def append_features(self, connection, features_df: pd.DataFrame):
+        self._write(self._table_dir('features'), features_df)
+
+    def finish_features(self, connection):
+        pass
+
+    def count_features_per_ip(self, connection, since: pd.Timestamp) -> pd.Series:
+        table_dir = self._table_dir('features')
+        if not self._dates(table_dir, since):
+            return pd.Series(dtype='int64', name='row_count', index=pd.Index([], name='ip_address'))
+        ips = self._dataset(table_dir).to_table(columns=['ip_address'], filter=self._filter(since=since, inclusive=True))
+        counts = ips.group_by('ip_address').aggregate([('ip_address', 'count')]).to_pandas()
+        return counts.set_index('ip_address')['ip_address_count'].rename('row_count')
+
+    def iter_features(self, connection, since: pd.Timestamp, columns: list, chunk_rows=None):
+        table_dir = self._table_dir('features')
+        if not self._dates(table_dir, since):
+            yield pd.DataFrame(columns=columns)
+            return
+        dataset = self._dataset(table_dir)
+        expression = self._filter(since=since, inclusive=True)
+        if not chunk_rows:
+            yield _to_pandas(dataset.to_table(columns=columns, filter=expression))
+            return
+        for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=chunk_rows):
+            if batch.num_rows:
+                yield _to_pandas(batch)
+
+
+def get_storage(engine, backend: str = STORAGE_BACKEND):
+    """
+    Returns the configured storage of the logs and features tables. engine is
+    the project database, which keeps the pipeline state with either backend.
+    """
+    if backend == 'sqlite':
+        return SQLiteStorage(engine)
+    if backend == 'parquet':
+        return ParquetStorage(engine)
+    raise ValueError(f"Unknown storage backend '{backend}'. Use 'sqlite' or 'parquet'.")
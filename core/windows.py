@@ -0,0 +1,177 @@
+from collections import deque
+import numpy as np
+import pandas as pd
+from config import FEATURE_WINDOW_INTERVAL
+
+# The model input columns, in the order the models were trained on.
+FEATURE_COLUMNS = ['request_count', 'client_error_count', 'server_error_count']
+
+# Timestamps are stored in SQLite as text in this layout (what pandas.to_sql writes).
+DB_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def window_nanoseconds(interval: str = FEATURE_WINDOW_INTERVAL) -> int:
+    """
+    Returns the length of a pandas offset alias (e.g. '5min') in nanoseconds.
+    """
+    return int(pd.Timedelta(interval).value)
+
+
+def to_naive_utc(timestamps) -> pd.Series:
+    """
+    Parses timestamps and normalizes them to timezone-naive UTC, which is how
+    they are stored in the 'logs' table.
+    """
+    parsed = pd.to_datetime(pd.Series(timestamps), format='ISO8601')
+    if parsed.dt.tz is not None:
+        parsed = parsed.dt.tz_convert('UTC').dt.tz_localize(None)
+    return parsed.astype('datetime64[ns]')
+
+
+def error_flags(http_response_codes):
+    """
+    Returns (client_error, server_error) 0/1 arrays for the given response codes.
+    """
+    codes = np.asarray(http_response_codes)
+    client_error = ((codes >= 400) & (codes < 500)).astype(np.int64)
+    server_error = ((codes >= 500) & (codes < 600)).astype(np.int64)
+    return client_error, server_error
+
+
+class IPWindowState:
+    """
+    The events of a single IP address that fall inside the trailing feature
+    window, kept in timestamp order together with running totals.
+
+    Adding an in-order event appends to the ring and evicts the events that
+    aged out, so each event costs amortized O(1). The counts returned for an
+    event follow the same (t - window, t] semantics as the pandas time-based
+    rolling window used by process_log_data_from_db.
+    """
+    __slots__ = ('window_ns', '_events', 'request_count', 'client_error_count', 'server_error_count')
+
+    def __init__(self, window_ns: int):
+        self.window_ns = window_ns
+        self._events = deque()
+        self.request_count = 0
+        self.client_error_count = 0
+        self.server_error_count = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    @property
+    def latest_timestamp(self):
+        return self._events[-1][0] if self._events else None
+
+    def counts(self) -> tuple:
+        return self.request_count, self.client_error_count, self.server_error_count
+
+    def add(self, timestamp_ns: int, client_error: int, server_error: int) -> tuple:
+        """
+        Records an event and returns the (request_count, client_error_count,
+        server_error_count) features for it.
+        """
+        events = self._events
+        if not events or timestamp_ns >= events[-1][0]:
+            events.append((timestamp_ns, client_error, server_error))
+            self.request_count += 1
+            self.client_error_count += client_error
+            self.server_error_count += server_error
+            self._evict(timestamp_ns - self.window_ns)
+            return self.counts()
+        return self._add_out_of_order(timestamp_ns, client_error, server_error)
+
+    def extend(self, timestamps_ns, client_errors, server_errors) -> np.ndarray:
+        """
+        Records a sequence of events and returns their features as an (n, 3) array.
+        A large batch of events in timestamp order is processed in one vectorized
+        pass; anything else falls back to adding the events one at a time.
+        """
+        timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+        client_errors = np.asarray(client_errors, dtype=np.int64)
+        server_errors = np.asarray(server_errors, dtype=np.int64)
+        if len(timestamps_ns) == 0:
+            return np.empty((0, 3), dtype=np.int64)
+
+        # The vectorized pass copies the retained events, so it only pays off for
+        # batches larger than the current window.
+        in_order = bool(np.all(np.diff(timestamps_ns) >= 0))
+        if not in_order or len(timestamps_ns) <= len(self._events) or (self._events and timestamps_ns[0] < self._events[-1][0]):
+            return np.array([
+                self.add(ts, client, server)
+                for ts, client, server in zip(timestamps_ns.tolist(), client_errors.tolist(), server_errors.tolist())
+            ], dtype=np.int64)
+
+        previous = np.array(self._events, dtype=np.int64).reshape(-1, 3)
+        all_timestamps = np.concatenate((previous[:, 0], timestamps_ns))
+        all_client_errors = np.concatenate((previous[:, 1], client_errors))
+        all_server_errors = np.concatenate((previous[:, 2], server_errors))
+        counts = rolling_window_counts(all_timestamps, all_client_errors, all_server_errors, self.window_ns)
+
+        # Keep only the events that are still inside the window of the newest one
+        first_kept = int(np.searchsorted(all_timestamps, all_timestamps[-1] - self.window_ns, side='right'))
+        self._events = deque(zip(
+            all_timestamps[first_kept:].tolist(),
+            all_client_errors[first_kept:].tolist(),
+            all_server_errors[first_kept:].tolist(),
+        ))
+        self.request_count = len(self._events)
+        self.client_error_count = int(all_client_errors[first_kept:].sum())
+        self.server_error_count = int(all_server_errors[first_kept:].sum())
+        return counts[len(previous):]
+
+    def _evict(self, cutoff_ns: int):
+        events = self._events
+        while events and events[0][0] <= cutoff_ns:
+            _, client_error, server_error = events.popleft()
+            self.request_count -= 1
+            self.client_error_count -= client_error
+            self.server_error_count -= server_error
+
+    def _add_out_of_order(self, timestamp_ns: int, client_error: int, server_error: int) -> tuple:
+        # A late event is scored at its own timestamp, against the events at or
+        # before it. Events that were already evicted cannot be taken into account.
+        request_count, client_error_count, server_error_count = 1, client_error, server_error
+        position = 0
+        for position, (ts, client, server) in enumerate(self._events):
+            if ts > timestamp_ns:
+                break
+            if ts > timestamp_ns - self.window_ns:
+                request_count += 1
+                client_error_count += client
+                server_error_count += server
+
+        if timestamp_ns > self._events[-1][0] - self.window_ns:
+            self._events.insert(position, (timestamp_ns, client_error, server_error))
+            self.request_count += 1
+            self.client_error_count += client_error
+            self.server_error_count += server_error
+        return request_count, client_error_count, server_error_count
+
+
+def rolling_window_counts(timestamps_ns, client_errors, server_errors, window_ns: int, request_flags=None) -> np.ndarray:
+    """
+    Vectorized equivalent of a pandas time-based rolling count/sum over events
+    sorted by timestamp: row i aggregates the rows j <= i with
+    timestamps_ns[j] > timestamps_ns[i] - window_ns.
+
+    Returns an (n, 3) int64 array of request, client error and server error
+    counts. Requests are counted per row, or summed from request_flags when
+    given (to mirror a pandas 'count', which skips missing values).
+    """
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    n = len(timestamps_ns)
+    positions = np.arange(n)
+    window_starts = np.searchsorted(timestamps_ns, timestamps_ns - window_ns, side='right')
+
+    counts = np.empty((n, 3), dtype=np.int64)
+    if request_flags is None:
+        counts[:, 0] = positions - window_starts + 1
+    else:
+        cumulative = np.concatenate(([0], np.cumsum(np.asarray(request_flags, dtype=np.int64))))
+        counts[:, 0] = cumulative[positions + 1] - cumulative[window_starts]
+    for column, flags in ((1, client_errors), (2, server_errors)):
+        cumulative = np.concatenate(([0], np.cumsum(np.asarray(flags, dtype=np.int64))))
+        counts[:, column] = cumulative[positions + 1] - cumulative[window_starts]
+    return counts
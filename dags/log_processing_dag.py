@@ -1,7 +1,9 @@
 from airflow.decorators import dag, task
+from airflow.exceptions import AirflowSkipException
 from pendulum import datetime
 from dags.tasks.processing import process_log_data_from_db
-from dags.tasks.training import train_outlier_models
+from dags.tasks.training import prepare_training_run, train_model_for_run, publish_training_run
+from dags.tasks.retention import apply_log_retention
 from config import MODELS_TO_TRAIN
 
 @dag(
@@ -19,20 +21,54 @@ def log_processing_and_training_dag():
     @task
     def run_feature_engineering_from_db():
         """
-        This task runs the main feature engineering logic.
+        This task runs the main feature engineering logic. It does nothing when
+        neither the logs nor the feature configuration changed since its last run.
         """
         process_log_data_from_db()
 
     @task
-    def run_model_training():
+    def prepare_model_training():
         """
-        This task trains multiple outlier detection models on the newly generated features.
+        This task decides whether the models need retraining and creates the
+        new model version. When the served models are up to date, it and the
+        training tasks are skipped, and the detection service is not reloaded.
         """
-        print(f"Starting training for models: {MODELS_TO_TRAIN}")
-        train_outlier_models(model_names=MODELS_TO_TRAIN)
+        run = prepare_training_run(model_names=MODELS_TO_TRAIN)
+        if run is None:
+            raise AirflowSkipException("The served models are up to date.")
+        return run
 
-    # Define the task dependency
-    run_feature_engineering_from_db() >> run_model_training()
+    @task
+    def train_model(model_name: str, run: dict):
+        """
+        This task trains one outlier detection model of the new version. It is
+        mapped over MODELS_TO_TRAIN, so the models train as parallel tasks.
+        """
+        return train_model_for_run(model_name, run)
+
+    @task
+    def publish_models(run: dict, results: list):
+        """
+        This task publishes the trained version and notifies the running API
+        service (whether local or in Docker) to reload the models.
+        """
+        publish_training_run(run, list(results))
+
+    @task
+    def run_log_retention():
+        """
+        This task compacts logs older than the retention period into per-minute
+        rollups, or drops their day partitions with the 'parquet' storage backend.
+        """
+        apply_log_retention()
+
+    # Define the task dependencies. Retention runs after feature engineering,
+    # so logs are only compacted once their features have been generated.
+    features = run_feature_engineering_from_db()
+    run = prepare_model_training()
+    results = train_model.partial(run=run).expand(model_name=MODELS_TO_TRAIN)
+    features >> [run, run_log_retention()]
+    publish_models(run, results)
 
 # Instantiate the DAG
 log_processing_and_training_dag()
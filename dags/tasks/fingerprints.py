@@ -0,0 +1,47 @@
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+
+def fingerprint(value) -> str:
+    """
+    Returns a SHA-256 hex digest of value's JSON, with keys sorted, so equal
+    inputs give the same fingerprint across runs and processes.
+    """
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+def _bin_fractions(values: np.ndarray, edges: list) -> np.ndarray:
+    bins = np.searchsorted(np.asarray(edges, dtype=np.float64), values, side='right')
+    return np.bincount(bins, minlength=len(edges) + 1) / max(len(values), 1)
+
+def feature_profile(features_df: pd.DataFrame, bins: int) -> dict:
+    """
+    Summarizes the distribution of each feature column as the fractions of
+    rows in (up to) bins quantile bins. Integer counts often share quantiles,
+    in which case their bins merge.
+    """
+    profile = {}
+    for column in features_df.columns:
+        values = features_df[column].dropna().to_numpy(dtype=np.float64)
+        if len(values):
+            edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1])).tolist()
+        else:
+            edges = []
+        profile[column] = {'edges': edges, 'fractions': _bin_fractions(values, edges).tolist()}
+    return profile
+
+def population_stability_index(profile: dict, features_df: pd.DataFrame) -> float:
+    """
+    Returns the largest population stability index, over the profiled
+    columns, of features_df against the profile's bins: 0 for the same
+    distribution, conventionally above 0.1 for a shift and above 0.25 for a
+    large one.
+    """
+    drift = 0.0
+    for column, reference in profile.items():
+        values = features_df[column].dropna().to_numpy(dtype=np.float64)
+        # Empty bins are floored, as the index is undefined for them
+        expected = np.maximum(np.asarray(reference['fractions']), 1e-4)
+        actual = np.maximum(_bin_fractions(values, reference['edges']), 1e-4)
+        drift = max(drift, float(np.sum((actual - expected) * np.log(actual / expected))))
+    return drift
@@ -1,49 +1,255 @@
+import json
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
-from config import DB_URI, FEATURE_WINDOW_INTERVAL
+from config import (
+    DB_URI, FEATURE_WINDOW_INTERVAL, FEATURE_CHUNK_ROWS, FEATURE_ENGINE, FEATURE_WORKERS,
+    METRICS_TEXTFILE_PATH, STORAGE_BACKEND,
+)
+from core.db import ensure_schema, get_engine, get_pipeline_state, set_pipeline_state
+from core.log import get_logger
+from core.metrics import PIPELINE_ROWS, PIPELINE_SKIPS, PIPELINE_STAGE_SECONDS, pipeline_run
+from core.storage import get_storage
+from core.windows import DB_TIMESTAMP_FORMAT, FEATURE_COLUMNS, error_flags, rolling_window_counts, window_nanoseconds
+from dags.tasks.fingerprints import fingerprint
 
-def process_log_data_from_db():
+# pipeline_state key of the newest log timestamp whose features have been saved.
+# Logs that arrive later with an older timestamp than this are not processed
+# incrementally; a full rebuild picks them up.
+FEATURES_WATERMARK_KEY = 'features_watermark'
+# pipeline_state key of the fingerprints of the feature configuration and of the
+# logs the saved features were computed from (JSON).
+FEATURES_FINGERPRINT_KEY = 'features_fingerprint'
+TASK_NAME = 'process_log_data'
+
+logger = get_logger('processing')
+
+def _compute_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Generates the rolling window features for the given logs, one row per log.
+    """
+    # Convert timestamp and set as index
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format='ISO8601')
+    df = df.set_index('timestamp').sort_index(kind='stable')
+
+    # Create helper columns for error types
+    df['client_error'] = ((df['http_response_code'] >= 400) & (df['http_response_code'] < 500)).astype(int)
+    df['server_error'] = ((df['http_response_code'] >= 500) & (df['http_response_code'] < 600)).astype(int)
+
+    # Define aggregations
+    aggregations = {
+        'service_endpoint': 'count',
+        'client_error': 'sum',
+        'server_error': 'sum'
+    }
+
+    # Group by IP and apply rolling aggregations using the configurable window
+    features_df = df.groupby('ip_address').rolling(FEATURE_WINDOW_INTERVAL).agg(aggregations)
+
+    # Clean up column names and reset index
+    features_df.columns = ['request_count', 'client_error_count', 'server_error_count']
+    return features_df.reset_index()
+
+def _compute_features_numpy(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    NumPy version of _compute_features with identical output: the logs are
+    sorted by (IP, timestamp) and every window is found with one searchsorted
+    pass instead of a pandas rolling window per IP.
+    """
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format='ISO8601')
+    # Like groupby, drop logs without an IP
+    df = df[df['ip_address'].notna()]
+    codes, ips = pd.factorize(df['ip_address'], sort=True)
+    timestamps = df['timestamp'].to_numpy().astype('int64')
+
+    # lexsort is stable, so logs sharing a timestamp keep their read order
+    order = np.lexsort((timestamps, codes))
+    codes, timestamps = codes[order], timestamps[order]
+    client_errors, server_errors = error_flags(df['http_response_code'].to_numpy()[order])
+    has_endpoint = df['service_endpoint'].notna().to_numpy()[order]
+
+    window_ns = window_nanoseconds(FEATURE_WINDOW_INTERVAL)
+    counts = np.empty((len(order), 3), dtype=np.int64)
+    if len(order):
+        # Offset each IP's timestamps by more than a window, so that one sorted key
+        # covers all IPs and no window reaches into the previous IP.
+        stride = int(timestamps.max() - timestamps.min()) + window_ns + 1
+        if len(ips) * stride < 2**62:
+            keys = codes.astype(np.int64) * stride + (timestamps - timestamps.min())
+            counts[:] = rolling_window_counts(keys, client_errors, server_errors, window_ns, has_endpoint)
+        else:
+            boundaries = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1, [len(codes)]))
+            for start, end in zip(boundaries[:-1], boundaries[1:]):
+                counts[start:end] = rolling_window_counts(
+                    timestamps[start:end], client_errors[start:end], server_errors[start:end], window_ns, has_endpoint[start:end])
+
+    features_df = pd.DataFrame({
+        'ip_address': ips.to_numpy()[codes],
+        'timestamp': timestamps.astype('datetime64[ns]'),
+    })
+    for column, values in zip(FEATURE_COLUMNS, counts.T):
+        features_df[column] = values.astype(np.float64)
+    return features_df
+
+def _compute_features_parallel(df: pd.DataFrame, executor: ProcessPoolExecutor, workers: int) -> pd.DataFrame:
+    """
+    Hash-partitions the logs by IP into one shard per worker, computes each
+    shard with _compute_features_numpy in the process pool and merges the
+    results in _compute_features order.
+    """
+    codes, ips = pd.factorize(df['ip_address'])
+    ip_shards = np.array([zlib.crc32(str(ip).encode()) % workers for ip in ips], dtype=np.int64)
+    row_shards = np.where(codes >= 0, ip_shards[codes], 0)
+    futures = [executor.submit(_compute_features_numpy, df[row_shards == shard]) for shard in range(workers)]
+    features_df = pd.concat([future.result() for future in futures], ignore_index=True)
+    # Each shard is ordered by (IP, time); a stable sort on IP restores the global order
+    return features_df.sort_values('ip_address', kind='stable', ignore_index=True)
+
+def _compute_chunk_features(chunk_df: pd.DataFrame, carry_df: pd.DataFrame, compute_features=_compute_features):
+    """
+    Generates the features of one time-ordered chunk of logs. carry_df holds the
+    logs of the previous chunks that are still inside the window of this
+    chunk's first rows; they feed the windows but get no feature rows.
+
+    Returns the chunk's features and the carry for the next chunk.
+    """
+    chunk_df['timestamp'] = pd.to_datetime(chunk_df['timestamp'], format='ISO8601')
+    combined_df = pd.concat([carry_df, chunk_df], ignore_index=True) if not carry_df.empty else chunk_df.reset_index(drop=True)
+    features_df = compute_features(combined_df.copy())
+
+    # Features are ordered by IP, then time, and the carried logs precede the chunk's
+    # logs of the same IP, so they are the first rows of each IP.
+    carried_per_ip = carry_df['ip_address'].value_counts()
+    position_in_ip = features_df.groupby('ip_address', sort=False).cumcount()
+    is_carried = position_in_ip < features_df['ip_address'].map(carried_per_ip).fillna(0)
+    features_df = features_df[~is_carried.to_numpy()]
+
+    # Later chunks only contain logs at or after this chunk's last timestamp
+    window_start = combined_df['timestamp'].iloc[-1] - pd.Timedelta(FEATURE_WINDOW_INTERVAL)
+    next_carry_df = combined_df[combined_df['timestamp'] > window_start]
+    return features_df, next_carry_df
+
+def _make_feature_function(feature_engine: str, workers: int, stack: ExitStack):
+    """
+    Returns the function that computes the features of a DataFrame of logs
+    for the configured engine. A process pool is registered on stack.
+    """
+    if feature_engine == 'pandas':
+        return _compute_features
+    if feature_engine != 'numpy':
+        raise ValueError(f"Unknown feature engine '{feature_engine}'. Use 'pandas' or 'numpy'.")
+    if workers > 1:
+        executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+        return partial(_compute_features_parallel, executor=executor, workers=workers)
+    return _compute_features_numpy
+
+@pipeline_run(TASK_NAME, METRICS_TEXTFILE_PATH)
+def process_log_data_from_db(full_rebuild: bool = False, chunk_rows: int = FEATURE_CHUNK_ROWS,
+                             feature_engine: str = FEATURE_ENGINE, workers: int = FEATURE_WORKERS,
+                             storage_backend: str = STORAGE_BACKEND):
     """
     Loads log data from the 'logs' table, generates features over a
     configurable sliding window, and saves the result to the 'features' table.
+
+    By default only the logs at or after the persisted watermark are processed
+    (plus one window of look-back for their rolling features) and the new
+    feature rows are appended. A full rebuild recomputes and replaces the whole
+    'features' table; it also runs when there is no watermark yet.
+
+    Logs are streamed in time-ordered chunks of chunk_rows rows, carrying each
+    IP's open window from one chunk to the next. Each chunk's features are
+    committed in their own transaction together with the watermark, so a
+    failed run resumes from its last committed chunk. Memory use is set by
+    chunk_rows rather than by the size of the table; chunk_rows=None processes
+    all logs in one DataFrame.
+
+    feature_engine selects pandas rolling windows or the vectorized NumPy
+    engine, which shards the IPs over a pool of worker processes when
+    workers > 1. Both produce the same features.
+
+    Logs and features are read and written through the storage_backend (see
+    core.storage); the watermark is kept in the database.
+
+    The run is skipped when neither the logs nor the feature configuration
+    changed since the last run, and becomes a full rebuild when the
+    configuration (e.g. FEATURE_WINDOW_INTERVAL) changed.
     """
-    print("Connecting to the database...")
+    logger.info("Connecting to the database")
     try:
-        engine = create_engine(DB_URI)
-        
-        # Read data from the 'logs' table
-        print("Reading data from 'logs' table...")
-        df = pd.read_sql_table('logs', engine)
-
-        # Convert timestamp and set as index
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df = df.set_index('timestamp').sort_index()
-
-        # Create helper columns for error types
-        df['client_error'] = ((df['http_response_code'] >= 400) & (df['http_response_code'] < 500)).astype(int)
-        df['server_error'] = ((df['http_response_code'] >= 500) & (df['http_response_code'] < 600)).astype(int)
-
-        # Define aggregations
-        aggregations = {
-            'service_endpoint': 'count',
-            'client_error': 'sum',
-            'server_error': 'sum'
-        }
-
-        # Group by IP and apply rolling aggregations using the configurable window
-        print(f"Generating features with a '{FEATURE_WINDOW_INTERVAL}' rolling window...")
-        features_df = df.groupby('ip_address').rolling(FEATURE_WINDOW_INTERVAL).agg(aggregations)
-
-        # Clean up column names and reset index
-        features_df.columns = ['request_count', 'client_error_count', 'server_error_count']
-        features_df = features_df.reset_index()
-
-        # Save the features to the 'features' table
-        print("Saving features to 'features' table...")
-        features_df.to_sql('features', engine, if_exists='replace', index=False)
-        
-        print("Processing complete.")
+        engine = get_engine(DB_URI)
+        ensure_schema(engine)
+        storage = get_storage(engine, storage_backend)
+
+        with ExitStack() as stack:
+            compute_features = _make_feature_function(feature_engine, workers, stack)
+            with engine.connect() as connection:
+                fingerprints = {
+                    'config': fingerprint({'window': FEATURE_WINDOW_INTERVAL, 'columns': FEATURE_COLUMNS, 'storage': storage_backend}),
+                    'logs': fingerprint(storage.summarize_logs(connection)),
+                }
+                previous = json.loads(get_pipeline_state(connection, FEATURES_FINGERPRINT_KEY) or '{}')
+                has_features = storage.has_features(connection)
+                watermark = get_pipeline_state(connection, FEATURES_WATERMARK_KEY)
+            if not full_rebuild and has_features and previous == fingerprints:
+                logger.info("Logs and feature configuration unchanged, skipping")
+                PIPELINE_SKIPS.labels(task=TASK_NAME, reason='unchanged').inc()
+                return
+            if previous.get('config', fingerprints['config']) != fingerprints['config']:
+                logger.info("Feature configuration changed, rebuilding all features")
+                full_rebuild = True
+
+            incremental = not full_rebuild and watermark is not None and has_features
+            if incremental:
+                watermark = pd.Timestamp(watermark)
+                since = watermark - pd.Timedelta(FEATURE_WINDOW_INTERVAL)
+                logger.info("Reading logs newer than the watermark", extra={'watermark': watermark, 'look_back_from': since})
+            else:
+                since = pd.Timestamp.min
+                logger.info("Reading all logs for a full rebuild")
+
+            # Each chunk's features are committed together with the watermark of its last log,
+            # so a failed run resumes incrementally from the last committed chunk. Only the
+            # first chunk's transaction drops the features being replaced.
+            logger.info("Generating features", extra={'window': FEATURE_WINDOW_INTERVAL, 'engine': feature_engine, 'workers': workers})
+            carry_df = pd.DataFrame(columns=['timestamp', 'ip_address', 'service_endpoint', 'http_response_code'])
+            new_watermark = None
+            saved_rows = 0
+            chunks = storage.iter_logs(since, chunk_rows)
+            while True:
+                with PIPELINE_STAGE_SECONDS.labels(task=TASK_NAME, stage='read').time():
+                    chunk_df = next(chunks, None)
+                if chunk_df is None:
+                    break
+                if chunk_df.empty:
+                    continue
+                PIPELINE_ROWS.labels(task=TASK_NAME).inc(len(chunk_df))
+                with PIPELINE_STAGE_SECONDS.labels(task=TASK_NAME, stage='compute').time():
+                    features_df, carry_df = _compute_chunk_features(chunk_df, carry_df, compute_features)
+                if incremental:
+                    # Look-back rows only feed the windows; their features were saved by an earlier run
+                    features_df = features_df[features_df['timestamp'] >= watermark]
+                with PIPELINE_STAGE_SECONDS.labels(task=TASK_NAME, stage='write').time(), engine.begin() as connection:
+                    if new_watermark is None:
+                        # Rows at the watermark itself are recomputed, in case more logs with that timestamp arrived.
+                        storage.begin_features(connection, watermark if incremental else None)
+                    storage.append_features(connection, features_df)
+                    new_watermark = chunk_df['timestamp'].iloc[-1]
+                    set_pipeline_state(connection, FEATURES_WATERMARK_KEY, new_watermark.strftime(DB_TIMESTAMP_FORMAT))
+                saved_rows += len(features_df)
+
+        with engine.begin() as connection:
+            if new_watermark is not None:
+                storage.finish_features(connection)
+            set_pipeline_state(connection, FEATURES_FINGERPRINT_KEY, json.dumps(fingerprints))
+        if new_watermark is None:
+            logger.info("No new logs to process")
+            return
+        logger.info("Saved features", extra={'rows': saved_rows})
+        logger.info("Processing complete")
 
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error("Feature processing failed", extra={'error': str(e)})
         raise
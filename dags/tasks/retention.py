@@ -0,0 +1,106 @@
+import pandas as pd
+from sqlalchemy import text
+from config import DB_URI, FEATURE_WINDOW_INTERVAL, LOG_RETENTION_PERIOD, TRAINING_HORIZON, STORAGE_BACKEND
+from core.db import ensure_schema, get_engine, get_pipeline_state
+from core.log import get_logger
+from core.storage import get_storage
+from dags.tasks.processing import FEATURES_WATERMARK_KEY
+from core.windows import DB_TIMESTAMP_FORMAT
+
+logger = get_logger('retention')
+
+# Adds the logs of one day before the cutoff to the rollups. The upsert keeps
+# minutes that were already partly rolled up by an earlier run correct.
+# ('\\:00' stops SQLAlchemy from reading ':00' as a bind parameter.)
+ROLLUP_LOGS_SQL = """
+INSERT INTO log_rollups (ip_address, minute, request_count, client_error_count, server_error_count)
+SELECT
+    ip_address,
+    substr(timestamp, 1, 16) || '\\:00' AS minute,
+    COUNT(*),
+    SUM(CASE WHEN http_response_code >= 400 AND http_response_code < 500 THEN 1 ELSE 0 END),
+    SUM(CASE WHEN http_response_code >= 500 AND http_response_code < 600 THEN 1 ELSE 0 END)
+FROM logs
+WHERE timestamp >= :batch_start AND timestamp < :batch_end
+GROUP BY ip_address, minute
+ON CONFLICT (ip_address, minute) DO UPDATE SET
+    request_count = request_count + excluded.request_count,
+    client_error_count = client_error_count + excluded.client_error_count,
+    server_error_count = server_error_count + excluded.server_error_count
+"""
+
+DELETE_LOGS_SQL = "DELETE FROM logs WHERE timestamp >= :batch_start AND timestamp < :batch_end"
+
+def retention_cutoff(now: pd.Timestamp = None) -> pd.Timestamp:
+    """
+    Returns the timestamp before which raw logs are compacted, aligned to a
+    minute so that a minute is never split between logs and rollups.
+    """
+    if pd.Timedelta(LOG_RETENTION_PERIOD) < pd.Timedelta(TRAINING_HORIZON) + pd.Timedelta(FEATURE_WINDOW_INTERVAL):
+        raise ValueError("LOG_RETENTION_PERIOD must cover TRAINING_HORIZON plus one FEATURE_WINDOW_INTERVAL.")
+    now = pd.Timestamp.now() if now is None else now
+    return (now - pd.Timedelta(LOG_RETENTION_PERIOD)).floor('min')
+
+def _drop_parquet_partitions(engine, cutoff: pd.Timestamp, storage_backend: str):
+    # Parquet datasets are partitioned by day, so whole days are dropped rather than compacted
+    storage = get_storage(engine, storage_backend)
+    for table in ('logs', 'features'):
+        dropped = storage.drop_partitions(table, cutoff)
+        logger.info("Dropped old partitions", extra={'table': table, 'dates': dropped, 'cutoff': cutoff})
+
+def apply_log_retention(cutoff: pd.Timestamp = None, storage_backend: str = STORAGE_BACKEND):
+    """
+    Compacts logs older than the retention cutoff into per-IP per-minute
+    rollups and deletes them, one day per transaction. Features older than
+    the cutoff are deleted as well, since training never reads them.
+
+    With the 'parquet' storage backend, the logs and features partitions of
+    the days before the cutoff are deleted instead.
+    """
+    logger.info("Connecting to the database for log retention")
+    try:
+        engine = get_engine(DB_URI)
+        ensure_schema(engine)
+        cutoff = retention_cutoff() if cutoff is None else cutoff
+
+        with engine.connect() as connection:
+            oldest = connection.execute(text("SELECT MIN(timestamp) FROM logs")).scalar()
+            watermark = get_pipeline_state(connection, FEATURES_WATERMARK_KEY)
+        if watermark is not None:
+            # Keep the look-back the next incremental feature run still needs
+            cutoff = min(cutoff, (pd.Timestamp(watermark) - pd.Timedelta(FEATURE_WINDOW_INTERVAL)).floor('min'))
+        if storage_backend != 'sqlite':
+            _drop_parquet_partitions(engine, cutoff, storage_backend)
+            logger.info("Log retention complete")
+            return
+        if oldest is None or pd.Timestamp(oldest) >= cutoff:
+            logger.info("No logs older than the cutoff to compact", extra={'cutoff': cutoff})
+        else:
+            batch_start = pd.Timestamp(oldest).floor('D')
+            compacted_rows = 0
+            while batch_start < cutoff:
+                batch_end = min(batch_start + pd.Timedelta(days=1), cutoff)
+                params = {
+                    'batch_start': batch_start.strftime(DB_TIMESTAMP_FORMAT),
+                    'batch_end': batch_end.strftime(DB_TIMESTAMP_FORMAT),
+                }
+                with engine.begin() as connection:
+                    connection.execute(text(ROLLUP_LOGS_SQL), params)
+                    compacted_rows += connection.execute(text(DELETE_LOGS_SQL), params).rowcount
+                batch_start = batch_end
+            logger.info("Compacted old logs into 'log_rollups'", extra={'rows': compacted_rows, 'cutoff': cutoff})
+
+        with engine.begin() as connection:
+            has_features = connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'features'")).first()
+            if has_features:
+                deleted = connection.execute(
+                    text("DELETE FROM features WHERE timestamp < :cutoff"),
+                    {'cutoff': cutoff.strftime(DB_TIMESTAMP_FORMAT)},
+                ).rowcount
+                logger.info("Deleted old feature rows", extra={'rows': deleted, 'cutoff': cutoff})
+
+        logger.info("Log retention complete")
+
+    except Exception as e:
+        logger.error("Log retention failed", extra={'error': str(e)})
+        raise
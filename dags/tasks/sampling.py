@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+def allocate_quotas(counts_per_ip: pd.Series, max_rows: int) -> pd.Series:
+    """
+    Splits max_rows over the IPs in proportion to their row counts (largest
+    remainder method), so the sample keeps the traffic mix of the full data.
+    An IP never gets more rows than it has.
+    """
+    total = int(counts_per_ip.sum())
+    if total <= max_rows:
+        return counts_per_ip.astype(np.int64)
+    exact = counts_per_ip * (max_rows / total)
+    quotas = np.floor(exact).astype(np.int64)
+    shortfall = max_rows - int(quotas.sum())
+    if shortfall > 0:
+        remainders = (exact - quotas).sort_values(ascending=False, kind='stable')
+        quotas[remainders.index[:shortfall]] += 1
+    return quotas
+
+class StratifiedReservoirSampler:
+    """
+    Streaming sample without replacement, stratified by IP.
+
+    Every row gets a uniform random key and each IP keeps the rows with its
+    quota smallest keys (bottom-k reservoir sampling), which is a uniform sample
+    of that IP's rows. Only the reservoir and the current chunk are in memory.
+    """
+    def __init__(self, quotas: pd.Series, seed: int = None):
+        self.quotas = quotas
+        self.rng = np.random.default_rng(seed)
+        self._reservoir = None
+
+    def add(self, chunk_df: pd.DataFrame):
+        chunk_df = chunk_df.assign(_sample_key=self.rng.random(len(chunk_df)))
+        candidates = chunk_df if self._reservoir is None else pd.concat([self._reservoir, chunk_df], ignore_index=True)
+        candidates = candidates.sort_values(['ip_address', '_sample_key'], kind='stable')
+        rank = candidates.groupby('ip_address', sort=False).cumcount()
+        quota = candidates['ip_address'].map(self.quotas).fillna(0)
+        self._reservoir = candidates[(rank < quota).to_numpy()]
+
+    def sample(self) -> pd.DataFrame:
+        if self._reservoir is None:
+            return pd.DataFrame()
+        return self._reservoir.drop(columns='_sample_key').reset_index(drop=True)
@@ -1,59 +1,279 @@
-import pandas as pd
-from sqlalchemy import create_engine
-from pycaret.anomaly import setup, create_model, save_model
-from config import DB_URI, MODELS_TO_TRAIN
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from pycaret.anomaly import AnomalyExperiment
+from config import (
+    DB_URI, MODELS_TO_TRAIN, TRAINING_HORIZON, TRAINING_MAX_ROWS,
+    TRAINING_SAMPLE_SEED, TRAINING_WORKERS, FEATURE_CHUNK_ROWS,
+    LOOKUP_TABLE_ENABLED, LOOKUP_TABLE_MAX_COUNTS, LOOKUP_TABLE_MAX_CELLS,
+    METRICS_TEXTFILE_PATH, STORAGE_BACKEND, NEIGHBOR_INDEX_COMPACT_MODELS, NEIGHBOR_INDEX_LEAF_SIZE,
+    FEATURE_WINDOW_INTERVAL, TRAINING_DRIFT_THRESHOLD, TRAINING_DRIFT_BINS, TRAINING_MAX_MODEL_AGE,
+)
+from core import registry
+from core.db import ensure_schema, get_engine, get_pipeline_state
+from core.fast_inference import FastModel, export_fast_model, fast_model_path
+from core.log import get_logger
+from core.lookup_table import compile_lookup_table
+from core.metrics import PIPELINE_FEATURE_DRIFT, PIPELINE_ROWS, PIPELINE_SKIPS, PIPELINE_STAGE_SECONDS, pipeline_run
+from core.storage import get_storage
+from core.windows import FEATURE_COLUMNS
+from dags.tasks.fingerprints import feature_profile, fingerprint, population_stability_index
+from dags.tasks.processing import FEATURES_FINGERPRINT_KEY
+from dags.tasks.sampling import StratifiedReservoirSampler, allocate_quotas
 import requests
 
 # The URL for the running outlier detection service
 DETECTION_SERVICE_URL = "http://127.0.0.1:8000"
+TASK_NAME = 'train_models'
+# Training features of a version being trained, read by the models' tasks; removed on publishing
+TRAINING_FEATURES_FILE = 'training_features.pkl'
+
+logger = get_logger('training')
 
-def train_outlier_models(model_names: list = MODELS_TO_TRAIN):
+def load_training_features(engine, max_rows: int = TRAINING_MAX_ROWS, seed: int = TRAINING_SAMPLE_SEED,
+                           storage_backend: str = STORAGE_BACKEND) -> pd.DataFrame:
     """
-    Trains multiple outlier detection models and then triggers a reload
-    in the running detection service.
+    Reads the features of the last TRAINING_HORIZON, filtering in the storage
+    (SQL, or predicate pushdown on Parquet) and reading only the feature
+    columns. When there are more than max_rows rows, a reservoir sample
+    stratified by IP is taken while streaming the rows, so memory stays
+    bounded by max_rows.
     """
-    print("Connecting to the database for model training...")
+    storage = get_storage(engine, storage_backend)
+    horizon_start = pd.Timestamp.now() - pd.Timedelta(TRAINING_HORIZON)
+    columns = ['ip_address'] + FEATURE_COLUMNS
+    with engine.connect() as connection:
+        counts_per_ip = storage.count_features_per_ip(connection, horizon_start)
+        if counts_per_ip.empty:
+            return pd.DataFrame(columns=FEATURE_COLUMNS)
+        if max_rows is None or counts_per_ip.sum() <= max_rows:
+            return next(storage.iter_features(connection, horizon_start, columns))[FEATURE_COLUMNS]
+
+        logger.info("Sampling feature rows stratified by IP", extra={'sample_rows': max_rows, 'total_rows': int(counts_per_ip.sum()), 'ips': len(counts_per_ip)})
+        sampler = StratifiedReservoirSampler(allocate_quotas(counts_per_ip, max_rows), seed=seed)
+        for chunk_df in storage.iter_features(connection, horizon_start, columns, FEATURE_CHUNK_ROWS):
+            sampler.add(chunk_df)
+        return sampler.sample()[FEATURE_COLUMNS]
+
+def _train_single_model(model_name: str, training_features: pd.DataFrame, session_id: int, version: str) -> dict:
+    """
+    Trains one model in its own PyCaret experiment, saves it with its fast
+    inference artifact into the given registry version and records the
+    training time and sample size in outlier_model_<name>.json. Runs in a
+    worker process.
+    """
+    logger.info("Training model", extra={'model': model_name})
+    start = time.perf_counter()
+    experiment = AnomalyExperiment()
+    experiment.setup(data=training_features, session_id=session_id, verbose=False, html=False)
+    model = experiment.create_model(model_name, verbose=False)
+    training_seconds = time.perf_counter() - start
+
+    model_path = registry.model_path(version, model_name)
+    logger.info("Saving the trained model", extra={'model': model_name, 'path': f'{model_path}.pkl'})
+    pipeline, _ = experiment.save_model(model, model_path, verbose=False)
+
+    logger.info("Exporting the fast inference artifact", extra={'model': model_name, 'path': fast_model_path(model_path)})
+    export_fast_model(pipeline, training_features, fast_model_path(model_path),
+                      compact_neighbors=model_name in NEIGHBOR_INDEX_COMPACT_MODELS)
+
+    metadata = {
+        'model': model_name,
+        'training_seconds': round(training_seconds, 3),
+        'sample_size': len(training_features),
+        'trained_at': pd.Timestamp.now().isoformat(),
+    }
+    with open(f'{model_path}.json', 'w') as f:
+        json.dump(metadata, f, indent=2)
+    logger.info("Trained model", extra={'model': model_name, 'rows': len(training_features), 'training_seconds': round(training_seconds, 3)})
+    return metadata
+
+def _training_config(model_names: list) -> dict:
+    """
+    The settings that shape the trained models; a change retrains them.
+    """
+    return {
+        'models': list(model_names),
+        'feature_columns': FEATURE_COLUMNS,
+        'window': FEATURE_WINDOW_INTERVAL,
+        'horizon': TRAINING_HORIZON,
+        'max_rows': TRAINING_MAX_ROWS,
+        'seed': TRAINING_SAMPLE_SEED,
+        'compact_neighbor_models': NEIGHBOR_INDEX_COMPACT_MODELS,
+        'neighbor_leaf_size': NEIGHBOR_INDEX_LEAF_SIZE,
+        'lookup_table': [LOOKUP_TABLE_ENABLED, LOOKUP_TABLE_MAX_COUNTS, LOOKUP_TABLE_MAX_CELLS],
+    }
+
+def _retrain_reason(manifest: dict, config_fingerprint: str, force: bool):
+    """
+    Returns why the served version has to be replaced whatever the features,
+    or None when only changed features would justify retraining.
+    """
+    if force:
+        return 'forced'
+    if not manifest:
+        return 'no_models'
+    if manifest.get('config_fingerprint') != config_fingerprint:
+        return 'config_changed'
+    if pd.Timestamp.now(tz='UTC') - pd.Timestamp(manifest['created_at']) > pd.Timedelta(TRAINING_MAX_MODEL_AGE):
+        return 'max_age'
+    return None
+
+def _training_features_path(version: str) -> str:
+    return os.path.join(registry.version_dir(version), TRAINING_FEATURES_FILE)
+
+@pipeline_run('prepare_training', METRICS_TEXTFILE_PATH)
+def prepare_training_run(model_names: list = MODELS_TO_TRAIN, force: bool = False):
+    """
+    Decides whether the models need retraining and, if so, creates the new
+    registry version with its training features. Returns the run's details
+    for train_model_for_run and publish_training_run, or None to skip.
+
+    Training is skipped when the training configuration is unchanged and the
+    served version is younger than TRAINING_MAX_MODEL_AGE, if either the
+    features are unchanged since it was trained or their drift from its
+    training features is below TRAINING_DRIFT_THRESHOLD. The first check
+    reads no features.
+    """
+    engine = get_engine(DB_URI)
+    ensure_schema(engine)
+    with engine.connect() as connection:
+        features_fingerprint = get_pipeline_state(connection, FEATURES_FINGERPRINT_KEY)
+    config_fingerprint = fingerprint(_training_config(model_names))
+    current_version = registry.get_current_version()
+    manifest = registry.read_manifest(current_version) if current_version else {}
+    reason = _retrain_reason(manifest, config_fingerprint, force)
+
+    if reason is None and features_fingerprint is not None and manifest.get('features_fingerprint') == features_fingerprint:
+        logger.info("Features unchanged since the served models were trained, skipping training", extra={'version': current_version})
+        PIPELINE_SKIPS.labels(task=TASK_NAME, reason='unchanged').inc()
+        return None
+
+    logger.info("Reading recent features", extra={'horizon': TRAINING_HORIZON})
+    with PIPELINE_STAGE_SECONDS.labels(task=TASK_NAME, stage='load_features').time():
+        training_features = load_training_features(engine)
+    if training_features.empty:
+        logger.info("No recent features found, skipping training", extra={'horizon': TRAINING_HORIZON})
+        PIPELINE_SKIPS.labels(task=TASK_NAME, reason='no_features').inc()
+        return None
+
+    drift = None
+    if manifest.get('feature_profile'):
+        drift = population_stability_index(manifest['feature_profile'], training_features)
+        PIPELINE_FEATURE_DRIFT.set(drift)
+    if reason is None:
+        if drift is not None and drift < TRAINING_DRIFT_THRESHOLD:
+            logger.info("Feature drift below the threshold, skipping training", extra={
+                'version': current_version, 'drift': round(drift, 4), 'threshold': TRAINING_DRIFT_THRESHOLD})
+            PIPELINE_SKIPS.labels(task=TASK_NAME, reason='no_drift').inc()
+            return None
+        reason = 'drift'
+
+    PIPELINE_ROWS.labels(task=TASK_NAME).inc(len(training_features))
+    version = registry.create_version()
+    training_features.to_pickle(_training_features_path(version))
+    logger.info("Training new models", extra={'version': version, 'reason': reason, 'drift': drift, 'rows': len(training_features)})
+    return {
+        'version': version,
+        'models': list(model_names),
+        'reason': reason,
+        'config_fingerprint': config_fingerprint,
+        'features_fingerprint': features_fingerprint,
+        'feature_profile': feature_profile(training_features, TRAINING_DRIFT_BINS),
+        'feature_drift': drift,
+    }
+
+@pipeline_run('train_model', METRICS_TEXTFILE_PATH)
+def train_model_for_run(model_name: str, run: dict) -> dict:
+    """
+    Trains one model of a run prepared by prepare_training_run, on the
+    features saved with its version. Each model can train in its own task.
+    """
+    training_features = pd.read_pickle(_training_features_path(run['version']))
+    return _train_single_model(model_name, training_features, TRAINING_SAMPLE_SEED, run['version'])
+
+def _trigger_reload():
+    logger.info("Triggering model reload in the detection service")
     try:
-        engine = create_engine(DB_URI)
-        
-        print("Reading features from the database...")
-        features_df = pd.read_sql_table('features', engine, parse_dates=['timestamp'])
+        reload_url = f"{DETECTION_SERVICE_URL}/outlier/reload_models"
+        response = requests.post(reload_url, timeout=30)
+        response.raise_for_status() # Raises an exception for 4xx or 5xx status codes
+        logger.info("Triggered model reload", extra={'response': response.json()})
+    except requests.exceptions.RequestException as e:
+        logger.error("Could not trigger model reload in the detection service", extra={'error': str(e)})
+        # We don't re-raise this exception, as the training itself was successful.
+        # This is a notification failure, not a pipeline failure.
+
+@pipeline_run('publish_models', METRICS_TEXTFILE_PATH)
+def publish_training_run(run: dict, results: list):
+    """
+    Compiles the lookup table of a run's trained models, publishes its
+    version and triggers a model reload in the detection service.
+    """
+    version = run['version']
+    logger.info("All model training and saving complete")
+    for metadata in results:
+        # Models may train in worker processes, so their times are recorded here
+        PIPELINE_STAGE_SECONDS.labels(task=TASK_NAME, stage=f"train_{metadata['model']}").observe(metadata['training_seconds'])
+
+    lookup_table = None
+    if LOOKUP_TABLE_ENABLED:
+        logger.info("Compiling the decision lookup table")
+        with PIPELINE_STAGE_SECONDS.labels(task=TASK_NAME, stage='compile_lookup_table').time():
+            training_features = pd.read_pickle(_training_features_path(version))
+            models = {metadata['model']: FastModel.load(fast_model_path(registry.model_path(version, metadata['model']))) for metadata in results}
+            lookup_table = compile_lookup_table(
+                models, training_features, registry.version_dir(version), LOOKUP_TABLE_MAX_COUNTS, LOOKUP_TABLE_MAX_CELLS)
+    os.remove(_training_features_path(version))
+
+    # Publish the version only once every model file is in place
+    registry.write_manifest(version, {
+        'models': {metadata['model']: metadata for metadata in results},
+        'feature_columns': FEATURE_COLUMNS,
+        'training_horizon': TRAINING_HORIZON,
+        'lookup_table': lookup_table,
+        'training_reason': run['reason'],
+        'config_fingerprint': run['config_fingerprint'],
+        'features_fingerprint': run['features_fingerprint'],
+        'feature_profile': run['feature_profile'],
+        'feature_drift': run['feature_drift'],
+    })
+    registry.set_current_version(version)
+    registry.prune_versions()
+    logger.info("Published model version", extra={'version': version})
+
+    # --- Trigger Model Reload ---
+    _trigger_reload()
 
-        twenty_four_hours_ago = pd.Timestamp.now() - pd.Timedelta(days=1)
-        recent_features = features_df[features_df['timestamp'] >= twenty_four_hours_ago]
+@pipeline_run(TASK_NAME, METRICS_TEXTFILE_PATH)
+def train_outlier_models(model_names: list = MODELS_TO_TRAIN, workers: int = TRAINING_WORKERS, force: bool = False):
+    """
+    Trains multiple outlier detection models and then triggers a reload
+    in the running detection service, unless prepare_training_run finds
+    that the served models are still up to date (or force is set).
 
-        if recent_features.empty:
-            print("No recent features found in the last 24 hours. Skipping training.")
+    Each model is trained in its own experiment; with workers > 1 the models
+    train concurrently in a process pool.
+    """
+    try:
+        run = prepare_training_run(model_names, force)
+        if run is None:
             return
 
-        numeric_features = recent_features.select_dtypes(include=['number'])
-        
-        print(f"Setting up PyCaret anomaly detection experiment with {len(recent_features)} records...")
-        setup(data=numeric_features, verbose=False)
-
-        for model_name in model_names:
-            print(f"--- Training {model_name} model ---")
-            model = create_model(model_name)
-            
-            model_path = f'outlier_model_{model_name}'
-            print(f"Saving the trained model to {model_path}.pkl")
-            save_model(model, model_path)
-
-        print("All model training and saving complete.")
-        
-        # --- Trigger Model Reload ---
-        print("Triggering model reload in the detection service...")
-        try:
-            reload_url = f"{DETECTION_SERVICE_URL}/outlier/reload_models"
-            response = requests.post(reload_url, timeout=30)
-            response.raise_for_status() # Raises an exception for 4xx or 5xx status codes
-            print(f"Successfully triggered model reload: {response.json()}")
-        except requests.exceptions.RequestException as e:
-            print(f"Error: Could not trigger model reload in the detection service. Is it running? Details: {e}")
-            # We don't re-raise this exception, as the training itself was successful.
-            # This is a notification failure, not a pipeline failure.
+        workers = max(1, min(workers, len(model_names)))
+        logger.info("Training models", extra={'models': model_names, 'version': run['version'], 'workers': workers})
+        with PIPELINE_STAGE_SECONDS.labels(task=TASK_NAME, stage='train').time():
+            if workers == 1:
+                results = [train_model_for_run(name, run) for name in model_names]
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(train_model_for_run, name, run) for name in model_names]
+                    results = [future.result() for future in futures]
+
+        publish_training_run(run, results)
 
     except Exception as e:
-        print(f"An error occurred during model training: {e}")
+        logger.error("Model training failed", extra={'error': str(e)})
         raise
@@ -0,0 +1,143 @@
+import json
+import httpx
+from fastapi import FastAPI, Request, Response
+from fastapi.testclient import TestClient
+from app.cluster import HashRing, create_gateway
+
+def _fake_worker(worker: int, calls: list):
+    """
+    A detection worker that reports which worker scored each entry.
+    """
+    app = FastAPI()
+
+    @app.post("/outlier/detect")
+    async def detect(request: Request):
+        entry = json.loads(await request.body())
+        calls.append((worker, 'detect', [entry['ip_address']]))
+        return {"status": "success", "worker": worker, "log_entry": entry}
+
+    @app.post("/outlier/detect_batch")
+    async def detect_batch(request: Request):
+        entries = json.loads(await request.body())
+        calls.append((worker, 'detect_batch', [entry['ip_address'] for entry in entries]))
+        return {"status": "success", "model_version": "v1", "results": [{"worker": worker, "log_entry": entry} for entry in entries]}
+
+    @app.post("/outlier/detect_stream")
+    async def detect_stream(request: Request):
+        results = []
+        for line_number, line in enumerate((await request.body()).splitlines(), start=1):
+            try:
+                entry = json.loads(line)
+                results.append({"status": "success", "worker": worker, "log_entry": entry})
+            except ValueError:
+                results.append({"status": "error", "line": line_number, "detail": "invalid"})
+        calls.append((worker, 'detect_stream', [r['log_entry']['ip_address'] for r in results if r['status'] == 'success']))
+        return Response("".join(json.dumps(r) + "\n" for r in results), media_type="application/x-ndjson")
+
+    @app.post("/outlier/reload_models")
+    def reload_models():
+        calls.append((worker, 'reload_models', []))
+        return {"status": "success"}
+
+    @app.get("/outlier/models")
+    def models():
+        calls.append((worker, 'models', []))
+        return {"serving_version": "v1"}
+
+    @app.get("/metrics")
+    def metrics():
+        return Response(
+            '# HELP detect_entries_total Entries scored.\n# TYPE detect_entries_total counter\n'
+            f'detect_entries_total{{endpoint="detect"}} {worker + 1}.0\n'
+            '# HELP models_loaded Models loaded.\n# TYPE models_loaded gauge\n'
+            'models_loaded 3.0\n',
+            media_type="text/plain")
+
+    return app
+
+def _gateway(workers=3):
+    calls = []
+    transports = [httpx.ASGITransport(app=_fake_worker(worker, calls)) for worker in range(workers)]
+    return create_gateway(transports), calls
+
+def _entry(ip_address, code=200):
+    return {"timestamp": "2023-10-27T10:00:00Z", "ip_address": ip_address, "service_endpoint": "/api", "http_response_code": code}
+
+def test_hash_ring_is_stable_and_spreads_keys():
+    ring = HashRing([0, 1, 2, 3])
+    ips = [f"10.0.{i // 256}.{i % 256}" for i in range(4000)]
+    assignment = [ring.node_for(ip) for ip in ips]
+    assert assignment == [HashRing([0, 1, 2, 3]).node_for(ip) for ip in ips]
+    assert all(assignment.count(node) > 500 for node in range(4))
+
+    # Adding a worker only moves the keys that now belong to it
+    grown = HashRing([0, 1, 2, 3, 4])
+    assert all(before == after for before, after in zip(assignment, (grown.node_for(ip) for ip in ips)) if after != 4)
+
+def test_entries_of_an_ip_always_reach_the_same_worker():
+    gateway, calls = _gateway()
+    ips = [f"192.168.1.{i}" for i in range(20)]
+    with TestClient(gateway) as client:
+        workers = {ip: client.post("/outlier/detect", json=_entry(ip)).json()['worker'] for ip in ips}
+        batch = [_entry(ip) for ip in ips * 2]
+        results = client.post("/outlier/detect_batch", json=batch).json()['results']
+
+    assert len(set(workers.values())) > 1
+    # Results come back in input order, each scored by the IP's worker
+    assert [r['log_entry']['ip_address'] for r in results] == ips * 2
+    assert all(r['worker'] == workers[r['log_entry']['ip_address']] for r in results)
+    # One sub-batch per worker, keeping each IP's entries in order
+    batch_calls = [call for call in calls if call[1] == 'detect_batch']
+    assert len(batch_calls) == len(set(workers.values()))
+
+def test_ndjson_batches_are_split_too():
+    gateway, _ = _gateway()
+    body = "\n".join(json.dumps(_entry(f"10.1.1.{i}")) for i in range(10)) + "\n"
+    with TestClient(gateway) as client:
+        response = client.post("/outlier/detect_batch", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert [r['log_entry']['ip_address'] for r in response.json()['results']] == [f"10.1.1.{i}" for i in range(10)]
+
+def test_reload_is_broadcast_and_other_calls_go_to_one_worker():
+    gateway, calls = _gateway()
+    with TestClient(gateway) as client:
+        assert client.post("/outlier/reload_models").status_code == 200
+        assert client.get("/outlier/models").json() == {"serving_version": "v1"}
+    assert sorted(worker for worker, name, _ in calls if name == 'reload_models') == [0, 1, 2]
+    assert [worker for worker, name, _ in calls if name == 'models'] == [0]
+
+def test_streams_are_routed_per_line_and_keep_their_order():
+    gateway, _ = _gateway()
+    ips = [f"172.16.0.{i}" for i in range(12)]
+    lines = [json.dumps(_entry(ip)) for ip in ips]
+    lines.insert(5, "not json")
+    with TestClient(gateway) as client:
+        workers = {ip: client.post("/outlier/detect", json=_entry(ip)).json()['worker'] for ip in ips}
+        response = client.post("/outlier/detect_stream", content="\n".join(lines) + "\n", headers={"Content-Type": "application/x-ndjson"})
+        results = [json.loads(line) for line in response.text.splitlines()]
+
+        with client.websocket_connect("/outlier/detect_ws") as websocket:
+            websocket.send_text("\n".join(lines[:3]))
+            ws_results = [websocket.receive_json() for _ in range(3)]
+
+    assert results[5] == {"status": "error", "line": 6, "detail": "invalid"}
+    del results[5]
+    assert [r['log_entry']['ip_address'] for r in results] == ips
+    assert all(r['worker'] == workers[r['log_entry']['ip_address']] for r in results)
+    assert [r['log_entry']['ip_address'] for r in ws_results] == ips[:3]
+
+def test_metrics_are_merged_with_a_worker_label():
+    gateway, _ = _gateway(workers=2)
+    with TestClient(gateway) as client:
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.text.splitlines() == [
+        '# HELP detect_entries_total Entries scored.',
+        '# TYPE detect_entries_total counter',
+        'detect_entries_total{worker="0",endpoint="detect"} 1.0',
+        'detect_entries_total{worker="1",endpoint="detect"} 2.0',
+        '# HELP models_loaded Models loaded.',
+        '# TYPE models_loaded gauge',
+        'models_loaded{worker="0"} 3.0',
+        'models_loaded{worker="1"} 3.0',
+    ]
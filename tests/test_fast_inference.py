@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from unittest.mock import patch
+from pycaret.anomaly import load_model, predict_model
+from core import registry
+from core.fast_inference import FastModel, fast_model_path
+from core.windows import FEATURE_COLUMNS
+from dags.tasks.training import train_outlier_models
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def trained_models(tmp_path, monkeypatch):
+    """
+    Trains the models on synthetic features in a temporary directory, so the
+    saved .pkl and fast inference artifacts do not touch the project root.
+    """
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(42)
+    num_rows = 2000
+    features_df = pd.DataFrame({
+        'ip_address': rng.choice(['10.0.0.1', '10.0.0.2'], size=num_rows),
+        'timestamp': pd.Timestamp.now() - pd.to_timedelta(rng.integers(0, 3600, size=num_rows), unit='s'),
+        'request_count': rng.integers(1, 60, size=num_rows).astype(float),
+        'client_error_count': rng.integers(0, 10, size=num_rows).astype(float),
+        'server_error_count': rng.integers(0, 4, size=num_rows).astype(float),
+    })
+    engine = create_engine("sqlite:///:memory:")
+    features_df.to_sql('features', engine, index=False)
+
+    model_names = ['lof', 'iforest', 'knn']
+    with patch('dags.tasks.training.get_engine', return_value=engine), \
+         patch('dags.tasks.training.requests.post'):
+        train_outlier_models(model_names=model_names)
+    return model_names, features_df[FEATURE_COLUMNS]
+
+def test_fast_path_matches_predict_model(trained_models):
+    """
+    The fast inference artifact must reproduce predict_model's Anomaly and
+    Anomaly_Score on the training features.
+    """
+    model_names, training_features = trained_models
+    for model_name in model_names:
+        model_path = registry.model_path(registry.get_current_version(), model_name)
+        expected = predict_model(load_model(model_path, verbose=False), data=training_features)
+
+        fast_model = FastModel.load(fast_model_path(model_path))
+        anomalies, scores = fast_model.score(training_features[fast_model.columns].to_numpy(dtype=np.float64))
+
+        np.testing.assert_array_equal(anomalies, expected['Anomaly'].to_numpy())
+        np.testing.assert_allclose(scores, expected['Anomaly_Score'].to_numpy(), rtol=1e-6)
+
+def test_fast_path_imputes_missing_values(trained_models):
+    model_names, training_features = trained_models
+    fast_model = FastModel.load(fast_model_path(registry.model_path(registry.get_current_version(), model_names[0])))
+    features = training_features.head(5).to_numpy(dtype=np.float64)
+    features[0, 0] = np.nan
+    imputed = features.copy()
+    imputed[0, 0] = fast_model.fill_values[0]
+    np.testing.assert_array_equal(fast_model.score(features)[1], fast_model.score(imputed)[1])
+
+def test_inference_app_serves_without_pycaret(trained_models, tmp_path):
+    """
+    The inference-only app must load the fast artifacts at startup and answer
+    /outlier/detect without importing PyCaret, the Airflow tasks or requests.
+    """
+    script = (
+        "import sys\n"
+        "from fastapi.testclient import TestClient\n"
+        "from app.inference import app\n"
+        "with TestClient(app) as client:\n"
+        "    response = client.post('/outlier/detect', json={'timestamp': '2024-01-01T00:00:00Z', "
+        "'ip_address': '10.0.0.1', 'service_endpoint': '/api', 'http_response_code': 200})\n"
+        "    response.raise_for_status()\n"
+        "print(sorted([*response.json()['model_predictions'], *response.json()['skipped_models']]))\n"
+        "print([name for name in ('pycaret', 'requests', 'dags') if name in sys.modules])\n"
+    )
+    env = {**os.environ, 'PYTHONPATH': REPOSITORY_ROOT}
+    output = subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, check=True).stdout.splitlines()
+    model_names, _ = trained_models
+    assert output[-2:] == [str(sorted(model_names)), '[]']
@@ -0,0 +1,111 @@
+import threading
+import pytest
+from sqlalchemy import create_engine, text
+from app.services.log_writer import LogWriter, LogWriterFull
+from core.db import ensure_schema, get_engine
+
+def _rows(count, start=0):
+    return [(f'2023-01-01 10:00:{i % 60:02d}.000000', '10.0.0.1', '/home', 200) for i in range(start, start + count)]
+
+def _count_logs(engine):
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT COUNT(*) FROM logs")).scalar()
+
+def test_log_writer_writes_rows_in_batches(tmp_path):
+    engine = get_engine(f"sqlite:///{tmp_path / 'logs.db'}")
+    writer = LogWriter(engine_factory=lambda: engine, batch_size=100, flush_interval=0.05)
+    for start in range(0, 250, 50):
+        writer.submit(_rows(50, start))
+    assert writer.flush(timeout=10)
+    assert _count_logs(engine) == 250
+    writer.stop()
+
+def test_log_writer_flushes_on_stop(tmp_path):
+    engine = get_engine(f"sqlite:///{tmp_path / 'logs.db'}")
+    # Neither the size nor the time trigger fires before stop()
+    writer = LogWriter(engine_factory=lambda: engine, batch_size=1000, flush_interval=60)
+    writer.submit(_rows(10))
+    writer.stop(timeout=10)
+    assert _count_logs(engine) == 10
+
+def test_log_writer_applies_backpressure(tmp_path):
+    release = threading.Event()
+    engine = create_engine(f"sqlite:///{tmp_path / 'logs.db'}")
+    ensure_schema(engine)
+
+    def blocked_engine():
+        # Holds the writer thread until the test releases it
+        release.wait(10)
+        return engine
+
+    writer = LogWriter(engine_factory=blocked_engine, batch_size=10, flush_interval=0.01,
+                       max_pending_rows=20, enqueue_timeout=0.2)
+    writer.submit(_rows(20))
+    # The writer thread may already hold one batch in flight, so 10 to 20 rows are pending
+    with pytest.raises(LogWriterFull):
+        writer.submit(_rows(15))
+    release.set()
+    writer.submit(_rows(5))
+    writer.stop(timeout=10)
+    assert _count_logs(engine) == 25
+
+def test_log_writer_recovers_when_the_engine_cannot_be_created(tmp_path):
+    engine = get_engine(f"sqlite:///{tmp_path / 'logs.db'}")
+    attempts = []
+
+    def failing_engine():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("database unavailable")
+        return engine
+
+    writer = LogWriter(engine_factory=failing_engine, batch_size=10, flush_interval=0.01)
+    writer.submit(_rows(25))
+    assert writer.flush(timeout=10)
+    assert _count_logs(engine) == 25
+    assert len(attempts) == 3
+    writer.stop()
+
+def test_log_writer_reserves_room_before_submitting(tmp_path):
+    release = threading.Event()
+    engine = create_engine(f"sqlite:///{tmp_path / 'logs.db'}")
+    ensure_schema(engine)
+
+    def blocked_engine():
+        release.wait(10)
+        return engine
+
+    writer = LogWriter(engine_factory=blocked_engine, batch_size=10, flush_interval=0.01,
+                       max_pending_rows=20, enqueue_timeout=0.2)
+    with writer.reserve(15):
+        # The reserved room is not available to other submitters
+        with pytest.raises(LogWriterFull):
+            writer.submit(_rows(10))
+        writer.submit(_rows(15), reserved=True)
+    release.set()
+    writer.stop(timeout=10)
+    assert _count_logs(engine) == 15
+
+def test_log_writer_retries_failed_inserts_until_written(tmp_path):
+    engine = get_engine(f"sqlite:///{tmp_path / 'logs.db'}")
+    attempts = []
+
+    class FailingEngine:
+        def begin(self):
+            attempts.append(1)
+            if len(attempts) <= 4:
+                raise RuntimeError("database is locked")
+            return engine.begin()
+
+    # More consecutive failures than max_retries: the rows are still written, not dropped
+    writer = LogWriter(engine_factory=FailingEngine, batch_size=10, flush_interval=0.01, max_retries=2)
+    writer.submit(_rows(10))
+    assert writer.flush(timeout=30)
+    assert _count_logs(engine) == 10
+    writer.stop()
+
+def test_get_engine_is_shared_and_uses_wal(tmp_path):
+    db_uri = f"sqlite:///{tmp_path / 'wal.db'}"
+    assert get_engine(db_uri) is get_engine(db_uri)
+    with get_engine(db_uri).connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == 'wal'
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pyod.models.iforest import IForest
+from pyod.models.knn import KNN
+from pyod.models.lof import LOF
+from app.services.outlier_detector import ModelEnsemble, _score_features
+from core.fast_inference import ARTIFACT_FORMAT_VERSION, FastModel
+from core.lookup_table import DecisionLookupTable, compile_lookup_table
+from core.windows import FEATURE_COLUMNS
+
+@pytest.fixture
+def fast_models():
+    rng = np.random.default_rng(0)
+    requests = rng.poisson(8, size=400)
+    client_errors = rng.binomial(requests, 0.2)
+    server_errors = rng.binomial(requests - client_errors, 0.1)
+    training_features = pd.DataFrame(
+        np.column_stack([requests, client_errors, server_errors]).astype(np.float64), columns=FEATURE_COLUMNS)
+    models = {}
+    for name, estimator in [('lof', LOF()), ('iforest', IForest(random_state=0)), ('knn', KNN())]:
+        estimator.fit(training_features.to_numpy())
+        models[name] = FastModel({
+            'format_version': ARTIFACT_FORMAT_VERSION,
+            'columns': FEATURE_COLUMNS,
+            'fill_values': np.full(len(FEATURE_COLUMNS), np.nan),
+            'dtype': '<f8',
+            'estimator': estimator,
+            'threshold': float(estimator.threshold_),
+        })
+    return models, training_features
+
+def test_lookup_matches_live_scoring(fast_models, tmp_path):
+    models, training_features = fast_models
+    metadata = compile_lookup_table(models, training_features, str(tmp_path), max_counts=(1000, 200, 200), max_cells=10**6)
+    table = DecisionLookupTable.load(str(tmp_path))
+    assert metadata['shape'] == [int(v) + 1 for v in training_features.max()]
+    assert isinstance(table.scores, np.memmap)
+
+    # Inside the grid, outside it, and an impossible combination (more errors than requests)
+    features_df = pd.DataFrame(
+        [[1, 0, 0], [5, 1, 1], [12, 3, 0], [5000, 10, 10], [2, 2, 1]], columns=FEATURE_COLUMNS, dtype='float64')
+    covered, _, _, _ = table.lookup(features_df.to_numpy())
+    assert covered.tolist() == [True, True, True, False, False]
+
+    expected = _score_features(features_df, ModelEnsemble('live', models), full_scores=True)
+    actual = _score_features(features_df, ModelEnsemble('table', models, table), full_scores=True)
+    assert actual == expected
+
+def test_early_exit_decides_like_every_model(fast_models):
+    models, _ = fast_models
+    features_df = pd.DataFrame(
+        np.random.default_rng(1).poisson(lam=(8, 3, 2), size=(300, 3)), columns=FEATURE_COLUMNS, dtype='float64')
+    costs = {'lof': 3e-6, 'iforest': 1e-6, 'knn': 2e-6}
+    ensemble = ModelEnsemble('costs', models, costs=costs)
+    assert ensemble.evaluation_order == ['iforest', 'knn', 'lof']
+
+    full = _score_features(features_df, ensemble, full_scores=True)
+    results = _score_features(features_df, ensemble)
+
+    assert [r['final_decision']['is_anomaly'] for r in results] == [r['final_decision']['is_anomaly'] for r in full]
+    assert all(not r['skipped_models'] for r in full)
+    for result, full_result in zip(results, full):
+        # The cheapest two models always run, and lof only when they disagree
+        assert {'iforest', 'knn'} <= set(result['model_predictions'])
+        assert set(result['model_predictions']) | set(result['skipped_models']) == set(models)
+        votes = [full_result['model_predictions'][name]['is_anomaly'] for name in ('iforest', 'knn')]
+        assert result['skipped_models'] == ([] if votes[0] != votes[1] else ['lof'])
+        for name, prediction in result['model_predictions'].items():
+            assert prediction == full_result['model_predictions'][name]
+    assert any(r['skipped_models'] for r in results)
+
+    # One flag per row: only the flagged rows get every score
+    per_row = np.arange(len(features_df)) % 2 == 0
+    mixed = _score_features(features_df, ensemble, full_scores=per_row)
+    assert mixed[::2] == full[::2]
+    assert mixed[1::2] == results[1::2]
+
+def test_grid_above_max_cells_is_not_compiled(fast_models, tmp_path):
+    models, training_features = fast_models
+    assert compile_lookup_table(models, training_features, str(tmp_path), max_counts=(1000, 200, 200), max_cells=10) is None
+    assert DecisionLookupTable.load(str(tmp_path)) is None
@@ -0,0 +1,41 @@
+import json
+import logging
+from unittest.mock import patch
+import pytest
+from core.log import JsonFormatter, RateLimitFilter
+from core.metrics import pipeline_run
+
+def test_pipeline_run_records_the_outcome(tmp_path):
+    textfile = tmp_path / 'pipeline.prom'
+    with pipeline_run('test_task', str(textfile)):
+        pass
+    with pytest.raises(RuntimeError):
+        with pipeline_run('test_task'):
+            raise RuntimeError("failed")
+
+    rendered = textfile.read_text()
+    assert 'pipeline_runs_total{outcome="success",task="test_task"} 1.0' in rendered
+    assert 'pipeline_run_seconds_count{task="test_task"} 1.0' in rendered
+    assert 'pipeline_run_seconds_bucket{le="0.0005",task="test_task"}' in rendered
+
+def _record(message, **extra):
+    record = logging.LogRecord('outlier_detector.test', logging.INFO, __file__, 1, message, (), None)
+    record.__dict__.update(extra)
+    return record
+
+def test_json_formatter_includes_extra_fields():
+    entry = json.loads(JsonFormatter().format(_record("Cache miss", ip_address='10.0.0.1')))
+    assert entry['message'] == "Cache miss"
+    assert entry['level'] == 'INFO'
+    assert entry['ip_address'] == '10.0.0.1'
+
+def test_rate_limit_filter_reports_suppressed_records():
+    limiter = RateLimitFilter(limit=2, interval=10)
+    with patch('core.log.time.monotonic', return_value=100.0):
+        assert [limiter.filter(_record("Cache miss")) for _ in range(5)] == [True, True, False, False, False]
+        # Other messages have their own budget
+        assert limiter.filter(_record("Cache hit"))
+    with patch('core.log.time.monotonic', return_value=110.0):
+        record = _record("Cache miss")
+        assert limiter.filter(record)
+        assert record.suppressed == 3
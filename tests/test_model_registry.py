@@ -0,0 +1,98 @@
+import os
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+from core import registry
+from app.services import outlier_detector
+from app.services.outlier_detector import ModelEnsemble
+
+
+def _publish(registry_dir, model_names=('lof', 'iforest')):
+    version = registry.create_version(registry_dir)
+    registry.write_manifest(version, {'models': {name: {} for name in model_names}}, registry_dir)
+    registry.set_current_version(version, registry_dir)
+    return version
+
+def test_incomplete_versions_are_not_listed_or_published(tmp_path):
+    version = registry.create_version(str(tmp_path))
+    assert registry.list_versions(str(tmp_path)) == []
+    with pytest.raises(ValueError):
+        registry.set_current_version(version, str(tmp_path))
+
+def test_previous_version_and_rollback(tmp_path):
+    first = _publish(str(tmp_path))
+    second = _publish(str(tmp_path))
+    assert registry.get_current_version(str(tmp_path)) == second
+    assert registry.previous_version(str(tmp_path)) == first
+
+    registry.set_current_version(first, str(tmp_path))
+    assert registry.get_current_version(str(tmp_path)) == first
+    assert registry.previous_version(str(tmp_path)) is None
+
+def test_prune_keeps_newest_and_current_versions(tmp_path):
+    versions = [_publish(str(tmp_path)) for _ in range(4)]
+    registry.set_current_version(versions[0], str(tmp_path))
+    # Left behind by a failed training run two days ago
+    abandoned = registry.create_version(str(tmp_path))
+    two_days_ago = time.time() - 2 * 86400
+    os.utime(tmp_path / abandoned, (two_days_ago, two_days_ago))
+    # Still being written by another training run
+    in_progress = registry.create_version(str(tmp_path))
+    latest = registry.create_version(str(tmp_path))
+    registry.write_manifest(latest, {'models': {}}, str(tmp_path))
+
+    registry.prune_versions(keep=2, registry_dir=str(tmp_path), grace_period='1D')
+
+    assert registry.list_versions(str(tmp_path)) == [versions[0], versions[3], latest]
+    assert not (tmp_path / abandoned).exists()
+    assert (tmp_path / in_progress).exists()
+
+def test_swap_keeps_serving_old_ensemble_until_new_one_is_loaded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    old_ensemble = ModelEnsemble('old', {'lof': MagicMock()})
+    new_ensemble = ModelEnsemble('new', {'lof': MagicMock()})
+    monkeypatch.setattr(outlier_detector, 'ensemble', old_ensemble)
+
+    def build(version):
+        # The old ensemble is still active while the new one loads
+        assert outlier_detector.ensemble is old_ensemble
+        return new_ensemble
+
+    with patch.object(outlier_detector, '_build_ensemble', side_effect=build):
+        outlier_detector._reload_all_models('new', wait=True)
+    assert outlier_detector.ensemble is new_ensemble
+
+def test_rollback_moves_current_only_once_the_version_is_loaded(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    # The registry's default directory is relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    first = _publish(registry.MODEL_REGISTRY_DIR)
+    second = _publish(registry.MODEL_REGISTRY_DIR)
+    old_ensemble = ModelEnsemble(second, {'lof': MagicMock(), 'iforest': MagicMock()})
+    monkeypatch.setattr(outlier_detector, 'ensemble', old_ensemble)
+    client = TestClient(app)
+
+    # Only one of the version's two models loads: nothing changes
+    with patch.object(outlier_detector, '_build_ensemble', return_value=ModelEnsemble(first, {'lof': MagicMock()})):
+        assert client.post("/outlier/rollback_models").status_code == 500
+    assert registry.get_current_version() == second
+    assert outlier_detector.ensemble is old_ensemble
+
+    loaded = ModelEnsemble(first, {'lof': MagicMock(), 'iforest': MagicMock()})
+    with patch.object(outlier_detector, '_build_ensemble', return_value=loaded):
+        response = client.post("/outlier/rollback_models")
+    assert response.status_code == 200
+    assert response.json()['model_version'] == first
+    assert registry.get_current_version() == first
+    assert outlier_detector.ensemble is loaded
+
+def test_failed_reload_keeps_active_ensemble(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    old_ensemble = ModelEnsemble('old', {'lof': MagicMock()})
+    monkeypatch.setattr(outlier_detector, 'ensemble', old_ensemble)
+
+    with patch.object(outlier_detector, '_build_ensemble', return_value=ModelEnsemble('broken', {})):
+        with pytest.raises(Exception):
+            outlier_detector._reload_all_models('broken', wait=True)
+    assert outlier_detector.ensemble is old_ensemble
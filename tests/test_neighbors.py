@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from pyod.models.iforest import IForest
+from pyod.models.knn import KNN
+from pyod.models.lof import LOF
+from core.neighbors import CompactKNN, CompactLOF, compact_neighbor_model
+
+def _count_features(num_rows, seed):
+    # Small integer counts, like the window features: many duplicated rows and ties
+    return np.random.default_rng(seed).poisson(lam=(8, 2, 1), size=(num_rows, 3)).astype(np.float64)
+
+@pytest.mark.parametrize('method', ['largest', 'mean', 'median'])
+def test_compact_knn_scores_like_knn(method):
+    training_X, query_X = _count_features(5000, seed=1), _count_features(1000, seed=2)
+    estimator = KNN(method=method).fit(training_X)
+
+    compact = compact_neighbor_model(estimator, leaf_size=16)
+
+    assert isinstance(compact, CompactKNN)
+    assert compact.index.n_points == len(np.unique(training_X, axis=0)) < len(training_X)
+    np.testing.assert_allclose(compact.decision_function(query_X), estimator.decision_function(query_X), rtol=1e-12)
+
+def test_compact_lof_scores_like_lof_without_ties():
+    rng = np.random.default_rng(3)
+    training_X = rng.normal(size=(2000, 3))
+    # Duplicated rows, but no ties between distinct ones
+    training_X = np.vstack([training_X, training_X[:500]])
+    query_X = rng.normal(size=(500, 3))
+    estimator = LOF().fit(training_X)
+
+    compact = compact_neighbor_model(estimator, leaf_size=16)
+
+    assert isinstance(compact, CompactLOF)
+    assert compact.index.n_points == 2000
+    np.testing.assert_allclose(compact.decision_function(query_X), estimator.decision_function(query_X), rtol=1e-9)
+
+def test_compact_lof_does_not_depend_on_row_order():
+    training_X, query_X = _count_features(5000, seed=4), _count_features(1000, seed=5)
+    shuffled_X = training_X[np.random.default_rng(6).permutation(len(training_X))]
+
+    scores = compact_neighbor_model(LOF().fit(training_X), leaf_size=16).decision_function(query_X)
+    shuffled_scores = compact_neighbor_model(LOF().fit(shuffled_X), leaf_size=16).decision_function(query_X)
+
+    np.testing.assert_allclose(scores, shuffled_scores, rtol=1e-9)
+
+def test_other_estimators_are_not_compacted():
+    assert compact_neighbor_model(IForest(random_state=0).fit(_count_features(500, seed=7)), leaf_size=16) is None
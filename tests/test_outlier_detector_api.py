@@ -1,8 +1,12 @@
+import asyncio
+import json
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app  # Import the main FastAPI app
 from unittest.mock import patch, MagicMock
 import pandas as pd
+from core.windows import IPWindowState
+from app.services.outlier_detector import ModelEnsemble
 
 # Create a TestClient instance that will be used in all tests
 client = TestClient(app)
@@ -26,8 +30,9 @@ def mock_db_and_cache():
     Fixture to mock database interactions and the cache.
     This isolates the API endpoint logic from the database and cache layers.
     """
-    with patch('app.services.outlier_detector.create_engine') as mock_engine, \
-         patch('app.services.outlier_detector.get_recent_logs_with_caching', return_value=pd.DataFrame()) as mock_cache:
+    with patch('app.services.outlier_detector.get_engine') as mock_engine, \
+         patch('app.services.outlier_detector.log_writer'), \
+         patch('app.services.outlier_detector.get_window_state_with_caching', side_effect=lambda *args: IPWindowState(300 * 10**9)) as mock_cache:
         yield mock_engine, mock_cache
 
 def test_detect_outlier_endpoint(mock_pycaret_predict, mock_db_and_cache):
@@ -36,8 +41,8 @@ def test_detect_outlier_endpoint(mock_pycaret_predict, mock_db_and_cache):
     It verifies that the endpoint correctly processes a valid log entry,
     calls the prediction model, and returns the expected response structure.
     """
-    # Mock the loaded models dictionary to simulate that models are ready
-    with patch('app.services.outlier_detector.models', {'lof': MagicMock(), 'iforest': MagicMock()}):
+    # Mock the loaded model ensemble to simulate that models are ready
+    with patch('app.services.outlier_detector.ensemble', ModelEnsemble('test', {'lof': MagicMock(), 'iforest': MagicMock()})):
         
         log_payload = {
             "timestamp": "2023-10-27T10:00:00Z",
@@ -57,15 +62,23 @@ def test_detect_outlier_endpoint(mock_pycaret_predict, mock_db_and_cache):
         assert 'lof' in response_data['model_predictions']
         assert response_data['model_predictions']['lof']['score'] == '0.678'
 
+        # The request shows up in the per-endpoint and per-stage metrics
+        metrics = client.get("/metrics")
+        assert metrics.status_code == 200
+        assert metrics.headers['content-type'].startswith('text/plain')
+        assert 'outlier_detect_request_seconds_count{endpoint="detect"}' in metrics.text
+        assert 'outlier_detect_stage_seconds_bucket{le="+Inf",stage="features"}' in metrics.text
+        assert 'outlier_model_predict_seconds_count{model="lof"}' in metrics.text
+
 def test_detect_outlier_no_models_loaded(mock_db_and_cache):
     """
     Tests the behavior of the /outlier/detect endpoint when no models can be loaded.
     It should return a specific error message.
     """
-    # Patch the models dictionary to be empty AND patch the loading function
+    # Patch the ensemble to be empty AND patch the loading function
     # to prevent it from trying to load models from disk during the test.
-    with patch('app.services.outlier_detector.models', {}), \
-         patch('app.services.outlier_detector._load_models_if_needed'):
+    with patch('app.services.outlier_detector.ensemble', ModelEnsemble(None, {})), \
+         patch('app.services.outlier_detector.load_models_if_needed'):
         
         log_payload = {
             "timestamp": "2023-10-27T10:00:00Z",
@@ -76,10 +89,160 @@ def test_detect_outlier_no_models_loaded(mock_db_and_cache):
         
         response = client.post("/outlier/detect", json=log_payload)
         
-        # Assert that the response indicates an error because the models dict remains empty
+        # Assert that the response indicates an error because the ensemble remains empty
         assert response.status_code == 500
         assert "No models are loaded" in response.json()['detail']
 
+def test_models_are_loaded_off_the_event_loop(mock_db_and_cache):
+    """
+    When no models are served yet, the detection endpoints load them on the
+    threadpool, not on the event loop shared by every request.
+    """
+    on_event_loop = []
+
+    def load():
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+
+    log_payload = {"timestamp": "2023-10-27T10:00:00Z", "ip_address": "192.168.1.50", "service_endpoint": "/", "http_response_code": 200}
+    with patch('app.services.outlier_detector.ensemble', ModelEnsemble(None, {})), \
+         patch('app.services.outlier_detector.load_models_if_needed', side_effect=load):
+        assert client.post("/outlier/detect", json=log_payload).status_code == 500
+        assert client.post("/outlier/detect_batch", json=[log_payload]).status_code == 500
+        client.post("/outlier/detect_stream", content=json.dumps(log_payload) + "\n")
+    assert on_event_loop == [False, False, False]
+
+
+@pytest.fixture
+def mock_pycaret_predict_rows():
+    """
+    Fixture to mock 'predict_model' for multi-row input: every row with a server
+    error in its window is flagged.
+    """
+    def predict(model, data):
+        return pd.DataFrame({
+            'Anomaly': (data['server_error_count'] > 0).astype(int),
+            'Anomaly_Score': data['request_count'] / 10,
+        })
+    with patch('app.services.outlier_detector.predict_model', side_effect=predict) as mock:
+        yield mock
+
+def _batch_payload():
+    return [
+        {"timestamp": "2023-10-27T10:00:00Z", "ip_address": "10.0.0.1", "service_endpoint": "/home", "http_response_code": 200},
+        {"timestamp": "2023-10-27T10:00:05Z", "ip_address": "10.0.0.2", "service_endpoint": "/home", "http_response_code": 500},
+        {"timestamp": "2023-10-27T10:00:10Z", "ip_address": "10.0.0.1", "service_endpoint": "/login", "http_response_code": 404},
+        {"timestamp": "2023-10-27T10:06:00Z", "ip_address": "10.0.0.1", "service_endpoint": "/home", "http_response_code": 200},
+    ]
+
+def _assert_batch_results(response, mock_predict):
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert [r['log_entry']['ip_address'] for r in results] == ["10.0.0.1", "10.0.0.2", "10.0.0.1", "10.0.0.1"]
+    assert [r['features_calculated']['request_count'] for r in results] == [1.0, 1.0, 2.0, 1.0]
+    assert [r['features_calculated']['client_error_count'] for r in results] == [0.0, 0.0, 1.0, 0.0]
+    assert [r['final_decision']['is_anomaly'] for r in results] == [False, True, False, False]
+    assert results[2]['model_predictions']['lof']['score'] == '0.2'
+    # A single predict call per model for the whole batch
+    assert mock_predict.call_count == 2
+
+def test_detect_batch_endpoint_json(mock_pycaret_predict_rows, mock_db_and_cache):
+    with patch('app.services.outlier_detector.ensemble', ModelEnsemble('test', {'lof': MagicMock(), 'iforest': MagicMock()})):
+        response = client.post("/outlier/detect_batch", json=_batch_payload())
+        _assert_batch_results(response, mock_pycaret_predict_rows)
+
+def test_detect_batch_endpoint_ndjson(mock_pycaret_predict_rows, mock_db_and_cache):
+    with patch('app.services.outlier_detector.ensemble', ModelEnsemble('test', {'lof': MagicMock(), 'iforest': MagicMock()})):
+        body = "\n".join(json.dumps(entry) for entry in _batch_payload()) + "\n"
+        response = client.post("/outlier/detect_batch", content=body, headers={"Content-Type": "application/x-ndjson"})
+        _assert_batch_results(response, mock_pycaret_predict_rows)
+
+def test_detect_batch_skips_models_that_cannot_change_the_majority(mock_pycaret_predict_rows, mock_db_and_cache):
+    models = {'lof': MagicMock(), 'iforest': MagicMock()}
+    with patch('app.services.outlier_detector.ensemble', ModelEnsemble('test', models, costs={'lof': 2e-6, 'iforest': 1e-6})):
+        results = client.post("/outlier/detect_batch", json=_batch_payload()).json()['results']
+        full_results = client.post("/outlier/detect_batch?full_scores=true", json=_batch_payload()).json()['results']
+
+    # iforest is the cheaper model; its vote alone decides the entry with a server error
+    assert [r['skipped_models'] for r in results] == [[], ['lof'], [], []]
+    assert list(results[1]['model_predictions']) == ['iforest']
+    assert [r['final_decision'] for r in results][::2] == [r['final_decision'] for r in full_results][::2]
+    assert [r['final_decision']['is_anomaly'] for r in full_results] == [False, True, False, False]
+    assert all(not r['skipped_models'] and len(r['model_predictions']) == 2 for r in full_results)
+
+    metrics = client.get("/metrics").text
+    assert 'outlier_model_evaluations_skipped_total{model="lof"}' in metrics
+    assert 'outlier_model_seconds_saved_total{model="lof"}' in metrics
+
+def test_rejected_entries_are_not_counted_in_the_windows(mock_pycaret_predict_rows):
+    from app.services import outlier_detector
+    from app.services.log_writer import LogWriterFull
+    ip_address = "10.0.0.77"
+    payload = [{"timestamp": "2023-10-27T10:00:00Z", "ip_address": ip_address, "service_endpoint": "/home", "http_response_code": 500}]
+    with patch('app.services.outlier_detector.ensemble', ModelEnsemble('test', {'lof': MagicMock()})), \
+         patch('app.services.outlier_detector.get_engine'), \
+         patch.dict(outlier_detector.cache, {ip_address: IPWindowState(300 * 10**9)}), \
+         patch('app.services.outlier_detector.log_writer') as mock_writer:
+        mock_writer.reserve.side_effect = LogWriterFull("full")
+        assert client.post("/outlier/detect_batch", json=payload).status_code == 503
+        assert outlier_detector.cache[ip_address].counts() == (0, 0, 0)
+        mock_writer.submit.assert_not_called()
+
+        # The retry counts the entry once
+        mock_writer.reserve.side_effect = None
+        response = client.post("/outlier/detect_batch", json=payload)
+        assert response.json()['results'][0]['features_calculated']['request_count'] == 1.0
+        assert outlier_detector.cache[ip_address].counts() == (1, 0, 1)
+        mock_writer.reserve.assert_called_with(1)
+        assert mock_writer.submit.call_args.kwargs == {'reserved': True}
+
+def test_both_apps_serve_the_shared_metrics_route():
+    from app import inference
+    for served_app in (app, inference.app):
+        response = TestClient(served_app).get("/metrics")
+        assert response.status_code == 200
+        assert 'outlier_detect_request_seconds' in response.text
+
+def test_detection_service_rejects_the_parquet_backend():
+    from app.services.outlier_detector import check_storage_backend
+    check_storage_backend('sqlite')
+    with pytest.raises(RuntimeError, match="parquet"):
+        check_storage_backend('parquet')
+
+def test_detect_batch_rejects_invalid_entries(mock_db_and_cache):
+    with patch('app.services.outlier_detector.ensemble', ModelEnsemble('test', {'lof': MagicMock()})):
+        response = client.post("/outlier/detect_batch", json=[{"ip_address": "10.0.0.1"}])
+        assert response.status_code == 422
+
+def test_detect_stream_returns_results_in_order(mock_pycaret_predict_rows, mock_db_and_cache):
+    with patch('app.services.outlier_detector.ensemble', ModelEnsemble('test', {'lof': MagicMock(), 'iforest': MagicMock()})):
+        lines = [json.dumps(entry) for entry in _batch_payload()]
+        lines.insert(2, '{"ip_address": "10.0.0.9"}')
+        body = "\n".join(lines) + "\n\n"
+        response = client.post("/outlier/detect_stream", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [r['status'] for r in results] == ['success', 'success', 'error', 'success', 'success']
+    assert results[2]['line'] == 3
+    assert [r['log_entry']['ip_address'] for r in results if r['status'] == 'success'] == ["10.0.0.1", "10.0.0.2", "10.0.0.1", "10.0.0.1"]
+    assert all(r['model_version'] == 'test' for r in results if r['status'] == 'success')
+
+def test_detect_websocket_streams_results(mock_pycaret_predict_rows, mock_db_and_cache):
+    payload = _batch_payload()
+    with patch('app.services.outlier_detector.ensemble', ModelEnsemble('test', {'lof': MagicMock()})):
+        with client.websocket_connect("/outlier/detect_ws") as websocket:
+            # One entry per message, then the rest as NDJSON in a single message
+            websocket.send_text(json.dumps(payload[0]))
+            websocket.send_text("\n".join(json.dumps(entry) for entry in payload[1:]))
+            results = [websocket.receive_json() for _ in payload]
+
+    assert [r['status'] for r in results] == ['success'] * len(payload)
+    assert [r['log_entry']['timestamp'] for r in results] == [entry['timestamp'].replace('Z', '+00:00') for entry in payload]
+
 # To run these tests:
 # 1. Navigate to your project root in the terminal.
 # 2. Run the command: pytest
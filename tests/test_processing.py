@@ -1,6 +1,8 @@
 import pytest
+import numpy as np
 import pandas as pd
 from sqlalchemy import create_engine
+from core.storage import SQLiteStorage
 from dags.tasks.processing import process_log_data_from_db
 from unittest.mock import patch
 
@@ -36,10 +38,10 @@ def test_process_log_data_from_db(setup_test_database):
     """
     test_engine = setup_test_database
     
-    # Patch the 'create_engine' call within the 'processing' module.
+    # Patch the 'get_engine' call within the 'processing' module.
     # Force it to return the engine we already created and populated in our fixture.
-    with patch('dags.tasks.processing.create_engine', return_value=test_engine):
-        # Now, when this function calls create_engine, it will get our test_engine.
+    with patch('dags.tasks.processing.get_engine', return_value=test_engine):
+        # Now, when this function calls get_engine, it will get our test_engine.
         process_log_data_from_db()
 
     # Read the results from the 'features' table in our test database
@@ -64,3 +66,130 @@ def test_process_log_data_from_db(setup_test_database):
     assert entry_ip2['server_error_count'] == 0
     
     print("test_process_log_data_from_db passed successfully.")
+
+def _random_logs(num_rows, seed):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2023-01-01 10:00:00')
+    return pd.DataFrame({
+        'timestamp': start + pd.to_timedelta(np.sort(rng.integers(0, 4 * 3600, size=num_rows)), unit='s'),
+        'ip_address': rng.choice(['192.168.1.1', '192.168.1.2', '192.168.1.3'], size=num_rows),
+        'service_endpoint': rng.choice(['/home', '/api'], size=num_rows),
+        'http_response_code': rng.choice([200, 404, 500], size=num_rows, p=[0.8, 0.15, 0.05]),
+    })
+
+def _sorted_features(engine):
+    features_df = pd.read_sql_table('features', engine)
+    return features_df.sort_values(['ip_address', 'timestamp', 'request_count']).reset_index(drop=True)
+
+def test_incremental_runs_match_full_rebuild():
+    """
+    Processing the logs in several incremental runs must produce the same
+    'features' table as one full rebuild over all logs.
+    """
+    logs_df = _random_logs(3000, seed=11)
+    # Split inside a run of equal timestamps, so a later batch adds logs at the watermark
+    split = int(np.flatnonzero(logs_df['timestamp'].duplicated().to_numpy()[1500:])[0]) + 1500
+    batches = [logs_df.iloc[start:end] for start, end in zip([0, 1000, split, 2900], [1000, split, 2900, len(logs_df)])]
+
+    incremental_engine = create_engine("sqlite:///:memory:")
+    with patch('dags.tasks.processing.get_engine', return_value=incremental_engine):
+        for batch in batches:
+            batch.to_sql('logs', incremental_engine, if_exists='append', index=False)
+            process_log_data_from_db()
+        # A run without new logs must not change anything
+        process_log_data_from_db()
+
+    full_engine = create_engine("sqlite:///:memory:")
+    logs_df.to_sql('logs', full_engine, index=False)
+    with patch('dags.tasks.processing.get_engine', return_value=full_engine):
+        process_log_data_from_db(full_rebuild=True)
+
+    pd.testing.assert_frame_equal(_sorted_features(incremental_engine), _sorted_features(full_engine))
+
+def test_chunked_run_matches_in_memory_run():
+    """
+    Streaming the logs in small chunks must give exactly the same features as
+    processing all logs in one DataFrame.
+    """
+    logs_df = _random_logs(3000, seed=5)
+
+    chunked_engine = create_engine("sqlite:///:memory:")
+    logs_df.to_sql('logs', chunked_engine, index=False)
+    with patch('dags.tasks.processing.get_engine', return_value=chunked_engine):
+        process_log_data_from_db(full_rebuild=True, chunk_rows=97)
+
+    in_memory_engine = create_engine("sqlite:///:memory:")
+    logs_df.to_sql('logs', in_memory_engine, index=False)
+    with patch('dags.tasks.processing.get_engine', return_value=in_memory_engine):
+        process_log_data_from_db(full_rebuild=True, chunk_rows=None)
+
+    pd.testing.assert_frame_equal(_sorted_features(chunked_engine), _sorted_features(in_memory_engine))
+
+def test_failed_run_resumes_from_the_last_committed_chunk():
+    """
+    Every chunk is committed with its watermark: after a run fails midway, the
+    next run continues from the last committed chunk and the 'features' table
+    ends up as if the first run had succeeded.
+    """
+    logs_df = _random_logs(3000, seed=9)
+    engine = create_engine("sqlite:///:memory:")
+    logs_df.to_sql('logs', engine, index=False)
+    append_features = SQLiteStorage.append_features
+    calls = []
+
+    def failing_append_features(storage, connection, features_df):
+        calls.append(len(features_df))
+        if len(calls) == 3:
+            raise RuntimeError("disk full")
+        append_features(storage, connection, features_df)
+
+    with patch('dags.tasks.processing.get_engine', return_value=engine):
+        with patch.object(SQLiteStorage, 'append_features', failing_append_features):
+            with pytest.raises(RuntimeError):
+                process_log_data_from_db(full_rebuild=True, chunk_rows=500)
+        with engine.connect() as connection:
+            watermark = connection.exec_driver_sql("SELECT value FROM pipeline_state WHERE key = 'features_watermark'").scalar()
+            assert connection.exec_driver_sql("SELECT COUNT(*) FROM features").scalar() == calls[0] + calls[1] > 0
+        assert pd.Timestamp(watermark) == pd.Timestamp(sorted(logs_df['timestamp'])[999])
+        process_log_data_from_db(chunk_rows=500)
+
+    full_engine = create_engine("sqlite:///:memory:")
+    logs_df.to_sql('logs', full_engine, index=False)
+    with patch('dags.tasks.processing.get_engine', return_value=full_engine):
+        process_log_data_from_db(full_rebuild=True)
+
+    pd.testing.assert_frame_equal(_sorted_features(engine), _sorted_features(full_engine))
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_numpy_engine_matches_pandas_engine(workers):
+    """
+    The vectorized engine, alone or sharded over a process pool, must produce
+    exactly the same 'features' table as pandas rolling windows.
+    """
+    logs_df = _random_logs(3000, seed=8)
+
+    tables = {}
+    for feature_engine, engine_workers in (('pandas', 1), ('numpy', workers)):
+        engine = create_engine("sqlite:///:memory:")
+        logs_df.to_sql('logs', engine, index=False)
+        with patch('dags.tasks.processing.get_engine', return_value=engine):
+            process_log_data_from_db(full_rebuild=True, chunk_rows=None, feature_engine=feature_engine, workers=engine_workers)
+        tables[feature_engine] = pd.read_sql_table('features', engine)
+
+    pd.testing.assert_frame_equal(tables['numpy'], tables['pandas'])
+
+def test_unchanged_logs_skip_and_changed_window_rebuilds():
+    engine = create_engine("sqlite:///:memory:")
+    _random_logs(500, seed=5).to_sql('logs', engine, index=False)
+    with patch('dags.tasks.processing.get_engine', return_value=engine):
+        process_log_data_from_db()
+        with patch('core.storage.SQLiteStorage.iter_logs') as iter_logs:
+            process_log_data_from_db()
+        iter_logs.assert_not_called()
+
+        with patch('dags.tasks.processing.FEATURE_WINDOW_INTERVAL', '1min'), \
+             patch('core.storage.SQLiteStorage.begin_features') as begin_features:
+            process_log_data_from_db()
+        # A full rebuild starts without a watermark
+        begin_features.assert_called_once()
+        assert begin_features.call_args.args[1] is None
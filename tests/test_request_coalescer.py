@@ -0,0 +1,58 @@
+import threading
+import pytest
+from app.services.request_coalescer import RequestCoalescer
+
+def _recording_coalescer(**kwargs):
+    batches = []
+    def process_batch(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+    return RequestCoalescer(process_batch, **kwargs), batches
+
+def test_concurrent_items_are_scored_in_one_batch():
+    coalescer, batches = _recording_coalescer(max_batch_size=100, max_wait_ms=200)
+    futures = [coalescer.submit(i) for i in range(5)]
+    assert [future.result(timeout=5) for future in futures] == [0, 10, 20, 30, 40]
+    assert batches == [[0, 1, 2, 3, 4]]
+    coalescer.stop()
+
+def test_full_batch_is_not_held_back_and_split_at_max_size():
+    coalescer, batches = _recording_coalescer(max_batch_size=2, max_wait_ms=60000)
+    futures = [coalescer.submit(i) for i in range(4)]
+    assert [future.result(timeout=5) for future in futures] == [0, 10, 20, 30]
+    assert batches == [[0, 1], [2, 3]]
+    coalescer.stop()
+
+def test_stop_processes_waiting_items():
+    coalescer, batches = _recording_coalescer(max_batch_size=100, max_wait_ms=60000)
+    future = coalescer.submit(7)
+    coalescer.stop(timeout=5)
+    assert future.result(timeout=0) == 70
+
+def test_batch_error_is_raised_by_every_caller():
+    def process_batch(items):
+        raise RuntimeError("scoring failed")
+    coalescer = RequestCoalescer(process_batch, max_batch_size=100, max_wait_ms=50)
+    futures = [coalescer.submit(i) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="scoring failed"):
+            future.result(timeout=5)
+    coalescer.stop()
+
+def test_cancelled_items_are_skipped():
+    release = threading.Event()
+    batches = []
+    def process_batch(items):
+        batches.append(list(items))
+        release.wait(5)
+        return items
+    coalescer = RequestCoalescer(process_batch, max_batch_size=1, max_wait_ms=0)
+    first = coalescer.submit('first')
+    cancelled = coalescer.submit('cancelled')
+    last = coalescer.submit('last')
+    assert cancelled.cancel()
+    release.set()
+    assert first.result(timeout=5) == 'first'
+    assert last.result(timeout=5) == 'last'
+    assert 'cancelled' not in [item for batch in batches for item in batch]
+    coalescer.stop()
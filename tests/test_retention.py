@@ -0,0 +1,49 @@
+import pandas as pd
+from sqlalchemy import create_engine, text
+from unittest.mock import patch
+from core.db import ensure_schema
+from dags.tasks.retention import apply_log_retention
+
+def _setup_database():
+    engine = create_engine("sqlite:///:memory:")
+    ensure_schema(engine)
+    logs_df = pd.DataFrame({
+        'timestamp': pd.to_datetime([
+            '2023-01-01 10:00:10', '2023-01-01 10:00:50', '2023-01-01 10:01:30',
+            '2023-01-02 23:59:59', '2023-01-03 00:00:30', '2023-01-03 12:00:00',
+        ]),
+        'ip_address': ['10.0.0.1', '10.0.0.1', '10.0.0.1', '10.0.0.2', '10.0.0.2', '10.0.0.1'],
+        'service_endpoint': ['/home'] * 6,
+        'http_response_code': [200, 404, 500, 503, 200, 200],
+    })
+    logs_df.to_sql('logs', engine, if_exists='append', index=False)
+    logs_df[['ip_address', 'timestamp']].assign(request_count=1.0).to_sql('features', engine, index=False)
+    return engine
+
+def test_apply_log_retention_compacts_old_logs_into_rollups():
+    engine = _setup_database()
+    with patch('dags.tasks.retention.get_engine', return_value=engine):
+        apply_log_retention(cutoff=pd.Timestamp('2023-01-03 00:00:00'))
+
+    remaining_logs = pd.read_sql_table('logs', engine)
+    assert remaining_logs['timestamp'].min() >= pd.Timestamp('2023-01-03')
+    assert len(remaining_logs) == 2
+
+    rollups = pd.read_sql("SELECT * FROM log_rollups ORDER BY ip_address, minute", engine)
+    assert rollups[['ip_address', 'minute']].values.tolist() == [
+        ['10.0.0.1', '2023-01-01 10:00:00'], ['10.0.0.1', '2023-01-01 10:01:00'], ['10.0.0.2', '2023-01-02 23:59:00'],
+    ]
+    assert rollups['request_count'].tolist() == [2, 1, 1]
+    assert rollups['client_error_count'].tolist() == [1, 0, 0]
+    assert rollups['server_error_count'].tolist() == [0, 1, 1]
+
+    assert len(pd.read_sql_table('features', engine)) == 2
+
+def test_cache_miss_query_uses_ip_timestamp_index():
+    engine = _setup_database()
+    with engine.connect() as connection:
+        plan = connection.execute(text(
+            "EXPLAIN QUERY PLAN SELECT timestamp, http_response_code FROM logs "
+            "WHERE ip_address = :ip AND timestamp > :start AND timestamp <= :end ORDER BY timestamp"
+        ), {'ip': '10.0.0.1', 'start': '2023-01-01 10:00:00', 'end': '2023-01-01 10:05:00'}).fetchall()
+    assert any('ix_logs_ip_address_timestamp' in row[-1] for row in plan)
@@ -0,0 +1,49 @@
+import pandas as pd
+from sqlalchemy import create_engine, text
+from app.services.sample_data_generator import SampleDataGenerator
+from config import LOG_GENERATOR_BURST_REQUESTS
+from core.storage import SQLiteStorage
+
+START_TIME = pd.Timestamp('2024-01-01 00:00:00')
+
+def _generate(seed, bursts=0, chunk_rows=3000):
+    generator = SampleDataGenerator(num_ips=500, zipf_exponent=1.2, seed=seed)
+    planned = generator.plan_anomaly_bursts(bursts, START_TIME) if bursts else None
+    return list(generator.iter_log_chunks(10000, chunk_rows=chunk_rows, start_time=START_TIME, bursts=planned)), planned
+
+def test_chunks_are_seeded_bounded_and_time_ordered():
+    chunks, _ = _generate(seed=1)
+    logs_df = pd.concat(chunks, ignore_index=True)
+
+    assert [len(chunk) for chunk in chunks] == [3000, 3000, 3000, 1000]
+    assert logs_df['timestamp'].is_monotonic_increasing
+    assert logs_df['timestamp'].between(START_TIME, START_TIME + pd.Timedelta(days=1)).all()
+    pd.testing.assert_frame_equal(logs_df, pd.concat(_generate(seed=1)[0], ignore_index=True))
+    assert not logs_df.equals(pd.concat(_generate(seed=2)[0], ignore_index=True))
+
+    # Zipf traffic: the top IP sends far more than an even share
+    assert logs_df['ip_address'].value_counts().iloc[0] > 10 * len(logs_df) / 500
+
+def test_bursts_are_injected_with_their_ground_truth():
+    chunks, bursts = _generate(seed=3, bursts=4)
+    logs_df = pd.concat(chunks, ignore_index=True)
+
+    assert len(logs_df) == 10000 + 4 * LOG_GENERATOR_BURST_REQUESTS
+    assert logs_df['timestamp'].is_monotonic_increasing
+    for burst in bursts.itertuples(index=False):
+        in_burst = logs_df[(logs_df['ip_address'] == burst.ip_address)
+                           & logs_df['timestamp'].between(burst.start_time, burst.end_time)]
+        assert len(in_burst) >= burst.request_count
+
+def test_write_logs_sqlite_stores_rows_and_labels(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'logs.db'}")
+    chunks, bursts = _generate(seed=4, bursts=2)
+
+    storage = SQLiteStorage(engine)
+    storage.write_anomaly_bursts(bursts)
+    assert storage.write_logs(iter(chunks)) == sum(len(chunk) for chunk in chunks)
+    with engine.connect() as connection:
+        first = connection.execute(text("SELECT * FROM logs ORDER BY rowid LIMIT 1")).one()
+        assert connection.execute(text("SELECT COUNT(*) FROM anomaly_bursts")).scalar() == 2
+    assert first[0] == chunks[0]['timestamp'].iloc[0].strftime('%Y-%m-%d %H:%M:%S.%f')
+    assert first[3] == chunks[0]['http_response_code'].iloc[0]
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+from dags.tasks.sampling import StratifiedReservoirSampler, allocate_quotas
+
+def test_allocate_quotas_is_proportional_and_exact():
+    counts = pd.Series({'10.0.0.1': 700, '10.0.0.2': 200, '10.0.0.3': 95, '10.0.0.4': 5})
+    quotas = allocate_quotas(counts, 100)
+    assert quotas.sum() == 100
+    assert quotas.to_dict() == {'10.0.0.1': 70, '10.0.0.2': 20, '10.0.0.3': 10, '10.0.0.4': 0}
+    # Below the cap every row is kept
+    assert allocate_quotas(counts, 5000).equals(counts)
+
+def test_reservoir_sampler_respects_quotas_across_chunks():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'ip_address': rng.choice(['a', 'b', 'c'], size=5000, p=[0.6, 0.3, 0.1]),
+        'request_count': np.arange(5000, dtype=float),
+    })
+    quotas = allocate_quotas(df['ip_address'].value_counts(), 500)
+    sampler = StratifiedReservoirSampler(quotas, seed=1)
+    for start in range(0, len(df), 700):
+        sampler.add(df.iloc[start:start + 700])
+    sample = sampler.sample()
+
+    assert len(sample) == 500
+    assert sample['ip_address'].value_counts().to_dict() == quotas.to_dict()
+    # Sampled without replacement, from rows of the right IP
+    assert sample['request_count'].is_unique
+    merged = sample.merge(df, on='request_count', suffixes=('', '_original'))
+    assert (merged['ip_address'] == merged['ip_address_original']).all()
+
+def test_reservoir_sampler_is_reproducible():
+    df = pd.DataFrame({'ip_address': ['a'] * 100 + ['b'] * 100, 'request_count': np.arange(200, dtype=float)})
+    quotas = allocate_quotas(df['ip_address'].value_counts(), 20)
+    samples = []
+    for _ in range(2):
+        sampler = StratifiedReservoirSampler(quotas, seed=7)
+        sampler.add(df)
+        samples.append(sampler.sample())
+    pd.testing.assert_frame_equal(samples[0], samples[1])
@@ -0,0 +1,19 @@
+import asyncio
+from unittest.mock import patch
+from app.services.streaming import iter_lines
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+def _lines(*chunks):
+    async def collect():
+        return [line async for line in iter_lines(_chunks(*chunks))]
+    return asyncio.run(collect())
+
+def test_lines_are_split_across_chunks():
+    assert _lines(b'{"a": 1}\n{"b"', b': 2}\n', '{"c": 3}') == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+def test_long_lines_are_reported_without_being_buffered():
+    with patch('app.services.streaming.STREAM_MAX_LINE_BYTES', 8):
+        assert _lines(b'short\n0123456789', b'0123456789', b'tail\nnext\n', b'x' * 20 + b'\n') == [b'short', None, b'next', None]
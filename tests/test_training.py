@@ -0,0 +1,102 @@
+import json
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from unittest.mock import patch
+from core import registry
+from core.db import ensure_schema, set_pipeline_state
+from dags.tasks.fingerprints import feature_profile, population_stability_index
+from dags.tasks.processing import FEATURES_FINGERPRINT_KEY
+from dags.tasks.training import load_training_features, train_outlier_models
+
+def _setup_features(num_rows=3000):
+    rng = np.random.default_rng(3)
+    now = pd.Timestamp.now()
+    features_df = pd.DataFrame({
+        'ip_address': rng.choice(['10.0.0.1', '10.0.0.2', '10.0.0.3'], size=num_rows, p=[0.5, 0.3, 0.2]),
+        # A third of the rows are older than the training horizon
+        'timestamp': now - pd.to_timedelta(rng.integers(0, 36 * 3600, size=num_rows), unit='s'),
+        'request_count': rng.integers(1, 60, size=num_rows).astype(float),
+        'client_error_count': rng.integers(0, 10, size=num_rows).astype(float),
+        'server_error_count': rng.integers(0, 4, size=num_rows).astype(float),
+    })
+    engine = create_engine("sqlite:///:memory:")
+    features_df.to_sql('features', engine, index=False)
+    recent_df = features_df[features_df['timestamp'] >= now - pd.Timedelta('24h')]
+    return engine, recent_df
+
+def test_load_training_features_filters_horizon_and_samples_per_ip():
+    engine, recent_df = _setup_features()
+
+    all_recent = load_training_features(engine, max_rows=None)
+    assert len(all_recent) == len(recent_df)
+
+    sample = load_training_features(engine, max_rows=300)
+    assert len(sample) == 300
+    assert list(sample.columns) == ['request_count', 'client_error_count', 'server_error_count']
+
+def test_train_outlier_models_records_training_metadata(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    engine, recent_df = _setup_features()
+    with patch('dags.tasks.training.get_engine', return_value=engine), \
+         patch('dags.tasks.training.requests.post'):
+        train_outlier_models(model_names=['iforest', 'knn'], workers=2)
+
+    version = registry.get_current_version()
+    assert set(registry.read_manifest(version)['models']) == {'iforest', 'knn'}
+    assert registry.read_manifest(version)['lookup_table']['models'] == ['iforest', 'knn']
+    for model_name in ['iforest', 'knn']:
+        model_path = registry.model_path(version, model_name)
+        assert (tmp_path / f'{model_path}.pkl').exists()
+        metadata = json.loads((tmp_path / f'{model_path}.json').read_text())
+        assert metadata['model'] == model_name
+        assert metadata['sample_size'] == len(recent_df)
+        assert metadata['training_seconds'] > 0
+
+def test_population_stability_index_detects_shifts():
+    rng = np.random.default_rng(5)
+    reference = pd.DataFrame({'request_count': rng.poisson(20, size=5000).astype(float)})
+    profile = feature_profile(reference, bins=10)
+
+    same = pd.DataFrame({'request_count': rng.poisson(20, size=5000).astype(float)})
+    shifted = pd.DataFrame({'request_count': rng.poisson(30, size=5000).astype(float)})
+    assert population_stability_index(profile, same) < 0.1
+    assert population_stability_index(profile, shifted) > 0.25
+
+def _set_features_fingerprint(engine, value):
+    ensure_schema(engine)
+    with engine.begin() as connection:
+        set_pipeline_state(connection, FEATURES_FINGERPRINT_KEY, value)
+
+def test_training_is_skipped_while_models_are_up_to_date(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    engine, _ = _setup_features()
+    _set_features_fingerprint(engine, 'day-1')
+    with patch('dags.tasks.training.get_engine', return_value=engine), \
+         patch('dags.tasks.training.requests.post') as post:
+        train_outlier_models(model_names=['iforest'], workers=1)
+        first_version = registry.get_current_version()
+
+        # Unchanged features are not even read
+        with patch('dags.tasks.training.load_training_features') as load:
+            train_outlier_models(model_names=['iforest'], workers=1)
+        load.assert_not_called()
+
+        # New features from the same distribution
+        _set_features_fingerprint(engine, 'day-2')
+        train_outlier_models(model_names=['iforest'], workers=1)
+        assert registry.get_current_version() == first_version
+        assert post.call_count == 1
+
+        # Shifted features
+        features_df = pd.read_sql_table('features', engine)
+        features_df['request_count'] += 100
+        features_df.to_sql('features', engine, index=False, if_exists='replace')
+        train_outlier_models(model_names=['iforest'], workers=1)
+        assert registry.read_manifest(registry.get_current_version())['training_reason'] == 'drift'
+
+        # A changed configuration retrains without drift
+        train_outlier_models(model_names=['iforest', 'knn'], workers=1)
+        assert registry.read_manifest(registry.get_current_version())['training_reason'] == 'config_changed'
+        assert post.call_count == 3
+    assert not list(tmp_path.glob('model_registry/*/training_features.pkl'))
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from unittest.mock import patch
+from core.windows import FEATURE_COLUMNS, IPWindowState, error_flags, window_nanoseconds
+from dags.tasks.processing import process_log_data_from_db
+
+def _random_logs(num_rows=2000, seed=7):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2023-01-01 10:00:00')
+    return pd.DataFrame({
+        # Whole seconds over one hour, so that several IPs share timestamps
+        'timestamp': start + pd.to_timedelta(np.sort(rng.integers(0, 3600, size=num_rows)), unit='s'),
+        'ip_address': rng.choice(['10.0.0.1', '10.0.0.2', '10.0.0.3'], size=num_rows),
+        'service_endpoint': rng.choice(['/home', '/login'], size=num_rows),
+        'http_response_code': rng.choice([200, 404, 500], size=num_rows, p=[0.8, 0.15, 0.05]),
+    })
+
+def test_window_state_matches_feature_job():
+    """
+    Replaying the logs event by event through IPWindowState must give the same
+    features as the batch feature engineering job.
+    """
+    logs_df = _random_logs()
+    engine = create_engine("sqlite:///:memory:")
+    logs_df.to_sql('logs', engine, index=False)
+    with patch('dags.tasks.processing.get_engine', return_value=engine):
+        process_log_data_from_db()
+    expected = pd.read_sql_table('features', engine).sort_values(['ip_address', 'timestamp'], kind='stable')
+
+    states = {}
+    rows = []
+    client_errors, server_errors = error_flags(logs_df['http_response_code'])
+    for ts, ip, client_error, server_error in zip(logs_df['timestamp'], logs_df['ip_address'], client_errors, server_errors):
+        state = states.setdefault(ip, IPWindowState(window_nanoseconds('5min')))
+        rows.append((ip, ts, *state.add(ts.value, int(client_error), int(server_error))))
+    actual = pd.DataFrame(rows, columns=['ip_address', 'timestamp'] + FEATURE_COLUMNS)
+    actual = actual.sort_values(['ip_address', 'timestamp'], kind='stable')
+
+    for column in FEATURE_COLUMNS:
+        np.testing.assert_array_equal(actual[column].to_numpy(), expected[column].to_numpy())
+
+def test_window_state_evicts_aged_out_events():
+    state = IPWindowState(window_nanoseconds('5min'))
+    minute = 60 * 10**9
+    assert state.add(0, 1, 0) == (1, 1, 0)
+    assert state.add(1 * minute, 0, 1) == (2, 1, 1)
+    # The window is (t - 5min, t], so the first event drops out at exactly 5 minutes
+    assert state.add(5 * minute, 0, 0) == (2, 0, 1)
+    assert len(state) == 2
+
+def test_window_state_scores_late_event_at_its_own_timestamp():
+    state = IPWindowState(window_nanoseconds('5min'))
+    minute = 60 * 10**9
+    state.add(0, 0, 0)
+    state.add(4 * minute, 0, 0)
+    assert state.add(2 * minute, 1, 0) == (2, 1, 0)
+    assert state.counts() == (3, 1, 0)
+
+def test_window_state_extend_matches_add():
+    logs_df = _random_logs(num_rows=500, seed=3)
+    timestamps = logs_df['timestamp'].to_numpy().astype('int64')
+    client_errors, server_errors = error_flags(logs_df['http_response_code'])
+
+    one_by_one = IPWindowState(window_nanoseconds('5min'))
+    expected = np.array([one_by_one.add(int(t), int(c), int(s)) for t, c, s in zip(timestamps, client_errors, server_errors)])
+
+    batched = IPWindowState(window_nanoseconds('5min'))
+    actual = np.concatenate([
+        batched.extend(timestamps[start:start + 100], client_errors[start:start + 100], server_errors[start:start + 100])
+        for start in range(0, len(timestamps), 100)
+    ])
+    np.testing.assert_array_equal(actual, expected)
+    assert batched.counts() == one_by_one.counts()